@@ -1,10 +1,14 @@
-import asyncio
 import logging
+import uuid
+from collections import OrderedDict
 from aiogram import types
 from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from config import ADMIN_IDS, CHANNEL_ID
+from config import ADMIN_IDS, CHANNEL_ID, PROFILE_DEFAULT_SECONDS
 from database import db
+from analytics import stats_cache
+from callback_ack import MANUAL_ACK_FLAG
+from utils import format_statistics_message, escape_legacy_markdown
 
 logger = logging.getLogger(__name__)
 
@@ -72,19 +76,12 @@ async def admin_menu_show(callback: types.CallbackQuery):
 @admin_required
 async def show_admin_stats(callback: types.CallbackQuery):
     """Показать статистику бота"""
-    # Получение статистики из базы данных
-    total_users = await db.get_total_users_count()
-    premium_users = await db.get_premium_users_count()
-    total_purchases = await db.get_total_purchases_count()
-    total_revenue = await db.get_total_revenue()
-    
-    stats_text = (
-        "📊 **Статистика бота**\n\n"
-        f"👥 Всего пользователей: {total_users}\n"
-        f"🌟 Премиум пользователей: {premium_users}\n"
-        f"💰 Всего покупок: {total_purchases}\n"
-        f"⭐ Общий доход: {total_revenue} звезд\n"
-    )
+    # Снимок статистики в памяти: обновление не обращается к базе данных
+    report = await stats_cache.get()
+    stats_text = format_statistics_message(report)
+    stats_text += f"\n🕒 Сверено с базой: {stats_cache.as_of.strftime('%d.%m.%Y %H:%M:%S')} UTC"
+    if stats_cache.updated_at > stats_cache.as_of:
+        stats_text += f"\n⚡ Обновлено по событиям: {stats_cache.updated_at.strftime('%d.%m.%Y %H:%M:%S')} UTC"
     
     keyboard = InlineKeyboardBuilder()
     keyboard.button(text="🔄 Обновить", callback_data="admin_stats")
@@ -399,7 +396,8 @@ async def show_admin_search_user(callback_or_message):
     text = (
         "🔍 **Поиск пользователя**\n\n"
         "Для поиска пользователя используйте команду:\n"
-        "`/search_user <ID или username>`\n\n"
+        "`/search_user <ID, @username или имя>`\n\n"
+        "Поиск по username и имени не зависит от регистра и находит совпадения по началу строки.\n"
         "Вы получите информацию о пользователе и его подписках."
     )
     
@@ -469,6 +467,171 @@ async def show_admin_payment_stats(callback: types.CallbackQuery):
     )
     await callback.answer()
 
+# Постраничный поиск пользователей: токен страницы -> (запрос, курсор).
+# callback_data ограничена 64 байтами, поэтому курсор хранится на сервере
+SEARCH_PAGE_SIZE = 10
+_search_pages: "OrderedDict[str, tuple]" = OrderedDict()
+_SEARCH_PAGES_LIMIT = 1000
+
+def _remember_search_page(query: str, cursor: tuple) -> str:
+    token = uuid.uuid4().hex[:16]
+    _search_pages[token] = (query, cursor)
+    while len(_search_pages) > _SEARCH_PAGES_LIMIT:
+        _search_pages.popitem(last=False)
+    return token
+
+async def send_user_search_results(target, query: str, users: list, next_cursor: tuple = None):
+    """Показать страницу результатов поиска пользователей"""
+    # Имена и запрос экранируются: одиночный _ или * ломает разметку сообщения
+    if users:
+        text = f"🔍 **Результаты поиска** «{escape_legacy_markdown(query)}»:\n\n"
+        for user in users:
+            status = "✅" if user.is_subscription_active else "❌"
+            full_name = " ".join(filter(None, [user.first_name, user.last_name])) or "Без имени"
+            text += (
+                f"{status} {escape_legacy_markdown(full_name)} "
+                f"(@{escape_legacy_markdown(user.username) or 'без username'})\n"
+                f"ID: `{user.telegram_id}`\n\n"
+            )
+        text += "Подробнее: `/search_user <ID>`"
+    else:
+        text = f"❌ Пользователи по запросу «{escape_legacy_markdown(query)}» не найдены"
+    
+    keyboard = InlineKeyboardBuilder()
+    if next_cursor:
+        token = _remember_search_page(query, next_cursor)
+        keyboard.button(text="Далее ➡️", callback_data=f"admin_search_page:{token}")
+    keyboard.button(text="🔙 Назад", callback_data="admin_menu")
+    keyboard.adjust(1)
+    
+    if isinstance(target, types.CallbackQuery):
+        await target.message.edit_text(
+            text,
+            reply_markup=keyboard.as_markup(),
+            parse_mode="Markdown"
+        )
+        await target.answer()
+    else:
+        await target.reply(
+            text,
+            reply_markup=keyboard.as_markup(),
+            parse_mode="Markdown"
+        )
+
+@admin_required
+async def admin_search_page(callback: types.CallbackQuery):
+    """Следующая страница результатов поиска пользователей"""
+    token = callback.data.split(":", 1)[1]
+    page = _search_pages.pop(token, None)
+    if page is None:
+        await callback.answer("⌛ Результаты поиска устарели, повторите поиск", show_alert=True)
+        return
+    
+    query, cursor = page
+    users, next_cursor = await db.search_users(query, limit=SEARCH_PAGE_SIZE, cursor=cursor)
+    await send_user_search_results(callback, query, users, next_cursor)
+
+@admin_required
+async def admin_profile(message: types.Message):
+    """Профилирование процесса: /profile [секунды] [mem]"""
+    import profiler
+    from datetime import datetime
+    from aiogram.types import BufferedInputFile
+    
+    try:
+        seconds, memory = profiler.parse_profile_args(message.text, PROFILE_DEFAULT_SECONDS)
+    except ValueError:
+        await message.reply("Использование: /profile [секунды] [mem]")
+        return
+    if profiler.is_running():
+        await message.reply("⏳ Профилирование уже выполняется")
+        return
+    
+    await message.reply(
+        f"⏱ Профилирование на {seconds:g} с"
+        f"{' с отслеживанием памяти' if memory else ''}, отчет придет файлом"
+    )
+    try:
+        report = await profiler.profile(seconds, memory)
+    except (ValueError, profiler.ProfilerBusyError) as e:
+        await message.reply(f"❌ {e}")
+        return
+    
+    filename = f"profile-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.txt"
+    await message.answer_document(
+        BufferedInputFile(report.encode("utf-8"), filename=filename),
+        caption="📈 Отчет профилирования"
+    )
+
+@admin_required
+async def admin_deny(message: types.Message):
+    """Запрет оплаты: /deny <telegram_id> [причина]"""
+    from checkout import denylist
+    
+    args = (message.text or "").split(maxsplit=2)
+    if len(args) < 2 or not args[1].isdigit():
+        await message.reply("Использование: /deny <telegram_id> [причина]")
+        return
+    user_id = int(args[1])
+    added = await db.deny_user(user_id, args[2] if len(args) > 2 else None)
+    denylist.add(user_id)
+    if added:
+        await message.reply(f"🚫 Оплата запрещена для пользователя `{user_id}`", parse_mode="Markdown")
+    else:
+        await message.reply(f"Оплата для пользователя `{user_id}` уже запрещена", parse_mode="Markdown")
+
+@admin_required
+async def admin_allow(message: types.Message):
+    """Снятие запрета оплаты: /allow <telegram_id>"""
+    from checkout import denylist
+    
+    args = (message.text or "").split()
+    if len(args) < 2 or not args[1].isdigit():
+        await message.reply("Использование: /allow <telegram_id>")
+        return
+    user_id = int(args[1])
+    removed = await db.allow_user(user_id)
+    denylist.discard(user_id)
+    if removed:
+        await message.reply(f"✅ Запрет оплаты снят для пользователя `{user_id}`", parse_mode="Markdown")
+    else:
+        await message.reply(f"Для пользователя `{user_id}` запрета оплаты не было", parse_mode="Markdown")
+
+def _catalog_text(catalog) -> str:
+    lines = ["📦 **Каталог подписок**\n"]
+    for product in catalog:
+        lines.append(f"• `{product.id}` - {product.title}: {product.price} ⭐, {product.days} дней")
+    return "\n".join(lines)
+
+@admin_required
+async def admin_reload_catalog(message: types.Message):
+    """Загрузка каталога из базы без перезапуска: /reload_catalog"""
+    from catalog import get_catalog, reload_catalog
+    
+    try:
+        changed = await reload_catalog(db)
+    except ValueError as e:
+        await message.reply(f"❌ {e}")
+        return
+    status = "✅ Каталог обновлен" if changed else "Каталог не изменился"
+    await message.reply(f"{status}\n\n{_catalog_text(get_catalog())}", parse_mode="Markdown")
+
+@admin_required
+async def admin_set_price(message: types.Message):
+    """Изменение цены подписки: /set_price <id подписки> <цена в звездах>"""
+    from catalog import get_catalog, reload_catalog
+    
+    args = (message.text or "").split()
+    if len(args) != 3 or not args[2].isdigit() or int(args[2]) <= 0:
+        await message.reply("Использование: /set_price <id подписки> <цена в звездах>")
+        return
+    if not await db.set_product_price(args[1], int(args[2])):
+        await message.reply(f"❌ Подписка `{args[1]}` не найдена", parse_mode="Markdown")
+        return
+    # Этот процесс применяет цену сразу, остальные - при очередной загрузке каталога
+    await reload_catalog(db)
+    await message.reply(f"✅ Цена изменена\n\n{_catalog_text(get_catalog())}", parse_mode="Markdown")
+
 # Функции для регистрации обработчиков
 def register_admin_handlers(dp):
     """Регистрация административных обработчиков"""
@@ -477,6 +640,26 @@ def register_admin_handlers(dp):
     async def admin_command(message: types.Message):
         await admin_start(message)
     
+    @dp.message(Command("profile"))
+    async def admin_profile_command(message: types.Message):
+        await admin_profile(message)
+    
+    @dp.message(Command("reload_catalog"))
+    async def admin_reload_catalog_command(message: types.Message):
+        await admin_reload_catalog(message)
+    
+    @dp.message(Command("set_price"))
+    async def admin_set_price_command(message: types.Message):
+        await admin_set_price(message)
+    
+    @dp.message(Command("deny"))
+    async def admin_deny_command(message: types.Message):
+        await admin_deny(message)
+    
+    @dp.message(Command("allow"))
+    async def admin_allow_command(message: types.Message):
+        await admin_allow(message)
+    
     @dp.callback_query(lambda c: c.data == "admin_stats")
     async def admin_stats_callback(callback: types.CallbackQuery):
         await show_admin_stats(callback)
@@ -493,15 +676,17 @@ def register_admin_handlers(dp):
     async def admin_channel_callback(callback: types.CallbackQuery):
         await show_admin_channel(callback)
     
-    @dp.callback_query(lambda c: c.data == "admin_sync_channel")
+    # Обработчики, отвечающие alert после долгой работы, отвечают сами:
+    # после автоматического ответа alert пришел бы обычным сообщением
+    @dp.callback_query(lambda c: c.data == "admin_sync_channel", flags={MANUAL_ACK_FLAG: True})
     async def admin_sync_channel_callback(callback: types.CallbackQuery):
         await admin_sync_channel(callback)
     
-    @dp.callback_query(lambda c: c.data == "admin_cleanup_expired")
+    @dp.callback_query(lambda c: c.data == "admin_cleanup_expired", flags={MANUAL_ACK_FLAG: True})
     async def admin_cleanup_expired_callback(callback: types.CallbackQuery):
         await admin_cleanup_expired(callback)
     
-    @dp.callback_query(lambda c: c.data == "admin_subscribers_list")
+    @dp.callback_query(lambda c: c.data == "admin_subscribers_list", flags={MANUAL_ACK_FLAG: True})
     async def admin_subscribers_list_callback(callback: types.CallbackQuery):
         await admin_subscribers_list(callback)
     
@@ -517,7 +702,7 @@ def register_admin_handlers(dp):
     async def admin_broadcast_callback(callback: types.CallbackQuery):
         await show_admin_broadcast(callback)
     
-    @dp.callback_query(lambda c: c.data == "admin_export")
+    @dp.callback_query(lambda c: c.data == "admin_export", flags={MANUAL_ACK_FLAG: True})
     async def admin_export_callback(callback: types.CallbackQuery):
         await show_admin_export(callback)
     
@@ -525,31 +710,16 @@ def register_admin_handlers(dp):
     async def admin_search_user_callback(callback: types.CallbackQuery):
         await show_admin_search_user(callback)
     
+    @dp.callback_query(lambda c: c.data.startswith("admin_search_page:"))
+    async def admin_search_page_callback(callback: types.CallbackQuery):
+        await admin_search_page(callback)
+    
     @dp.callback_query(lambda c: c.data == "admin_payment_stats")
     async def admin_payment_stats_callback(callback: types.CallbackQuery):
         await show_admin_payment_stats(callback)
 
 # Дополнительные административные функции
 
-async def send_broadcast(bot, message_text: str, user_ids: list = None):
-    """Отправка рассылки пользователям"""
-    if user_ids is None:
-        user_ids = await db.get_all_user_ids()
-    
-    success_count = 0
-    error_count = 0
-    
-    for user_id in user_ids:
-        try:
-            await bot.send_message(user_id, message_text, parse_mode="Markdown")
-            success_count += 1
-            await asyncio.sleep(0.05)  # Задержка для избежания лимитов
-        except Exception as e:
-            error_count += 1
-            logger.warning(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
-    
-    return success_count, error_count
-
 async def export_users_data():
     """Экспорт данных пользователей в CSV формат"""
     users = await db.get_all_users()
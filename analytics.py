@@ -0,0 +1,220 @@
+import asyncio
+import copy
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from sqlalchemy import select, func
+from config import STATS_RECONCILE_SECONDS
+from database import db, read_only, User, Purchase, PurchaseRollup
+from events import UserRegistered, PaymentCommitted
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class StatisticsService:
+    """Статистика бота, вычисляемая агрегатными запросами на стороне базы данных.
+
+    Возвращает отчет в формате utils.calculate_statistics, но не загружает
+    пользователей и покупки в память: каждое значение считается запросом
+    по индексированным колонкам (created_at, premium_until, product_id).
+    Итоги за все время учитывают архив через purchase_rollups.
+    """
+
+    def __init__(self, database, top_products: int = 5):
+        self.database = database
+        self.top_products = top_products
+
+    @read_only(stale_ok=True)
+    async def get_report(self) -> Dict[str, Any]:
+        """Отчет для utils.format_statistics_message (читается с реплики, если она есть)"""
+        now = datetime.utcnow()
+        week_ago = now - timedelta(days=7)
+
+        async with self.database.read_session() as session:
+            total_users = (await session.execute(
+                select(func.count(User.id))
+            )).scalar() or 0
+            premium_users = (await session.execute(
+                select(func.count(User.id)).where(
+                    User.premium_until > now,
+                    User.is_premium == True
+                )
+            )).scalar() or 0
+            new_users_week = (await session.execute(
+                select(func.count(User.id)).where(User.created_at >= week_ago)
+            )).scalar() or 0
+
+            total_purchases, total_revenue = (await session.execute(
+                select(func.count(Purchase.id), func.coalesce(func.sum(Purchase.amount), 0))
+            )).one()
+            week_count, week_revenue = (await session.execute(
+                select(func.count(Purchase.id), func.coalesce(func.sum(Purchase.amount), 0))
+                .where(Purchase.created_at >= week_ago)
+            )).one()
+
+            # Товаров немного: продажи по всем товарам из горячей таблицы и итогов архива
+            products = {
+                product_id: [count, revenue or 0, None]
+                for product_id, count, revenue in (await session.execute(
+                    select(Purchase.product_id, func.count(Purchase.id), func.sum(Purchase.amount))
+                    .group_by(Purchase.product_id)
+                )).all()
+            }
+            for product_id, count, revenue, title in (await session.execute(
+                select(
+                    PurchaseRollup.product_id, func.sum(PurchaseRollup.count),
+                    func.sum(PurchaseRollup.revenue), func.max(PurchaseRollup.product_title)
+                ).group_by(PurchaseRollup.product_id)
+            )).all():
+                product = products.setdefault(product_id, [0, 0, None])
+                product[0] += count
+                product[1] += revenue
+                product[2] = title
+                total_purchases += count
+                total_revenue += revenue
+            top_rows = sorted(products.items(), key=lambda item: item[1][0], reverse=True)[:self.top_products]
+
+            # Название берем из последней покупки каждого товара одним запросом
+            product_ids = [product_id for product_id, _ in top_rows]
+            titles = dict((await session.execute(
+                select(Purchase.product_id, Purchase.product_title)
+                .where(Purchase.id.in_(
+                    select(func.max(Purchase.id))
+                    .where(Purchase.product_id.in_(product_ids))
+                    .group_by(Purchase.product_id)
+                ))
+            )).all()) if product_ids else {}
+            popular_products = [
+                (product_id, {'count': count, 'revenue': revenue, 'title': titles.get(product_id) or archived_title})
+                for product_id, (count, revenue, archived_title) in top_rows
+            ]
+
+        return {
+            'users': {
+                'total': total_users,
+                'premium': premium_users,
+                'premium_percentage': (premium_users / total_users * 100) if total_users > 0 else 0,
+                'new_week': new_users_week
+            },
+            'purchases': {
+                'total': total_purchases,
+                'revenue': total_revenue,
+                'week_count': week_count,
+                'week_revenue': week_revenue,
+                'avg_purchase': total_revenue / total_purchases if total_purchases > 0 else 0
+            },
+            'popular_products': popular_products
+        }
+
+class StatsCache:
+    """Снимок статистики в памяти с инкрементальным обновлением.
+
+    Регистрация и оплата обновляют снимок сразу (on_user_registered,
+    on_payment; подписка на события шины - subscribe), а reconcile периодически пересчитывает его запросами
+    StatisticsService: так исправляются значения, которые инкрементально
+    не поддерживаются (новые за неделю, истекшие премиумы), и события из
+    других процессов и реплик. Чтение снимка не обращается к базе; если
+    фоновая сверка не запущена (воркеры многопроцессного режима), снимок
+    пересчитывается при чтении, когда сверка просрочена вдвое.
+
+    as_of - время последнего полного пересчета по базе (расхождение с SQL
+    ищется относительно него), updated_at - время последнего изменения
+    снимка, в том числе инкрементального.
+    """
+
+    def __init__(self, service: StatisticsService, reconcile_seconds: int = STATS_RECONCILE_SECONDS):
+        self.service = service
+        self.reconcile_seconds = reconcile_seconds
+        self._report: Optional[Dict[str, Any]] = None
+        self.as_of: Optional[datetime] = None
+        self.updated_at: Optional[datetime] = None
+        self._reconciled_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _is_stale(self) -> bool:
+        return self._report is None or time.monotonic() - self._reconciled_at > self.reconcile_seconds * 2
+
+    async def get(self) -> Dict[str, Any]:
+        """Текущий снимок (считается запросами при первом обращении и если сверка просрочена)"""
+        if self._is_stale():
+            async with self._lock:
+                # Одновременные запросы ждут одного пересчета, а не выполняют его по очереди
+                if self._is_stale():
+                    await self._reconcile_locked()
+        metrics.inc("stats_cache.reads")
+        return self._report
+
+    async def reconcile(self):
+        """Пересчет снимка по базе данных"""
+        async with self._lock:
+            await self._reconcile_locked()
+
+    async def _reconcile_locked(self):
+        report = await self.service.get_report()
+        self._report = report
+        self.as_of = self.updated_at = datetime.utcnow()
+        self._reconciled_at = time.monotonic()
+        metrics.inc("stats_cache.reconciles")
+
+    def _recompute(self):
+        users = self._report['users']
+        users['premium_percentage'] = (users['premium'] / users['total'] * 100) if users['total'] > 0 else 0
+        purchases = self._report['purchases']
+        purchases['avg_purchase'] = purchases['revenue'] / purchases['total'] if purchases['total'] > 0 else 0
+        # as_of не меняется: он остается временем последней сверки с базой
+        self.updated_at = datetime.utcnow()
+
+    def subscribe(self, events):
+        """Обновление снимка по событиям регистрации и оплаты"""
+        events.subscribe(UserRegistered, lambda event: self.on_user_registered(),
+                         name="stats_cache.user_registered")
+        events.subscribe(PaymentCommitted,
+                         lambda event: self.on_payment(event.product_id, event.product_title, event.amount),
+                         name="stats_cache.payment")
+
+    def on_user_registered(self):
+        """Новый пользователь"""
+        if self._report is None:
+            return
+        report = copy.deepcopy(self._report)
+        report['users']['total'] += 1
+        report['users']['new_week'] += 1
+        self._report = report
+        self._recompute()
+
+    def on_payment(self, product_id: str, product_title: str, amount: int):
+        """Новая покупка"""
+        if self._report is None:
+            return
+        report = copy.deepcopy(self._report)
+        purchases = report['purchases']
+        purchases['total'] += 1
+        purchases['revenue'] += amount
+        purchases['week_count'] += 1
+        purchases['week_revenue'] += amount
+
+        products = dict(report['popular_products'])
+        # Продажи товара вне заполненного топа неизвестны до следующего reconcile
+        if product_id in products or len(products) < self.service.top_products:
+            product = products.setdefault(product_id, {'count': 0, 'revenue': 0, 'title': product_title})
+            product['count'] += 1
+            product['revenue'] += amount
+            report['popular_products'] = sorted(
+                products.items(), key=lambda item: item[1]['count'], reverse=True
+            )
+        self._report = report
+        self._recompute()
+
+# Глобальный сервис статистики и снимок для админ-панели
+stats_service = StatisticsService(db)
+stats_cache = StatsCache(stats_service)
+
+async def stats_reconcile_task(cache: StatsCache = stats_cache):
+    """Периодический пересчет снимка статистики (на каждой реплике и в каждом воркере)"""
+    while True:
+        await asyncio.sleep(cache.reconcile_seconds)
+        try:
+            await cache.reconcile()
+        except Exception as e:
+            logger.error(f"Ошибка пересчета статистики: {e}")
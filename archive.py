@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Перенос старых покупок в архив
+
+Покупки старше ARCHIVE_AFTER_DAYS переносятся из purchases в
+purchases_archive, а их количество и сумма - в итоги purchase_rollups.
+Горячая таблица остается небольшой, итоги за все время сохраняются.
+
+Запуск:
+    python archive.py
+    python archive.py --days 180
+"""
+
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_INTERVAL_HOURS
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Недельная статистика и экран платежей читают только горячую таблицу
+MIN_ARCHIVE_DAYS = 30
+
+async def archive_old_purchases(database, days: int = ARCHIVE_AFTER_DAYS,
+                                batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Перенос покупок старше days дней; возвращает число перенесенных"""
+    if days < MIN_ARCHIVE_DAYS:
+        raise ValueError(f"Архивировать можно покупки старше {MIN_ARCHIVE_DAYS} дней")
+    moved = await database.archive_purchases(datetime.utcnow() - timedelta(days=days), batch_size)
+    metrics.inc("archive.purchases.rows", moved)
+    logger.info("Архивация покупок старше %d дней завершена, перенесено: %d", days, moved)
+    return moved
+
+async def archive_purchases_task(database, days: int = ARCHIVE_AFTER_DAYS,
+                                 interval_hours: int = ARCHIVE_INTERVAL_HOURS):
+    """Периодическая архивация покупок (фоновая задача лидера)"""
+    while True:
+        try:
+            await archive_old_purchases(database, days)
+        except Exception as e:
+            logger.error("Ошибка при архивации покупок: %s", e)
+        await asyncio.sleep(interval_hours * 3600)
+
+async def _run(args):
+    from database import db, init_database
+
+    try:
+        await init_database()
+        print(await archive_old_purchases(db, args.days, args.batch_size))
+    finally:
+        await db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос старых покупок в архив")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS or 365)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from logging_setup import setup_logging
+
+    setup_logging()
+    asyncio.run(_run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,836 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарки производительности бота
+
+Запуск:
+    python benchmarks.py workers --max-workers 4 --updates 4000
+    python benchmarks.py stats --rows 100000 1000000
+    python benchmarks.py search --users 1000000
+    python benchmarks.py statements --calls 20000
+    python benchmarks.py callbacks --updates 400 --api-latency 0.05
+    python benchmarks.py logging --users 2000 --sink-latency 0.002
+    python benchmarks.py queries --budget 3
+    python benchmarks.py archive --rows 1000000 --keep-days 90
+    python benchmarks.py writes --writes 5000 --concurrency 200
+    python benchmarks.py replica --users 1000
+    python benchmarks.py warmup --users 1000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+# Бенчмарки не обращаются к Telegram, но config требует токен
+os.environ.setdefault("BOT_TOKEN", "42:BENCHMARK")
+
+def _cpu_bound_setup():
+    """Диспетчер с обработчиком, имитирующим CPU-нагрузку реальных хендлеров"""
+    from aiogram import Bot, Dispatcher, types
+
+    bot = Bot(token="42:BENCHMARK")
+    dp = Dispatcher()
+
+    @dp.callback_query()
+    async def render(callback: types.CallbackQuery):
+        # Рендеринг текста и сериализация, как при построении меню
+        rows = [
+            {"id": i, "title": f"Подписка {i}", "price": i * 100, "user": callback.from_user.id}
+            for i in range(200)
+        ]
+        text = "\n".join(f"{row['title']} - {row['price']} ⭐" for row in rows)
+        json.loads(json.dumps(rows, ensure_ascii=False))
+        return len(text)
+
+    return bot, dp
+
+def _synthetic_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+            "chat_instance": "bench",
+            "data": "subscriptions",
+        },
+    }
+
+async def _run_workers(workers: int, updates: int, users: int) -> float:
+    from workers import WorkerPool
+
+    pool = WorkerPool(workers, setup=_cpu_bound_setup, collect_results=True)
+    pool.start()
+    # Прогрев: запуск процессов не входит в измерение
+    for update_id in range(workers * 4):
+        await pool.dispatch(_synthetic_update(update_id, update_id))
+    await asyncio.sleep(3)
+
+    started = time.perf_counter()
+    for update_id in range(updates):
+        await pool.dispatch(_synthetic_update(update_id, update_id % users))
+    await pool.stop(timeout=300)
+    elapsed = time.perf_counter() - started
+
+    processed = sum(pool.results.get()[1] for _ in range(workers))
+    assert processed == updates + workers * 4, processed
+    return elapsed
+
+def bench_workers(args):
+    """Масштабирование многопроцессного режима от 1 до N воркеров"""
+    print(f"{'воркеров':>9} {'время, с':>9} {'обн./с':>9} {'ускорение':>10}")
+    baseline = None
+    for workers in range(1, args.max_workers + 1):
+        elapsed = asyncio.run(_run_workers(workers, args.updates, args.users))
+        throughput = args.updates / elapsed
+        baseline = baseline or throughput
+        print(f"{workers:>9} {elapsed:>9.2f} {throughput:>9.0f} {throughput / baseline:>9.2f}x")
+
+PRODUCTS = [
+    ("1_month", "Подписка на 1 месяц", 100),
+    ("3_months", "Подписка на 3 месяца", 250),
+    ("6_months", "Подписка на 6 месяцев", 450),
+    ("12_months", "Подписка на 12 месяцев", 800),
+]
+
+def _temp_database(**kwargs):
+    """Временная SQLite база для бенчмарка"""
+    from database import Database
+
+    directory = tempfile.mkdtemp(prefix="starsbot-bench-")
+    return Database(f"sqlite:///{os.path.join(directory, 'bench.db')}", **kwargs)
+
+async def _populate(database, users: int, purchases: int, chunk: int = 50000):
+    """Заполнение базы синтетическими пользователями и покупками"""
+    from sqlalchemy import insert
+    from database import User, Purchase, normalize_search_text
+
+    await database.create_tables()
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    async with database.async_session() as session:
+        for start in range(0, users, chunk):
+            rows = []
+            for i in range(start, min(start + chunk, users)):
+                created_at = now - timedelta(minutes=rng.randrange(0, 60 * 24 * 365))
+                is_premium = rng.random() < 0.1
+                username = f"user{i}"
+                first_name = rng.choice(["Иван", "Анна", "Пётр", "Мария", "Alex", "Kate"])
+                last_name = f"Фамилия{i % 1000}"
+                rows.append({
+                    "telegram_id": 100000 + i,
+                    "username": username,
+                    "first_name": first_name,
+                    "last_name": last_name,
+                    # Массовая вставка не вызывает валидаторы модели
+                    "username_lower": normalize_search_text(username),
+                    "first_name_lower": normalize_search_text(first_name),
+                    "last_name_lower": normalize_search_text(last_name),
+                    "is_premium": is_premium,
+                    "premium_until": now + timedelta(days=rng.randrange(-30, 30)) if is_premium else None,
+                    "created_at": created_at,
+                    "updated_at": created_at,
+                })
+            await session.execute(insert(User), rows)
+        for start in range(0, purchases, chunk):
+            rows = []
+            for i in range(start, min(start + chunk, purchases)):
+                product_id, title, amount = rng.choice(PRODUCTS)
+                rows.append({
+                    "user_id": 100000 + rng.randrange(users),
+                    "product_id": product_id,
+                    "product_title": title,
+                    "amount": amount,
+                    "telegram_payment_charge_id": f"charge{i}",
+                    "created_at": now - timedelta(minutes=rng.randrange(0, 60 * 24 * 365)),
+                })
+            await session.execute(insert(Purchase), rows)
+        await session.commit()
+
+async def _measure(coro_factory):
+    """Время и пиковая память корутины"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = await coro_factory()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+async def _bench_stats(rows: int):
+    from sqlalchemy import select
+    from analytics import StatisticsService
+    from database import Purchase
+    from utils import calculate_statistics
+
+    database = _temp_database()
+    await _populate(database, rows, rows)
+
+    async def in_memory():
+        users = await database.get_all_users()
+        async with database.async_session() as session:
+            purchases = (await session.execute(select(Purchase))).scalars().all()
+        return calculate_statistics(users, purchases)
+
+    service = StatisticsService(database)
+    old, old_time, old_peak = await _measure(in_memory)
+    new, new_time, new_peak = await _measure(service.get_report)
+    await database.close()
+
+    assert old["users"] == new["users"], (old["users"], new["users"])
+    assert old["purchases"]["total"] == new["purchases"]["total"]
+    return old_time, old_peak, new_time, new_peak
+
+def bench_stats(args):
+    """calculate_statistics в памяти против агрегатных запросов StatisticsService"""
+    print(f"{'строк':>9} {'calculate_statistics':>24} {'StatisticsService':>24}")
+    for rows in args.rows:
+        old_time, old_peak, new_time, new_peak = asyncio.run(_bench_stats(rows))
+        print(
+            f"{rows:>9} {old_time:>10.2f} с {old_peak / 2**20:>8.1f} МБ"
+            f" {new_time:>10.3f} с {new_peak / 2**20:>8.2f} МБ"
+        )
+
+async def _bench_archive(rows: int, keep_days: int, repeats: int):
+    from sqlalchemy import func, select
+    from analytics import StatisticsService
+    from database import ArchivedPurchase, Purchase
+
+    database = _temp_database()
+    await _populate(database, max(rows // 10, 1), rows)
+    service = StatisticsService(database)
+    today = datetime.utcnow().date()
+
+    queries = {
+        "доход за все время": database.get_total_revenue,
+        "покупок за все время": database.get_total_purchases_count,
+        "доход за сегодня": lambda: database.get_revenue_by_date(today),
+        "последние покупки": lambda: database.get_recent_purchases(10),
+        "отчет статистики": service.get_report,
+    }
+
+    async def run_all():
+        timings, results = {}, {}
+        for name, query in queries.items():
+            samples = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                results[name] = await query()
+                samples.append(time.perf_counter() - started)
+            timings[name] = sorted(samples)[len(samples) // 2]
+        return timings, results
+
+    before, before_results = await run_all()
+    started = time.perf_counter()
+    moved = await database.archive_purchases(datetime.utcnow() - timedelta(days=keep_days))
+    archive_seconds = time.perf_counter() - started
+    after, after_results = await run_all()
+
+    for name in ("доход за все время", "покупок за все время", "доход за сегодня"):
+        assert before_results[name] == after_results[name], (name, before_results[name], after_results[name])
+    assert before_results["отчет статистики"]["popular_products"] == after_results["отчет статистики"]["popular_products"]
+    async with database.async_session() as session:
+        hot = (await session.execute(select(func.count(Purchase.id)))).scalar()
+        archived = (await session.execute(select(func.count(ArchivedPurchase.id)))).scalar()
+    await database.close()
+    return before, after, moved, archive_seconds, hot, archived
+
+def bench_archive(args):
+    """Запросы к покупкам до и после переноса старых строк в архив"""
+    before, after, moved, archive_seconds, hot, archived = asyncio.run(
+        _bench_archive(args.rows, args.keep_days, args.repeats)
+    )
+    print(f"перенесено {moved} строк за {archive_seconds:.1f} с; в горячей таблице {hot}, в архиве {archived}")
+    print(f"{'запрос':>22} {'до, мс':>9} {'после, мс':>10}")
+    for name in before:
+        print(f"{name:>22} {before[name] * 1000:>9.2f} {after[name] * 1000:>10.2f}")
+
+async def _bench_search(users: int, repeats: int):
+    database = _temp_database()
+    await _populate(database, users, 0)
+
+    queries = ["user12345", "@user99", "иван", "ИВ", "фамилия42", "kate", "@nobody"]
+    results = {}
+    for query in queries:
+        await database.search_users(query)  # прогрев
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            page, cursor = await database.search_users(query)
+            timings.append((time.perf_counter() - started) * 1000)
+            # Следующая страница по курсору
+            if cursor:
+                started = time.perf_counter()
+                await database.search_users(query, cursor=cursor)
+                timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results[query] = (len(page), timings[len(timings) // 2], timings[int(len(timings) * 0.99)])
+    await database.close()
+    return results
+
+def bench_search(args):
+    """Задержка префиксного поиска пользователей (страница из 10 результатов)"""
+    results = asyncio.run(_bench_search(args.users, args.repeats))
+    print(f"{'запрос':>12} {'найдено':>8} {'p50, мс':>8} {'p99, мс':>8}")
+    for query, (found, p50, p99) in results.items():
+        print(f"{query:>12} {found:>8} {p50:>8.2f} {p99:>8.2f}")
+
+def _per_call_us(fn, calls: int) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return (time.perf_counter() - started) / calls * 1e6
+
+def _bench_statement_building(calls: int) -> dict:
+    """Стоимость построения конструкции и ключа кэша компиляции без обращения к БД"""
+    from sqlalchemy import select
+    from sqlalchemy.dialects import sqlite
+    from database import User, _USER_BY_TELEGRAM_ID
+
+    def inline(i):
+        select(User).where(User.telegram_id == i)._generate_cache_key()
+
+    def prebuilt(i):
+        _USER_BY_TELEGRAM_ID._generate_cache_key()
+
+    dialect = sqlite.dialect()
+
+    def compile_each_time(i):
+        _USER_BY_TELEGRAM_ID.compile(dialect=dialect)
+
+    return {
+        "select + ключ на каждый вызов": _per_call_us(inline, calls),
+        "готовый запрос (ключ запомнен)": _per_call_us(prebuilt, calls),
+        "компиляция SQL (промах кэша)": _per_call_us(compile_each_time, calls // 10),
+    }
+
+async def _bench_statements(calls: int):
+    from sqlalchemy import select
+    from database import User
+
+    database = _temp_database()
+    await _populate(database, 1000, 0)
+
+    async def inline_select(telegram_id):
+        # Прежний вариант: конструкция select собирается при каждом вызове
+        async with database.async_session() as session:
+            result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+            return result.scalar_one_or_none()
+
+    results = {}
+    for name, call in (("get_user, select на вызов", inline_select), ("get_user, готовый запрос", database.get_user)):
+        for tid in range(100000, 100100):  # прогрев
+            await call(tid)
+        started = time.perf_counter()
+        for i in range(calls):
+            await call(100000 + i % 1000)
+        results[name] = (time.perf_counter() - started) / calls * 1e6
+
+    stats = database.compiled_cache_stats()
+    await database.close()
+    return results, stats
+
+def bench_statements(args):
+    """Накладные расходы на построение и компиляцию горячих запросов"""
+    for name, per_call in _bench_statement_building(args.calls * 10).items():
+        print(f"{name:>32}: {per_call:8.1f} мкс/вызов")
+    results, stats = asyncio.run(_bench_statements(args.calls))
+    for name, per_call in results.items():
+        print(f"{name:>32}: {per_call:8.1f} мкс/вызов")
+    print(f"кэш компиляции: {stats['hit_rate']:.1%} попаданий ({stats['cache_hit']} / {stats['cache_miss']})")
+
+def _recording_session(api_latency: float):
+    """Сессия бота без сети: каждый вызов Bot API ждет api_latency и записывается"""
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import GetMe, SendMessage, EditMessageText
+    from aiogram.types import Chat, Message, User as TelegramUser
+
+    class RecordingSession(BaseSession):
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+
+        async def close(self):
+            pass
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls.append((time.perf_counter(), method))
+            await asyncio.sleep(api_latency)
+            if isinstance(method, GetMe):
+                return TelegramUser(id=42, is_bot=True, first_name="Bench", username="bench_bot")
+            if isinstance(method, (SendMessage, EditMessageText)):
+                return Message(message_id=1, date=int(time.time()), chat=Chat(id=1, type="private"), text="")
+            return True
+
+    return RecordingSession()
+
+def _callback_update(update_id: int, user_id: int, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "menu",
+            },
+        },
+    }
+
+async def _replay(dp, bot, updates, concurrency: int):
+    """Подача сырых обновлений в диспетчер с ограничением параллельности.
+
+    Возвращает время начала обработки каждого обновления по update_id.
+    """
+    from aiogram.types import Update
+
+    semaphore = asyncio.Semaphore(concurrency)
+    started = {}
+
+    async def feed(raw):
+        async with semaphore:
+            started[raw["update_id"]] = time.perf_counter()
+            await dp.feed_update(bot, Update.model_validate(raw, context={"bot": bot}))
+
+    await asyncio.gather(*(feed(raw) for raw in updates))
+    return started
+
+async def _bench_callbacks(updates: int, users: int, api_latency: float, grace: float):
+    from aiogram import Bot
+    from aiogram.methods import AnswerCallbackQuery, SendMessage
+    import admin
+    import bot as app
+    from callback_ack import setup_callback_ack
+    import database
+
+    database.db = _temp_database()
+    app.db = database.db
+    admin.db = database.db
+    await _populate(database.db, users, users * 2)
+
+    session = _recording_session(api_latency)
+    bot = Bot(token="42:BENCHMARK", session=session)
+    admin.register_admin_handlers(app.dp)
+    ack = setup_callback_ack(app.dp, bot, grace_seconds=grace)
+
+    rng = random.Random(1)
+    screens = ["subscriptions", "profile", "purchase_history", "info", "back_to_main"]
+    results = {}
+    for mode in ("без middleware", "с middleware"):
+        ack.enabled = mode != "без middleware"
+        session.calls.clear()
+        batch = [
+            _callback_update(update_id, 100000 + rng.randrange(users), rng.choice(screens))
+            for update_id in range(updates)
+        ]
+        started = await _replay(app.dp, bot, batch, concurrency=32)
+        latencies = sorted(
+            (at - started[int(method.callback_query_id)]) * 1000
+            for at, method in session.calls
+            if isinstance(method, AnswerCallbackQuery)
+        )
+        assert len(latencies) == updates, len(latencies)
+        results[mode] = (latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)])
+
+    # Экспорт дольше grace: его alert должен прийти alert-ом, а не сообщением
+    admin.ADMIN_IDS.append(100000)
+    session.calls.clear()
+    await _replay(app.dp, bot, [_callback_update(updates, 100000, "admin_export")], concurrency=1)
+    answers = [method for _, method in session.calls if isinstance(method, AnswerCallbackQuery)]
+    assert [answer.show_alert for answer in answers] == [True], answers
+    assert not any(isinstance(method, SendMessage) for _, method in session.calls)
+    await database.db.close()
+    return results
+
+def bench_callbacks(args):
+    """Воспринимаемая задержка: время от получения callback до ответа на него; проверка alert после долгой работы"""
+    results = asyncio.run(_bench_callbacks(args.updates, args.users, args.api_latency, args.grace))
+    print(f"задержка Bot API {args.api_latency * 1000:.0f} мс, grace {args.grace * 1000:.0f} мс")
+    print(f"{'режим':>16} {'p50, мс':>9} {'p99, мс':>9}")
+    for mode, (p50, p99) in results.items():
+        print(f"{mode:>16} {p50:>9.1f} {p99:>9.1f}")
+
+def _message_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+        },
+    }
+
+async def _bench_queries(users: int) -> dict:
+    from aiogram import Bot
+    import admin
+    import analytics
+    import bot as app
+    import database
+    from metrics import metrics
+    from query_accounting import setup_query_accounting
+
+    database.db = _temp_database()
+    app.db = database.db
+    admin.db = database.db
+    analytics.stats_service.database = database.db
+    await _populate(database.db, users, users * 2)
+    # Как при запуске бота: снимок статистики считается фоновой сверкой
+    await analytics.stats_cache.reconcile()
+
+    bot = Bot(token="42:BENCHMARK", session=_recording_session(0))
+    admin.register_admin_handlers(app.dp)
+    setup_query_accounting(app.dp, "metrics")
+    admin_id = 100000
+    admin.ADMIN_IDS.append(admin_id)
+
+    rng = random.Random(3)
+    batch = []
+    for update_id in range(200):
+        user_id = 100000 + rng.randrange(users)
+        kind = update_id % 4
+        if kind == 0:
+            batch.append(_message_update(update_id, user_id, "/start"))
+        elif kind == 1:
+            screen = rng.choice(["subscriptions", "profile", "purchase_history", "buy_1_month"])
+            batch.append(_callback_update(update_id, user_id, screen))
+        elif kind == 2:
+            batch.append(_message_update(update_id, admin_id, f"/search_user {user_id}"))
+        else:
+            batch.append(_callback_update(update_id, admin_id, "admin_stats"))
+    await _replay(app.dp, bot, batch, concurrency=8)
+    await database.db.close()
+
+    timings = metrics.snapshot()["timings"]
+    return {
+        name[len("db.queries."):]: timing
+        for name, timing in timings.items() if name.startswith("db.queries.")
+    }
+
+def bench_queries(args):
+    """Число запросов к базе на обновление по обработчикам; код 1, если превышен бюджет"""
+    results = asyncio.run(_bench_queries(args.users))
+    print(f"{'обработчик':>28} {'обновлений':>10} {'среднее':>8} {'максимум':>8}")
+    exceeded = []
+    for name, timing in sorted(results.items()):
+        print(f"{name:>28} {timing['count']:>10} {timing['avg']:>8.1f} {timing['max']:>8.0f}")
+        if timing["max"] > args.budget:
+            exceeded.append(name)
+    if exceeded:
+        print(f"превышен бюджет {args.budget} запросов: {', '.join(exceeded)}")
+        raise SystemExit(1)
+
+async def _bench_writes(single_writer: bool, writes: int, users: int, concurrency: int) -> dict:
+    database = _temp_database(single_writer=single_writer)
+    await _populate(database, users, 0)
+    rng = random.Random(11)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], {}
+
+    async def write(i: int):
+        # Как во всплеске после рассылки: /start новых и старых пользователей и оплаты
+        user_id = 100000 + rng.randrange(users * 2)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if i % 5 == 0:
+                    await database.record_payment(
+                        user_id, "1_month", "Подписка на 1 месяц", 100, 30, f"burst{i}",
+                        effects=(("grant_channel_access", {"user_id": user_id}, f"grant:burst{i}"),)
+                    )
+                else:
+                    await database.create_or_update_user(user_id, f"user{user_id}", "Burst")
+            except Exception as e:
+                name = type(e).__name__
+                errors[name] = errors.get(name, 0) + 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(write(i) for i in range(writes)))
+    elapsed = time.perf_counter() - started
+    await database.close()
+
+    latencies.sort()
+    return {
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "p50": latencies[len(latencies) // 2] if latencies else 0.0,
+        "p99": latencies[int(len(latencies) * 0.99)] if latencies else 0.0,
+        "errors": errors,
+    }
+
+def bench_writes(args):
+    """Всплеск одновременных записей в SQLite: пул соединений против единственного писателя"""
+    print(f"{'режим':>18} {'записей/с':>10} {'p50, мс':>8} {'p99, мс':>9} {'время, с':>9}  ошибки")
+    for single_writer in (False, True):
+        result = asyncio.run(_bench_writes(single_writer, args.writes, args.users, args.concurrency))
+        print(
+            f"{'писатель SQLite' if single_writer else 'пул соединений':>18}"
+            f" {result['throughput']:>10.0f} {result['p50'] * 1000:>8.1f} {result['p99'] * 1000:>9.1f}"
+            f" {result['seconds']:>9.2f}  {result['errors'] or '-'}"
+        )
+
+async def _bench_replica(users: int) -> list:
+    from sqlalchemy import event
+    from database import Database, read_only
+
+    # Основная база и отстающая реплика - два файла SQLite
+    directory = tempfile.mkdtemp(prefix="starsbot-bench-")
+    primary_path = os.path.join(directory, "primary.db")
+    replica_path = os.path.join(directory, "replica.db")
+    replica = Database(f"sqlite:///{replica_path}")
+    await _populate(replica, users // 2, 0)
+    await replica.close()
+    database = Database(f"sqlite:///{primary_path}", replica_url=f"sqlite:///{replica_path}")
+    await _populate(database, users, 0)
+
+    statements = {"primary": 0, "replica": 0}
+
+    def counter(name):
+        def count(*args):
+            statements[name] += 1
+        return count
+
+    event.listen(database.engine.sync_engine, "before_cursor_execute", counter("primary"))
+    event.listen(database.replica_engine.sync_engine, "before_cursor_execute", counter("replica"))
+
+    class Report:
+        def __init__(self, database):
+            self.database = database
+
+        @read_only(stale_ok=True)
+        async def users_count(self):
+            return await self.database.get_total_users_count()
+
+        @read_only(stale_ok=True)
+        async def newest_user(self):
+            return await self.database.get_user(100000 + users - 1)
+
+    report = Report(database)
+
+    async def lose_replica():
+        # Файл реплики пропадает: новые соединения видят пустую базу
+        await database.replica_engine.dispose()
+        os.remove(replica_path)
+
+    # (сценарий, вызов, результат, ожидаемые запросы к основной базе и к реплике)
+    scenarios = [
+        ("stale_ok=True", database.get_total_users_count, users // 2, (0, 1)),
+        ("stale_ok=False", lambda: database.get_user(100000 + users - 1), True, (1, 0)),
+        ("stale_ok=False внутри True", report.newest_user, True, (1, 0)),
+        ("отказ реплики", lose_replica, None, (0, 0)),
+        ("ошибка во вложенном вызове", report.users_count, users, (1, 1)),
+        ("реплика исключена", database.get_total_users_count, users, (1, 0)),
+    ]
+    results = []
+    for name, call, expected, expected_statements in scenarios:
+        statements.update(primary=0, replica=0)
+        value = await call()
+        if expected is True:
+            value = value is not None
+        results.append((name, value, expected, (statements["primary"], statements["replica"]), expected_statements))
+    await database.close()
+    return results
+
+def bench_replica(args):
+    """Чтение с реплики и переход на основную базу на двух файлах SQLite; код 1 при ошибке"""
+    print(f"{'сценарий':>28} {'результат':>10} {'ожидается':>10} {'основная/реплика':>17}")
+    failed = False
+    for name, value, expected, actual, expected_statements in asyncio.run(_bench_replica(args.users)):
+        ok = value == expected and actual == expected_statements
+        failed = failed or not ok
+        print(
+            f"{name:>28} {str(value):>10} {str(expected):>10}"
+            f" {f'{actual[0]}/{actual[1]}':>17}{'' if ok else f'  ожидалось {expected_statements[0]}/{expected_statements[1]}'}"
+        )
+    if failed:
+        raise SystemExit(1)
+
+async def _bench_warmup(users: int) -> tuple:
+    from warmup import _compile_hot_statements
+
+    database = _temp_database()
+    await _populate(database, users, users)
+    executed = await _compile_hot_statements(database)
+
+    user_id = 100000 + users // 2
+    hot = [
+        ("get_user", lambda: database.get_user(user_id)),
+        ("get_user_by_username", lambda: database.get_user_by_username(f"@user{users // 2}")),
+        ("get_user_purchases", lambda: database.get_user_purchases(user_id)),
+        ("search_users @username", lambda: database.search_users("@user1", limit=10)),
+        # Совпадение только по фамилии: выполняются запросы по всем трем полям
+        ("search_users", lambda: database.search_users("Фамилия1", limit=10)),
+    ]
+    results = []
+    for name, call in hot:
+        before = database.compiled_cache_stats()["cache_miss"]
+        await call()
+        results.append((name, database.compiled_cache_stats()["cache_miss"] - before))
+    await database.close()
+    return executed, results
+
+def bench_warmup(args):
+    """Промахи кэша SQL у горячих запросов после прогрева; код 1, если прогрев не покрыл запрос"""
+    executed, results = asyncio.run(_bench_warmup(args.users))
+    print(f"прогрев выполнил запросов: {executed}")
+    print(f"{'запрос':>24} {'промахов кэша':>14}")
+    for name, misses in results:
+        print(f"{name:>24} {misses:>14}")
+    if not executed or any(misses for _, misses in results):
+        raise SystemExit(1)
+
+class _SlowStream:
+    """Поток вывода, каждая запись в который занимает latency секунд (медленный диск или pipe)"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.lines = 0
+
+    def write(self, text: str):
+        time.sleep(self.latency)
+        self.lines += text.count("\n")
+
+    def flush(self):
+        pass
+
+async def _broadcast_with_lag_probe(users: int) -> tuple:
+    """Рассылка пользователям, заблокировавшим бота, с замером задержек цикла событий"""
+    from aiogram import Bot
+    from aiogram.exceptions import TelegramForbiddenError
+    from broadcast import Broadcast
+
+    database = _temp_database()
+    await _populate(database, users, 0)
+
+    session = _recording_session(0)
+
+    async def blocked(bot, method, timeout=None):
+        await asyncio.sleep(0.001)  # сетевой запрос
+        raise TelegramForbiddenError(method=method, message="Forbidden: bot was blocked by the user")
+
+    session.make_request = blocked
+    bot = Bot(token="42:BENCHMARK", session=session)
+
+    lags = []
+    done = asyncio.Event()
+
+    async def probe():
+        # Тик каждую миллисекунду: опоздание тика - время, когда цикл был занят
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - started - 0.001)
+
+    probe_task = asyncio.create_task(probe())
+    started = time.perf_counter()
+    # Без паузы между отправками: замеряется время на запросы и логирование
+    await Broadcast(bot, database, "broadcast:bench", "Новости канала", 0, rate=float("inf")).run()
+    elapsed = time.perf_counter() - started
+    done.set()
+    await probe_task
+    await database.close()
+    return elapsed, sum(lag for lag in lags if lag > 0), max(lags)
+
+def bench_logging(args):
+    """Блокировка цикла событий логированием во время рассылки при медленном выводе логов"""
+    import logging
+    from logging_setup import setup_logging, stop_logging
+
+    root = logging.getLogger()
+    print(f"{'логирование':>24} {'рассылка, с':>12} {'цикл занят, с':>14} {'макс. задержка, мс':>19}")
+    for mode in ("без логирования", "синхронное (basicConfig)", "очередь (logging_setup)"):
+        stream = _SlowStream(args.sink_latency)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        if mode == "без логирования":
+            root.addHandler(logging.NullHandler())
+            root.setLevel(logging.CRITICAL)
+        elif mode.startswith("синхронное"):
+            logging.basicConfig(level=logging.INFO, stream=stream, force=True)
+        else:
+            setup_logging(level="INFO", fmt="json", stream=stream)
+        elapsed, blocked, worst = asyncio.run(_broadcast_with_lag_probe(args.users))
+        stop_logging()
+        print(f"{mode:>24} {elapsed:>12.2f} {blocked:>14.2f} {worst * 1000:>19.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки Starsbot")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    workers = subparsers.add_parser("workers", help=bench_workers.__doc__)
+    workers.add_argument("--max-workers", type=int, default=os.cpu_count() or 2)
+    workers.add_argument("--updates", type=int, default=4000)
+    workers.add_argument("--users", type=int, default=500)
+    workers.set_defaults(func=bench_workers)
+
+    stats = subparsers.add_parser("stats", help=bench_stats.__doc__)
+    stats.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    stats.set_defaults(func=bench_stats)
+
+    search = subparsers.add_parser("search", help=bench_search.__doc__)
+    search.add_argument("--users", type=int, default=1000000)
+    search.add_argument("--repeats", type=int, default=200)
+    search.set_defaults(func=bench_search)
+
+    statements = subparsers.add_parser("statements", help=bench_statements.__doc__)
+    statements.add_argument("--calls", type=int, default=20000)
+    statements.set_defaults(func=bench_statements)
+
+    callbacks = subparsers.add_parser("callbacks", help=bench_callbacks.__doc__)
+    callbacks.add_argument("--updates", type=int, default=400)
+    callbacks.add_argument("--users", type=int, default=200)
+    callbacks.add_argument("--api-latency", type=float, default=0.05)
+    callbacks.add_argument("--grace", type=float, default=0.05)
+    callbacks.set_defaults(func=bench_callbacks)
+
+    logging_bench = subparsers.add_parser("logging", help=bench_logging.__doc__)
+    logging_bench.add_argument("--users", type=int, default=2000)
+    logging_bench.add_argument("--sink-latency", type=float, default=0.002)
+    logging_bench.set_defaults(func=bench_logging)
+
+    archive = subparsers.add_parser("archive", help=bench_archive.__doc__)
+    archive.add_argument("--rows", type=int, default=1000000)
+    archive.add_argument("--keep-days", type=int, default=90)
+    archive.add_argument("--repeats", type=int, default=5)
+    archive.set_defaults(func=bench_archive)
+
+    writes = subparsers.add_parser("writes", help=bench_writes.__doc__)
+    writes.add_argument("--writes", type=int, default=5000)
+    writes.add_argument("--users", type=int, default=2000)
+    writes.add_argument("--concurrency", type=int, default=200)
+    writes.set_defaults(func=bench_writes)
+
+    replica = subparsers.add_parser("replica", help=bench_replica.__doc__)
+    replica.add_argument("--users", type=int, default=1000)
+    replica.set_defaults(func=bench_replica)
+
+    warmup = subparsers.add_parser("warmup", help=bench_warmup.__doc__)
+    warmup.add_argument("--users", type=int, default=1000)
+    warmup.set_defaults(func=bench_warmup)
+
+    queries = subparsers.add_parser("queries", help=bench_queries.__doc__)
+    queries.add_argument("--users", type=int, default=500)
+    queries.add_argument("--budget", type=int, default=3)
+    queries.set_defaults(func=bench_queries)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,96 @@
 import asyncio
 import logging
+import time
+from functools import lru_cache
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, LabeledPrice, PreCheckoutQuery
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, PreCheckoutQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from config import BOT_TOKEN, PROVIDER_TOKEN, SUBSCRIPTION_PRICES, CHANNEL_ID, CHANNEL_INVITE_LINK
+from config import (
+    BOT_TOKEN, PROVIDER_TOKEN, CHANNEL_ID, CHANNEL_INVITE_LINK,
+    WORKER_PROCESSES, THROTTLE_ENABLED, CALLBACK_ACK_ENABLED, EXPORT_INTERVAL_MINUTES,
+    ARCHIVE_AFTER_DAYS, REMINDER_INTERVAL_MINUTES, SHUTDOWN_DRAIN_SECONDS, DROP_PENDING_UPDATES,
+    ADMIN_IDS, validate_config
+)
+from analytics import stats_cache, stats_reconcile_task
+from callback_ack import MANUAL_ACK_FLAG
+from catalog import get_catalog, reload_catalog, seed_catalog, find_paid_product, catalog_refresh_task
+from checkout import denylist, PreCheckoutValidator, REJECT_MESSAGES
 from database import db, init_database
-from admin import register_admin_handlers, show_admin_broadcast, show_admin_search_user
-from channel_manager import ChannelManager, subscription_cleanup_task
+from events import bus
+from metrics import metrics
+from outbox import OutboxWorker, GRANT_CHANNEL_ACCESS
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Логирование настраивается при запуске (logging_setup.setup_logging)
 logger = logging.getLogger(__name__)
 
-# Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
+# Диспетчер создается при импорте (это дешево), а Bot и зависимости - в create_app
 dp = Dispatcher()
-channel_manager = ChannelManager(bot)
+_app = None
+
+def create_app():
+    """Фабрика приложения: создание Bot и подключение обработчиков.
+
+    Возвращает (bot, dp). Повторный вызов возвращает уже созданное приложение.
+    """
+    global _app
+    if _app is not None:
+        return _app
+    
+    validate_config()
+    
+    from admin import register_admin_handlers
+    from callback_ack import setup_callback_ack
+    from channel_manager import ChannelManager
+    from health import setup_health
+    from logging_setup import setup_log_context
+    from query_accounting import setup_query_accounting
+    from render_cache import setup_render_cache
+    from shutdown import setup_drain
+    from throttling import setup_throttling
+    
+    bot = Bot(token=BOT_TOKEN)
+    # update_id и user_id текущего обновления в каждой записи лога
+    setup_log_context(dp)
+    # Число запросов к базе на обновление по обработчикам
+    setup_query_accounting(dp)
+    # Одинаковые edit_text не отправляются в Bot API
+    setup_render_cache(bot)
+    # Учет успешных getUpdates для проверки готовности
+    dp["health"] = setup_health(bot, db)
+    # Начатые обработчики дожидаются при остановке
+    dp["inflight"] = setup_drain(dp)
+    # Снимок статистики админ-панели обновляется по событиям регистрации и оплаты
+    stats_cache.subscribe(bus)
+    channel_manager = ChannelManager(bot)
+    # Доступен обработчикам как аргумент channel_manager
+    dp["channel_manager"] = channel_manager
+    
+    # Действия после оплаты выполняются через outbox (доступен как аргумент outbox)
+    outbox = OutboxWorker(db)
+    outbox.register(
+        GRANT_CHANNEL_ACCESS,
+        lambda payload: channel_manager.grant_access(payload["user_id"]),
+        on_failure=lambda payload: channel_manager.notify_access_failed(payload["user_id"])
+    )
+    dp["outbox"] = outbox
+    
+    # Проверка pre_checkout_query по снимку каталога, без запросов к базе
+    dp["checkout"] = PreCheckoutValidator()
+    
+    # Ограничение частоты запросов до вызова обработчиков
+    if THROTTLE_ENABLED:
+        setup_throttling(dp)
+    
+    # Ответ на callback-запросы, не дожидаясь медленных обработчиков
+    if CALLBACK_ACK_ENABLED:
+        setup_callback_ack(dp, bot)
+    
+    # Регистрация административных обработчиков
+    register_admin_handlers(dp)
+    
+    _app = (bot, dp)
+    return _app
 
 def get_back_keyboard():
     """Создать клавиатуру с кнопкой назад"""
@@ -25,33 +99,19 @@ def get_back_keyboard():
     ])
     return keyboard
 
-# Подписки для покупки
-SUBSCRIPTIONS = {
-    "1_month": {
-        "title": "Подписка на 1 месяц",
-        "description": "Доступ к приватному каналу на 1 месяц",
-        "price": SUBSCRIPTION_PRICES["1_month"],
-        "days": 30
-    },
-    "3_months": {
-        "title": "Подписка на 3 месяца",
-        "description": "Доступ к приватному каналу на 3 месяца",
-        "price": SUBSCRIPTION_PRICES["3_months"],
-        "days": 90
-    },
-    "6_months": {
-        "title": "Подписка на 6 месяцев",
-        "description": "Доступ к приватному каналу на 6 месяцев",
-        "price": SUBSCRIPTION_PRICES["6_months"],
-        "days": 180
-    },
-    "12_months": {
-        "title": "Подписка на 12 месяцев",
-        "description": "Доступ к приватному каналу на 12 месяцев",
-        "price": SUBSCRIPTION_PRICES["12_months"],
-        "days": 365
-    }
-}
+@lru_cache(maxsize=1)
+def get_main_menu_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура главного меню (строится один раз)"""
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="💎 Подписки", callback_data="subscriptions")
+    keyboard.button(text="ℹ️ О канале", callback_data="channel_info")
+    keyboard.button(text="👤 Профиль", callback_data="profile")
+    keyboard.adjust(2, 1)
+    return keyboard.as_markup()
+
+def get_subscriptions_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура каталога подписок (строится вместе со снимком каталога)"""
+    return get_catalog().keyboard
 
 @dp.message(Command("start"))
 async def start_command(message: types.Message):
@@ -71,51 +131,39 @@ async def start_command(message: types.Message):
     else:
         subscription_status = "\n❌ У вас нет активной подписки"
     
-    keyboard = InlineKeyboardBuilder()
-    keyboard.button(text="💎 Подписки", callback_data="subscriptions")
-    keyboard.button(text="ℹ️ О канале", callback_data="channel_info")
-    keyboard.button(text="👤 Профиль", callback_data="profile")
-    keyboard.adjust(2, 1)
-    
     await message.answer(
         f"🌟 Добро пожаловать в бот подписок!\n\n"
         f"Здесь вы можете приобрести доступ к нашему приватному каналу за звезды Telegram.{subscription_status}",
-        reply_markup=keyboard.as_markup()
+        reply_markup=get_main_menu_keyboard()
     )
 
 @dp.callback_query(lambda c: c.data == "subscriptions")
 async def show_subscriptions(callback: types.CallbackQuery):
     """Показать доступные подписки"""
-    keyboard = InlineKeyboardBuilder()
-    
-    for subscription_id, subscription in SUBSCRIPTIONS.items():
-        keyboard.button(
-            text=f"{subscription['title']} - {subscription['price']} ⭐",
-            callback_data=f"buy_{subscription_id}"
-        )
-    
-    keyboard.button(text="🔙 Назад", callback_data="back_to_main")
-    keyboard.adjust(1)
-    
     await callback.message.edit_text(
         "💎 **Доступные подписки**\n\n"
         "Выберите подписку для покупки:\n\n"
         "📺 Получите доступ к эксклюзивному контенту нашего приватного канала!",
-        reply_markup=keyboard.as_markup(),
+        reply_markup=get_subscriptions_keyboard(),
         parse_mode="Markdown"
     )
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("buy_"))
+# Отвечает сам: alert о текущей подписке показывается после запроса к базе
+@dp.callback_query(lambda c: c.data.startswith("buy_"), flags={MANUAL_ACK_FLAG: True})
 async def process_purchase(callback: types.CallbackQuery):
     """Обработка покупки подписки"""
     subscription_id = callback.data.replace("buy_", "")
+    # Один снимок на весь обработчик: подписка и цены из одной версии каталога
+    catalog = get_catalog()
+    product = catalog.get(subscription_id)
     
-    if subscription_id not in SUBSCRIPTIONS:
+    if product is None:
         await callback.answer("Подписка не найдена!", show_alert=True)
         return
-    
-    subscription = SUBSCRIPTIONS[subscription_id]
+    if callback.from_user.id in denylist:
+        await callback.answer(REJECT_MESSAGES["denied"], show_alert=True)
+        return
     
     # Проверяем, есть ли у пользователя уже активная подписка
     user = await db.get_user(callback.from_user.id)
@@ -127,82 +175,102 @@ async def process_purchase(callback: types.CallbackQuery):
         )
     
     # Создание инвойса для оплаты звездами
-    prices = [LabeledPrice(label=subscription["title"], amount=subscription["price"])]
-    
-    await bot.send_invoice(
+    await callback.bot.send_invoice(
         chat_id=callback.from_user.id,
-        title=subscription["title"],
-        description=subscription["description"],
-        payload=f"subscription_{subscription_id}",
+        title=product.title,
+        description=product.description,
+        payload=product.payload,
         provider_token="",  # Для звезд Telegram не нужен
         currency="XTR",  # Валюта для звезд Telegram
-        prices=prices
+        prices=catalog.prices(product.id)
     )
     
     await callback.answer()
 
 @dp.pre_checkout_query()
-async def process_pre_checkout_query(pre_checkout_query: PreCheckoutQuery):
-    """Обработка предварительной проверки платежа"""
-    # Здесь можно добавить дополнительные проверки
-    await bot.answer_pre_checkout_query(
-        pre_checkout_query.id,
-        ok=True
-    )
+async def process_pre_checkout_query(pre_checkout_query: PreCheckoutQuery, checkout):
+    """Обработка предварительной проверки платежа (подписка, сумма, запрет оплаты)"""
+    await checkout.answer(pre_checkout_query)
+
+async def alert_admins(bot: Bot, text: str):
+    """Уведомление администраторов; ошибки отправки только пишутся в лог"""
+    for admin_id in ADMIN_IDS:
+        try:
+            await bot.send_message(admin_id, text)
+        except Exception as e:
+            logger.warning("Не удалось уведомить администратора %s: %s", admin_id, e)
 
 @dp.message(lambda message: message.content_type == types.ContentType.SUCCESSFUL_PAYMENT)
-async def process_successful_payment(message: types.Message):
-    """Обработка успешного платежа"""
+async def process_successful_payment(message: types.Message, outbox):
+    """Обработка успешного платежа.
+    
+    Покупка, продление подписки и задача выдачи доступа записываются одной
+    транзакцией; ссылку в канал отправляет OutboxWorker с повторами.
+    Звезды к этому моменту уже списаны, поэтому платеж записывается, даже
+    если подписки больше нет в каталоге; администраторы получают уведомление.
+    """
     payment = message.successful_payment
-    subscription_id = payment.invoice_payload.replace("subscription_", "")
+    charge_id = payment.telegram_payment_charge_id
+    product = get_catalog().by_payload(payment.invoice_payload)
+    mismatch = product is None
+    if mismatch:
+        # Каталог изменился между pre_checkout и оплатой
+        product = await find_paid_product(db, payment.invoice_payload)
+        metrics.inc("payments.catalog_mismatch")
+        logger.error(
+            "Платеж %s пользователя %s: подписки %s нет в каталоге, %s",
+            charge_id, message.from_user.id, payment.invoice_payload,
+            f"срок из базы: {product.days} дней" if product else "подписка не найдена, доступ не выдан"
+        )
     
-    if subscription_id in SUBSCRIPTIONS:
-        subscription = SUBSCRIPTIONS[subscription_id]
-        
-        # Сохранение покупки в базе данных
-        await db.create_purchase(
-            user_id=message.from_user.id,
-            product_id=subscription_id,
-            product_title=subscription['title'],
-            amount=payment.total_amount,
-            telegram_payment_charge_id=payment.telegram_payment_charge_id,
-            provider_payment_charge_id=payment.provider_payment_charge_id
+    purchase = await db.record_payment(
+        user_id=message.from_user.id,
+        product_id=product.id if product else payment.invoice_payload,
+        product_title=product.title if product else payment.invoice_payload,
+        amount=payment.total_amount,
+        days=product.days if product else 0,
+        telegram_payment_charge_id=charge_id,
+        provider_payment_charge_id=payment.provider_payment_charge_id,
+        effects=(
+            (GRANT_CHANNEL_ACCESS, {"user_id": message.from_user.id}, f"{GRANT_CHANNEL_ACCESS}:{charge_id}"),
+        ) if product else ()
+    )
+    if purchase is None:
+        # Повторная доставка того же платежа: подписка уже продлена
+        return
+    if mismatch:
+        await alert_admins(
+            message.bot,
+            f"⚠️ Оплата подписки не из каталога: {payment.invoice_payload}, "
+            f"пользователь {message.from_user.id}, {payment.total_amount} ⭐, платеж {charge_id}. "
+            + (f"Подписка продлена на {product.days} дней по данным базы." if product
+               else "Подписка не найдена: платеж записан, доступ не выдан.")
         )
-        
-        # Активация подписки
-        await db.activate_subscription(message.from_user.id, subscription['days'])
-        
-        # Добавление пользователя в канал
-        success = await channel_manager.add_user_to_channel(message.from_user.id)
-        
-        if success:
-            await message.answer(
-                f"✅ **Платеж успешно обработан!**\n\n"
-                f"Подписка: {subscription['title']}\n"
-                f"Сумма: {payment.total_amount} ⭐\n"
-                f"Период: {subscription['days']} дней\n"
-                f"ID транзакции: `{payment.telegram_payment_charge_id}`\n\n"
-                f"🎉 Ваша подписка активирована!\n"
-                f"Проверьте личные сообщения - вам отправлена ссылка для вступления в канал.",
-                parse_mode="Markdown"
-            )
-        else:
-            await message.answer(
-                f"✅ **Платеж обработан, но возникла проблема с добавлением в канал.**\n\n"
-                f"Подписка: {subscription['title']}\n"
-                f"Сумма: {payment.total_amount} ⭐\n\n"
-                f"⚠️ Обратитесь в поддержку для получения доступа к каналу.",
-                parse_mode="Markdown"
-            )
-        
-        # Логирование успешного платежа
-        logger.info(
-            f"Successful payment: User {message.from_user.id}, "
-            f"Subscription {subscription_id}, Amount {payment.total_amount} stars, "
-            f"Days {subscription['days']}"
+    if product is None:
+        await message.answer(
+            f"⚠️ Платеж получен, но подписка не найдена. Администратор уже уведомлен.\n"
+            f"ID транзакции: `{charge_id}`",
+            parse_mode="Markdown"
         )
-    else:
-        await message.answer("❌ Ошибка при обработке платежа. Обратитесь в поддержку.")
+        return
+    outbox.wake()
+    
+    await message.answer(
+        f"✅ **Платеж успешно обработан!**\n\n"
+        f"Подписка: {product.title}\n"
+        f"Сумма: {payment.total_amount} ⭐\n"
+        f"Период: {product.days} дней\n"
+        f"ID транзакции: `{charge_id}`\n\n"
+        f"🎉 Ваша подписка активирована!\n"
+        f"Ссылка для вступления в канал придет в личные сообщения в течение минуты.",
+        parse_mode="Markdown"
+    )
+    
+    # Логирование успешного платежа
+    logger.info(
+        "Successful payment: User %s, Subscription %s, Amount %s stars, Days %s",
+        message.from_user.id, product.id, payment.total_amount, product.days
+    )
 
 @dp.callback_query(lambda c: c.data == "info")
 async def show_info(callback: types.CallbackQuery):
@@ -260,7 +328,7 @@ async def show_profile(callback: types.CallbackQuery):
 @dp.callback_query(lambda c: c.data == "purchase_history")
 async def show_purchase_history(callback: types.CallbackQuery):
     """Показать историю покупок"""
-    purchases = await db.get_user_purchases(callback.from_user.id)
+    purchases = await db.get_user_purchases(callback.from_user.id, include_archive=True)
     
     if purchases:
         history_text = "📊 **История ваших покупок:**\n\n"
@@ -284,7 +352,7 @@ async def show_purchase_history(callback: types.CallbackQuery):
     await callback.answer()
 
 @dp.callback_query(lambda c: c.data == "channel_info")
-async def show_channel_info(callback: types.CallbackQuery):
+async def show_channel_info(callback: types.CallbackQuery, channel_manager):
     """Показать информацию о канале"""
     user = await db.get_user(callback.from_user.id)
     
@@ -358,23 +426,18 @@ async def back_to_main(callback: types.CallbackQuery):
     else:
         welcome_text = "🏠 **Главное меню**\n\nВыберите действие:"
     
-    keyboard = InlineKeyboardBuilder()
-    keyboard.button(text="💎 Подписки", callback_data="subscriptions")
-    keyboard.button(text="ℹ️ О канале", callback_data="channel_info")
-    keyboard.button(text="👤 Профиль", callback_data="profile")
-    keyboard.adjust(2, 1)
-    
     await callback.message.edit_text(
         welcome_text,
         parse_mode="Markdown",
-        reply_markup=keyboard.as_markup()
+        reply_markup=get_main_menu_keyboard()
     )
     await callback.answer()
 
 @dp.message(Command("broadcast"))
 async def broadcast_command(message: types.Message):
     """Обработчик команды /broadcast"""
-    from admin import is_admin, send_broadcast
+    from admin import is_admin, show_admin_broadcast
+    from broadcast import start_broadcast
     
     if not is_admin(message.from_user.id):
         await message.reply("❌ У вас нет прав администратора")
@@ -388,23 +451,16 @@ async def broadcast_command(message: types.Message):
     
     broadcast_text = command_args[1]
     
-    # Отправляем рассылку
+    # Рассылка идет в фоне с контрольными точками и переживает перезапуск,
+    # итог придет отдельным сообщением
+    start_broadcast(message.bot, db, broadcast_text, message.chat.id)
     await message.reply("📤 Начинаю рассылку...")
-    success_count, error_count = await send_broadcast(bot, broadcast_text)
-    
-    result_text = (
-        f"✅ Рассылка завершена!\n\n"
-        f"📊 Статистика:\n"
-        f"• Успешно отправлено: {success_count}\n"
-        f"• Ошибок: {error_count}"
-    )
-    
-    await message.reply(result_text)
 
 @dp.message(Command("search_user"))
 async def search_user_command(message: types.Message):
     """Обработчик команды /search_user"""
-    from admin import is_admin
+    from admin import is_admin, send_user_search_results, show_admin_search_user, SEARCH_PAGE_SIZE
+    from utils import escape_legacy_markdown
     
     if not is_admin(message.from_user.id):
         await message.reply("❌ У вас нет прав администратора")
@@ -420,25 +476,28 @@ async def search_user_command(message: types.Message):
     
     # Поиск пользователя
     try:
-        if search_query.startswith('@'):
-            username = search_query[1:]
-            user = await db.get_user_by_username(username)
+        if search_query.isdigit():
+            user = await db.get_user_by_id(int(search_query))
         else:
-            user_id = int(search_query)
-            user = await db.get_user_by_id(user_id)
+            # Префиксный поиск по username, имени и фамилии
+            users, next_cursor = await db.search_users(search_query, limit=SEARCH_PAGE_SIZE)
+            if len(users) > 1 or next_cursor:
+                await send_user_search_results(message, search_query, users, next_cursor)
+                return
+            user = users[0] if users else None
         
         if not user:
             await message.reply(f"❌ Пользователь '{search_query}' не найден")
             return
         
         # Получаем информацию о подписках
-        subscriptions = await db.get_user_subscriptions(user.telegram_id)
+        subscriptions = await db.get_user_subscriptions(user.telegram_id, user=user)
         
         user_info = (
             f"👤 **Информация о пользователе**\n\n"
             f"🆔 ID: `{user.telegram_id}`\n"
-            f"👤 Имя: {user.first_name or 'Не указано'}\n"
-            f"📝 Username: @{user.username or 'Не указан'}\n"
+            f"👤 Имя: {escape_legacy_markdown(user.first_name) or 'Не указано'}\n"
+            f"📝 Username: @{escape_legacy_markdown(user.username) or 'Не указан'}\n"
             f"💎 Премиум: {'Да' if user.is_premium_active else 'Нет'}\n"
             f"📅 Регистрация: {user.created_at.strftime('%d.%m.%Y %H:%M')}\n\n"
         )
@@ -447,14 +506,12 @@ async def search_user_command(message: types.Message):
             user_info += "📋 **Подписки:**\n"
             for sub in subscriptions:
                 status = "Активна" if sub.is_active else "Неактивна"
-                user_info += f"• {sub.product_title} - {status}\n"
+                user_info += f"• {escape_legacy_markdown(sub.product_title)} - {status}\n"
         else:
             user_info += "📋 **Подписки:** Нет активных подписок\n"
         
         await message.reply(user_info, parse_mode="Markdown")
         
-    except ValueError:
-        await message.reply("❌ Неверный формат ID пользователя")
     except Exception as e:
         await message.reply(f"❌ Ошибка поиска: {str(e)}")
 
@@ -462,28 +519,112 @@ async def main():
     """Главная функция запуска бота"""
     logger.info("Запуск бота...")
     
+    bot, dp = create_app()
+    
+    from broadcast import resume_broadcasts, stop_broadcasts
+    from channel_manager import subscription_cleanup_task
+    from leader import LeaderElector
+    from shutdown import shut_down
+    from warmup import warm_up
+    
+    # Одиночные фоновые задачи выполняются только на реплике-лидере
+    leader = LeaderElector(db)
+    leader.register_job("subscription_cleanup", lambda: subscription_cleanup_task(bot))
+    if EXPORT_INTERVAL_MINUTES > 0:
+        from exporter import PurchaseExporter, export_purchases_task
+        exporter = PurchaseExporter(db)
+        leader.register_job("purchases_export", lambda: export_purchases_task(exporter))
+    if ARCHIVE_AFTER_DAYS > 0:
+        from archive import archive_purchases_task
+        leader.register_job("purchases_archive", lambda: archive_purchases_task(db))
+    if REMINDER_INTERVAL_MINUTES > 0:
+        from reminders import renewal_reminders_task
+        leader.register_job("renewal_reminders", lambda: renewal_reminders_task(bot, db))
+    outbox = dp["outbox"]
+    health = dp["health"]
+    inflight = dp["inflight"]
+    health.leader = leader
+    
     try:
         # Инициализация базы данных
         await init_database()
         
-        # Запуск задачи очистки истекших подписок
-        asyncio.create_task(subscription_cleanup_task(bot))
+        # Каталог подписок из базы (при ошибке остаются подписки по умолчанию);
+        # пустая таблица заполняется один раз здесь, до запуска воркеров
+        try:
+            await seed_catalog(db)
+            await reload_catalog(db)
+        except Exception as e:
+            logger.error("Каталог не загружен, используются подписки по умолчанию: %s", e)
         
-        # Регистрация административных обработчиков
-        register_admin_handlers(dp)
+        # Прогрев: пул соединений, запросы, клавиатуры и проверка Bot API
+        await warm_up(bot, db, preload=(get_main_menu_keyboard, get_subscriptions_keyboard))
         
-        # Удаление вебхука (если был установлен)
-        await bot.delete_webhook(drop_pending_updates=True)
+        # Запуск выбора лидера и задачи очистки истекших подписок
+        health.watch("leader", asyncio.create_task(leader.run()))
         
-        logger.info("Bot started with subscription cleanup task")
+        # Выполнение задач outbox (на каждой реплике, задачи не дублируются)
+        health.watch("outbox", asyncio.create_task(outbox.run()))
         
-        # Запуск поллинга
-        await dp.start_polling(bot)
+        # Изменения цен и подписок применяются без перезапуска
+        health.watch("catalog", asyncio.create_task(catalog_refresh_task(db)))
+        
+        # Список запрета оплаты для проверки pre_checkout_query
+        health.watch("denylist", asyncio.create_task(denylist.run(db)))
+        
+        # Периодическая сверка снимка статистики админ-панели с базой
+        health.watch("stats_reconcile", asyncio.create_task(stats_reconcile_task()))
+        
+        # Задержка цикла событий и HTTP-проверки для оркестратора
+        await health.start()
+        
+        # Удаление вебхука (если был установлен). Обновления, пришедшие во
+        # время перезапуска, по умолчанию сохраняются и будут обработаны
+        await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+        
+        # Рассылки, прерванные остановкой этой или другой реплики
+        resume_started = time.perf_counter()
+        resumed = await resume_broadcasts(bot, db)
+        metrics.set_gauge("startup.resume_seconds", time.perf_counter() - resume_started)
+        if resumed:
+            logger.info("Продолжено прерванных рассылок: %d", resumed)
+        
+        startup_seconds = time.time() - metrics.started_at
+        metrics.set_gauge("startup.seconds", startup_seconds)
+        logger.info(f"Bot started with subscription cleanup task in {startup_seconds:.2f}s")
+        
+        if WORKER_PROCESSES > 1:
+            # Прием обновлений с распределением по процессам-воркерам
+            from workers import run_ingestion
+            await run_ingestion(bot, dp, WORKER_PROCESSES)
+        else:
+            # Запуск поллинга (до SIGINT/SIGTERM). Сессия бота остается
+            # открытой: начатым обработчикам она еще нужна
+            await dp.start_polling(bot, close_bot_session=False)
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
     finally:
-        await bot.session.close()
-        await db.close()
+        # Прием обновлений остановлен: реплика больше не готова, начатая
+        # работа завершается или сохраняет прогресс, затем закрываются
+        # сессия бота и база
+        health.draining = True
+        await shut_down([
+            ("handlers", lambda: inflight.drain(SHUTDOWN_DRAIN_SECONDS)),
+            ("broadcasts", stop_broadcasts),
+            # Задачи лидера останавливаются, аренда освобождается сразу,
+            # и новая реплика не ждет истечения ее срока
+            ("leader", leader.stop),
+            ("outbox", lambda: outbox.stop(timeout=SHUTDOWN_DRAIN_SECONDS)),
+            ("events", bus.close),
+            ("health", health.stop),
+            ("bot_session", bot.session.close),
+            # Запись буфера статусов канала и очереди писателя SQLite
+            ("database", db.close),
+        ])
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    from logging_setup import setup_logging
+    
+    # Запись логов в фоновом потоке, не блокирующем цикл событий
+    setup_logging()
+    asyncio.run(main())
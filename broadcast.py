@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import time
+from typing import Tuple
+from aiogram import Bot
+from config import BROADCAST_BATCH_SIZE, BROADCAST_RATE_PER_SECOND, JOB_CHECKPOINT_STALE_SECONDS
+from leader import default_instance_id
+from metrics import metrics
+from query_accounting import detach_query_stats
+
+logger = logging.getLogger(__name__)
+
+# Контрольные точки рассылок в job_checkpoints: broadcast:<чат администратора>:<время запуска, мс>
+CHECKPOINT_PREFIX = "broadcast:"
+
+# Реплика, записывающая контрольные точки
+HOLDER_ID = default_instance_id()
+
+# Выполняющиеся в процессе рассылки
+_running: set = set()
+
+class Broadcast:
+    """Рассылка всем пользователям с контрольными точками.
+
+    Получатели читаются страницами по batch_size в порядке telegram_id,
+    после каждой страницы прогресс (последний ID и счетчики) записывается
+    в job_checkpoints. При остановке реплики рассылка отменяется и
+    сохраняет точку со статусом interrupted - следующий запуск продолжит
+    ее с того же места (resume_broadcasts). Если реплика упала без
+    остановки, рассылку продолжит реплика, запущенная позже, когда точка
+    устареет. При остановке повторно сообщение может получить не больше
+    одного пользователя - тот, кому оно отправлялось в момент отмены.
+    После падения рассылка продолжается с последней записанной точки,
+    и повторно сообщение получат до batch_size пользователей, которым
+    оно было отправлено после нее.
+    """
+
+    def __init__(self, bot: Bot, database, name: str, text: str, chat_id: int,
+                 after_id: int = 0, success: int = 0, errors: int = 0,
+                 batch_size: int = BROADCAST_BATCH_SIZE, rate: float = BROADCAST_RATE_PER_SECOND):
+        self.bot = bot
+        self.database = database
+        self.name = name
+        self.text = text
+        self.chat_id = chat_id
+        self.after_id = after_id
+        self.success = success
+        self.errors = errors
+        self.batch_size = batch_size
+        self.delay = 1 / rate
+
+    @classmethod
+    def from_checkpoint(cls, bot: Bot, database, checkpoint) -> "Broadcast":
+        state = checkpoint.data
+        return cls(
+            bot, database, checkpoint.name, state["text"], state["chat_id"],
+            after_id=state["after_id"], success=state["success"], errors=state["errors"]
+        )
+
+    @property
+    def state(self) -> dict:
+        return {
+            "text": self.text,
+            "chat_id": self.chat_id,
+            "after_id": self.after_id,
+            "success": self.success,
+            "errors": self.errors,
+        }
+
+    async def checkpoint(self, status: str = "running"):
+        await self.database.save_checkpoint(self.name, HOLDER_ID, self.state, status)
+
+    async def _send(self, user_id: int):
+        try:
+            await self.bot.send_message(user_id, self.text, parse_mode="Markdown")
+            self.success += 1
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Не удалось отправить сообщение пользователю %s: %s", user_id, e)
+
+    async def run(self) -> Tuple[int, int]:
+        """Отправка оставшимся получателям; возвращает (успешно, ошибок)"""
+        await self.checkpoint()
+        try:
+            while True:
+                user_ids = await self.database.get_user_ids_page(self.after_id, self.batch_size)
+                for user_id in user_ids:
+                    await self._send(user_id)
+                    self.after_id = user_id
+                    await asyncio.sleep(self.delay)  # Задержка для избежания лимитов
+                if len(user_ids) < self.batch_size:
+                    break
+                await self.checkpoint()
+        except asyncio.CancelledError:
+            try:
+                await self.checkpoint("interrupted")
+                logger.info(
+                    "Рассылка %s прервана остановкой, отправлено %d; продолжится после запуска",
+                    self.name, self.success
+                )
+            except Exception as e:
+                logger.error("Не удалось сохранить прогресс рассылки %s: %s", self.name, e)
+            raise
+        await self.database.delete_checkpoint(self.name)
+        metrics.inc("broadcast.sent", self.success)
+        metrics.inc("broadcast.errors", self.errors)
+        return self.success, self.errors
+
+async def _run_and_report(broadcast: Broadcast):
+    detach_query_stats()
+    try:
+        success_count, error_count = await broadcast.run()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # Точка остается и устареет: рассылку продолжит следующий запуск
+        logger.error("Ошибка рассылки %s: %s", broadcast.name, e)
+        return
+    try:
+        await broadcast.bot.send_message(
+            broadcast.chat_id,
+            f"✅ Рассылка завершена!\n\n"
+            f"📊 Статистика:\n"
+            f"• Успешно отправлено: {success_count}\n"
+            f"• Ошибок: {error_count}"
+        )
+    except Exception as e:
+        logger.warning("Не удалось отправить итог рассылки администратору %s: %s", broadcast.chat_id, e)
+
+def _spawn(broadcast: Broadcast) -> asyncio.Task:
+    task = asyncio.create_task(_run_and_report(broadcast), name=broadcast.name)
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return task
+
+def start_broadcast(bot: Bot, database, text: str, chat_id: int) -> Broadcast:
+    """Запуск рассылки в фоне; итог придет администратору в чат chat_id"""
+    name = f"{CHECKPOINT_PREFIX}{chat_id}:{int(time.time() * 1000)}"
+    broadcast = Broadcast(bot, database, name, text, chat_id)
+    _spawn(broadcast)
+    return broadcast
+
+async def stop_broadcasts() -> int:
+    """Остановка рассылок процесса с сохранением прогресса; возвращает их число"""
+    tasks = list(_running)
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return len(tasks)
+
+async def resume_broadcasts(bot: Bot, database,
+                            stale_seconds: int = JOB_CHECKPOINT_STALE_SECONDS) -> int:
+    """Продолжение рассылок, прерванных остановкой или падением реплики"""
+    checkpoints = await database.claim_checkpoints(CHECKPOINT_PREFIX, HOLDER_ID, stale_seconds)
+    for checkpoint in checkpoints:
+        broadcast = Broadcast.from_checkpoint(bot, database, checkpoint)
+        logger.info("Продолжение рассылки %s после ID %s", broadcast.name, broadcast.after_id)
+        metrics.inc("broadcast.resumed")
+        try:
+            await bot.send_message(
+                broadcast.chat_id,
+                f"▶️ Рассылка продолжена после перезапуска бота "
+                f"(уже отправлено: {broadcast.success})"
+            )
+        except Exception as e:
+            logger.warning("Не удалось уведомить администратора %s: %s", broadcast.chat_id, e)
+        _spawn(broadcast)
+    return len(checkpoints)
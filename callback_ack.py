@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiogram import BaseMiddleware, Bot, Dispatcher, types
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.flags import get_flag
+from aiogram.methods import AnswerCallbackQuery, SendMessage, TelegramMethod
+from aiogram.methods.base import TelegramType
+from config import CALLBACK_ACK_GRACE_SECONDS
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Флаг обработчика, который сам отвечает на callback (например, с url или поздним alert)
+MANUAL_ACK_FLAG = "manual_ack"
+
+class CallbackAckTracker:
+    """Общее состояние: какие callback-запросы уже получили ответ"""
+
+    __slots__ = ("max_tracked", "_pending")
+
+    def __init__(self, max_tracked: int = 10000):
+        self.max_tracked = max_tracked
+        # id запроса -> [время начала обработки, чат, отвечен ли]
+        self._pending: "OrderedDict[str, list]" = OrderedDict()
+
+    def start(self, callback_id: str, chat_id: Optional[int]):
+        self._pending[callback_id] = [time.perf_counter(), chat_id, False]
+        while len(self._pending) > self.max_tracked:
+            self._pending.popitem(last=False)
+
+    def mark_answered(self, callback_id: str) -> bool:
+        """Отметка ответа; False, если ответ уже был"""
+        state = self._pending.get(callback_id)
+        if state is None:
+            return True
+        if state[2]:
+            return False
+        state[2] = True
+        metrics.observe("callback_ack.seconds", time.perf_counter() - state[0])
+        return True
+
+    def is_answered(self, callback_id: str) -> bool:
+        state = self._pending.get(callback_id)
+        return state is not None and state[2]
+
+    def chat_id(self, callback_id: str) -> Optional[int]:
+        state = self._pending.get(callback_id)
+        return state[1] if state else None
+
+class AnswerTrackingMiddleware(BaseRequestMiddleware):
+    """Учет AnswerCallbackQuery на уровне сессии бота.
+
+    Повторный ответ на уже отвеченный запрос не отправляется: без текста он
+    просто пропускается, а текст (alert) доставляется обычным сообщением,
+    чтобы не потерялся.
+    """
+
+    def __init__(self, tracker: CallbackAckTracker):
+        self.tracker = tracker
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Any:
+        if not isinstance(method, AnswerCallbackQuery):
+            return await make_request(bot, method)
+        if self.tracker.mark_answered(method.callback_query_id):
+            return await make_request(bot, method)
+
+        metrics.inc("callback_ack.late_answers")
+        chat_id = self.tracker.chat_id(method.callback_query_id)
+        if method.text and chat_id is not None:
+            await make_request(bot, SendMessage(chat_id=chat_id, text=method.text))
+        return True
+
+class CallbackAckMiddleware(BaseMiddleware):
+    """Быстрый ответ на callback-запросы, чтобы у кнопки не крутился индикатор.
+
+    Если обработчик не ответил сам за grace_seconds, middleware отвечает
+    пустым ответом, не дожидаясь запросов к базе и редактирования
+    сообщения; обработчик, который так и не ответил, получает ответ сразу
+    после завершения. Обработчики с флагом manual_ack (например, отвечающие
+    alert после долгой работы) отвечают сами; их запросы только
+    отслеживаются, чтобы повторный пустой ответ не ушел в Telegram.
+    """
+
+    def __init__(self, tracker: CallbackAckTracker, grace_seconds: float = CALLBACK_ACK_GRACE_SECONDS):
+        self.tracker = tracker
+        self.grace_seconds = grace_seconds
+        self.enabled = True
+
+    async def _answer_later(self, callback: types.CallbackQuery):
+        await asyncio.sleep(self.grace_seconds)
+        # Начатый ответ доводится до конца, даже если обработчик уже завершился
+        await asyncio.shield(self._answer(callback))
+
+    async def _answer(self, callback: types.CallbackQuery):
+        if self.tracker.is_answered(callback.id):
+            return
+        metrics.inc("callback_ack.auto")
+        try:
+            await callback.answer()
+        except Exception as e:
+            logger.debug(f"Не удалось ответить на callback {callback.id}: {e}")
+
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: types.CallbackQuery,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not self.enabled:
+            return await handler(event, data)
+        self.tracker.start(event.id, event.message.chat.id if event.message else event.from_user.id)
+        if get_flag(data, MANUAL_ACK_FLAG):
+            return await handler(event, data)
+
+        timer = asyncio.create_task(self._answer_later(event)) if self.grace_seconds > 0 else None
+        if timer is None:
+            await self._answer(event)
+        try:
+            return await handler(event, data)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            # Запись остается в трекере (вытесняется по max_tracked): отложенный
+            # ответ таймера может выполниться уже после обработчика
+            await self._answer(event)
+
+def setup_callback_ack(dp: Dispatcher, bot: Bot,
+                       grace_seconds: float = CALLBACK_ACK_GRACE_SECONDS) -> CallbackAckMiddleware:
+    """Подключение автоматического ответа на callback-запросы"""
+    tracker = CallbackAckTracker()
+    bot.session.middleware(AnswerTrackingMiddleware(tracker))
+    middleware = CallbackAckMiddleware(tracker, grace_seconds)
+    dp.callback_query.middleware(middleware)
+    return middleware
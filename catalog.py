@@ -0,0 +1,180 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Iterable, Iterator, List, Optional
+from aiogram.types import InlineKeyboardMarkup, LabeledPrice
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from config import SUBSCRIPTION_PRICES, CATALOG_REFRESH_SECONDS
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Payload инвойса: префикс и ID подписки
+PAYLOAD_PREFIX = "subscription_"
+
+@dataclass(frozen=True)
+class Product:
+    """Подписка из каталога"""
+    id: str
+    title: str
+    description: str
+    price: int  # в звездах Telegram
+    days: int
+
+    @property
+    def payload(self) -> str:
+        return f"{PAYLOAD_PREFIX}{self.id}"
+
+class CatalogSnapshot:
+    """Неизменяемый снимок каталога подписок.
+
+    Обработчики читают снимок без обращения к базе и без блокировок:
+    объекты снимка не меняются, а новый каталог подменяет снимок целиком
+    (reload_catalog). Цены для инвойсов и клавиатура каталога строятся
+    один раз при создании снимка.
+    """
+
+    __slots__ = ("products", "keyboard", "_by_payload", "_prices")
+
+    def __init__(self, products: Iterable[Product]):
+        products = {product.id: product for product in products}
+        self.products = MappingProxyType(products)
+        self._by_payload = MappingProxyType({product.payload: product for product in products.values()})
+        self._prices = MappingProxyType({
+            product.id: (LabeledPrice(label=product.title, amount=product.price),)
+            for product in products.values()
+        })
+        self.keyboard = self._build_keyboard(products.values())
+
+    @staticmethod
+    def _build_keyboard(products: Iterable[Product]) -> InlineKeyboardMarkup:
+        keyboard = InlineKeyboardBuilder()
+        for product in products:
+            keyboard.button(
+                text=f"{product.title} - {product.price} ⭐",
+                callback_data=f"buy_{product.id}"
+            )
+        keyboard.button(text="🔙 Назад", callback_data="back_to_main")
+        keyboard.adjust(1)
+        return keyboard.as_markup()
+
+    def get(self, product_id: str) -> Optional[Product]:
+        return self.products.get(product_id)
+
+    def by_payload(self, payload: str) -> Optional[Product]:
+        """Подписка по payload инвойса"""
+        return self._by_payload.get(payload)
+
+    def prices(self, product_id: str) -> List[LabeledPrice]:
+        """Цены для send_invoice"""
+        return list(self._prices[product_id])
+
+    def __contains__(self, product_id: str) -> bool:
+        return product_id in self.products
+
+    def __iter__(self) -> Iterator[Product]:
+        return iter(self.products.values())
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+# Подписки по умолчанию: ими заполняется пустая таблица products,
+# и они действуют, пока каталог не загружен из базы
+SUBSCRIPTIONS = {
+    "1_month": {
+        "title": "Подписка на 1 месяц",
+        "description": "Доступ к приватному каналу на 1 месяц",
+        "price": SUBSCRIPTION_PRICES["1_month"],
+        "days": 30
+    },
+    "3_months": {
+        "title": "Подписка на 3 месяца",
+        "description": "Доступ к приватному каналу на 3 месяца",
+        "price": SUBSCRIPTION_PRICES["3_months"],
+        "days": 90
+    },
+    "6_months": {
+        "title": "Подписка на 6 месяцев",
+        "description": "Доступ к приватному каналу на 6 месяцев",
+        "price": SUBSCRIPTION_PRICES["6_months"],
+        "days": 180
+    },
+    "12_months": {
+        "title": "Подписка на 12 месяцев",
+        "description": "Доступ к приватному каналу на 12 месяцев",
+        "price": SUBSCRIPTION_PRICES["12_months"],
+        "days": 365
+    }
+}
+
+_snapshot = CatalogSnapshot(
+    Product(id=product_id, **subscription) for product_id, subscription in SUBSCRIPTIONS.items()
+)
+
+def get_catalog() -> CatalogSnapshot:
+    """Текущий снимок каталога"""
+    return _snapshot
+
+def _product_from_row(row) -> Product:
+    return Product(id=row.id, title=row.title, description=row.description, price=row.price, days=row.days)
+
+async def seed_catalog(database) -> int:
+    """Заполнение пустой таблицы products подписками по умолчанию (один раз при запуске)"""
+    return await database.seed_products([
+        {"id": product_id, "sort_order": index, **subscription}
+        for index, (product_id, subscription) in enumerate(SUBSCRIPTIONS.items())
+    ])
+
+async def find_paid_product(database, payload: str) -> Optional[Product]:
+    """Подписка оплаченного инвойса, которой уже нет в снимке каталога.
+
+    Подписку могли снять с продажи между pre_checkout и оплатой, а звезды
+    уже списаны: берется строка products (в том числе неактивная), без
+    нее - подписка по умолчанию. None - payload не относится ни к одной
+    подписке.
+    """
+    if not payload.startswith(PAYLOAD_PREFIX):
+        return None
+    product_id = payload[len(PAYLOAD_PREFIX):]
+    row = await database.get_product(product_id)
+    if row is not None:
+        return _product_from_row(row)
+    subscription = SUBSCRIPTIONS.get(product_id)
+    return Product(id=product_id, **subscription) if subscription else None
+
+async def reload_catalog(database) -> bool:
+    """Загрузка каталога из базы и подмена снимка; True, если каталог изменился.
+
+    Только читает: пустую таблицу заполняет seed_catalog при запуске. Если в
+    базе нет ни одной активной подписки, текущий снимок остается (ValueError).
+    """
+    global _snapshot
+
+    products = [_product_from_row(row) for row in await database.get_products()]
+    if not products:
+        raise ValueError("В каталоге нет активных подписок")
+    if products == list(_snapshot):
+        return False
+
+    # Присваивание атомарно: обработчик видит либо старый, либо новый снимок целиком
+    _snapshot = CatalogSnapshot(products)
+    metrics.inc("catalog.reloads")
+    metrics.set_gauge("catalog.products", len(products))
+    logger.info(
+        "Каталог обновлен: %s",
+        ", ".join(f"{product.id}={product.price}" for product in products)
+    )
+    return True
+
+async def catalog_refresh_task(database, interval_seconds: float = CATALOG_REFRESH_SECONDS):
+    """Периодическая загрузка каталога из базы (на каждой реплике и в каждом воркере).
+
+    Первая загрузка выполняется при запуске, поэтому задача начинает с паузы.
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await reload_catalog(database)
+        except Exception as e:
+            logger.error("Ошибка загрузки каталога: %s", e)
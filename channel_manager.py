@@ -5,28 +5,35 @@ from aiogram import Bot
 from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 from config import CHANNEL_ID, CHANNEL_INVITE_LINK
 from database import db
+from events import bus, MemberJoined, MemberLeft, SubscriptionExpired
+from outbox import PermanentOutboxError
 
 logger = logging.getLogger(__name__)
 
 class ChannelManager:
     """Класс для управления участниками приватного канала"""
     
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: Bot, events=None):
         self.bot = bot
+        self.events = events or bus
         self.channel_id = CHANNEL_ID
         self.invite_link = CHANNEL_INVITE_LINK
     
-    async def add_user_to_channel(self, user_id: int) -> bool:
-        """Добавление пользователя в приватный канал"""
+    async def grant_access(self, user_id: int):
+        """Выдача доступа к каналу: пригласительная ссылка и уведомление.
+        
+        Ошибки не перехватываются - задачу outbox повторит OutboxWorker.
+        Если пользователь заблокировал бота, повтор бессмыслен.
+        """
+        # Создаем пригласительную ссылку для конкретного пользователя
+        invite_link = await self.bot.create_chat_invite_link(
+            chat_id=self.channel_id,
+            member_limit=1,  # Ссылка только для одного пользователя
+            expire_date=datetime.now().timestamp() + 3600  # Ссылка действует 1 час
+        )
+        
+        # Отправляем пользователю ссылку для вступления
         try:
-            # Создаем пригласительную ссылку для конкретного пользователя
-            invite_link = await self.bot.create_chat_invite_link(
-                chat_id=self.channel_id,
-                member_limit=1,  # Ссылка только для одного пользователя
-                expire_date=datetime.now().timestamp() + 3600  # Ссылка действует 1 час
-            )
-            
-            # Отправляем пользователю ссылку для вступления
             await self.bot.send_message(
                 chat_id=user_id,
                 text=f"🎉 Ваша подписка активирована!\n\n"
@@ -34,11 +41,30 @@ class ChannelManager:
                      f"{invite_link.invite_link}\n\n"
                      f"⚠️ Ссылка действительна в течение 1 часа."
             )
-            
-            # Обновляем статус в базе данных
-            await db.update_channel_status(user_id, True)
-            
-            logger.info(f"Пользователь {user_id} приглашен в канал")
+        except TelegramForbiddenError as e:
+            raise PermanentOutboxError(f"пользователь {user_id} заблокировал бота") from e
+        
+        # Обновляем статус в базе данных
+        await db.update_channel_status(user_id, True)
+        await self.events.publish(MemberJoined(user_id))
+        
+        logger.info("Пользователь %s приглашен в канал", user_id)
+    
+    async def notify_access_failed(self, user_id: int):
+        """Сообщение пользователю, если доступ так и не удалось выдать"""
+        try:
+            await self.bot.send_message(
+                chat_id=user_id,
+                text="⚠️ Платеж получен, но выдать доступ к каналу не удалось.\n\n"
+                     "Обратитесь в поддержку для получения доступа к каналу."
+            )
+        except (TelegramBadRequest, TelegramForbiddenError):
+            pass
+    
+    async def add_user_to_channel(self, user_id: int) -> bool:
+        """Добавление пользователя в приватный канал"""
+        try:
+            await self.grant_access(user_id)
             return True
             
         except TelegramBadRequest as e:
@@ -65,6 +91,7 @@ class ChannelManager:
             
             # Обновляем статус в базе данных
             await db.update_channel_status(user_id, False)
+            await self.events.publish(MemberLeft(user_id))
             
             # Уведомляем пользователя
             try:
@@ -78,7 +105,7 @@ class ChannelManager:
                 # Пользователь заблокировал бота или удалил аккаунт
                 pass
             
-            logger.info(f"Пользователь {user_id} удален из канала")
+            logger.info("Пользователь %s удален из канала", user_id)
             return True
             
         except TelegramBadRequest as e:
@@ -118,6 +145,7 @@ class ChannelManager:
             expired_users = await db.get_expired_subscriptions()
             
             for user in expired_users:
+                await self.events.publish(SubscriptionExpired(user.telegram_id))
                 await self.remove_user_from_channel(user.telegram_id)
                 await asyncio.sleep(0.1)  # Небольшая задержка между запросами
             
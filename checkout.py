@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Iterable, Optional
+from aiogram.types import PreCheckoutQuery
+from catalog import CatalogSnapshot, get_catalog
+from config import DENYLIST_REFRESH_SECONDS
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Причины отказа (используются в метриках checkout.rejected.<причина>) и тексты для пользователя
+REJECT_MESSAGES = {
+    "unknown_product": "Подписка не найдена. Откройте каталог подписок заново.",
+    "currency": "Неверная валюта платежа.",
+    "amount_mismatch": "Цена подписки изменилась. Откройте каталог подписок заново.",
+    "denied": "Оплата для вашего аккаунта недоступна. Обратитесь в поддержку.",
+}
+
+class Denylist:
+    """Кэш пользователей, которым запрещена оплата.
+
+    Проверка - поиск в frozenset без обращения к базе. Набор целиком
+    перечитывается из denied_users раз в refresh_seconds (run) и сразу
+    меняется в процессе, где администратор выполнил /deny или /allow;
+    остальные процессы увидят изменение после очередного обновления.
+    До первой загрузки набор пуст.
+    """
+
+    def __init__(self, refresh_seconds: float = DENYLIST_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._ids: frozenset = frozenset()
+        self.loaded_at: Optional[float] = None
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def replace(self, user_ids: Iterable[int]):
+        self._ids = frozenset(user_ids)
+        self.loaded_at = time.monotonic()
+        metrics.set_gauge("checkout.denylist_size", len(self._ids))
+
+    def add(self, user_id: int):
+        self._ids = self._ids | {user_id}
+
+    def discard(self, user_id: int):
+        self._ids = self._ids - {user_id}
+
+    async def refresh(self, database):
+        self.replace(await database.get_denied_user_ids())
+
+    async def run(self, database):
+        """Периодическое обновление из базы (на каждой реплике и в каждом воркере)"""
+        while True:
+            try:
+                await self.refresh(database)
+            except Exception as e:
+                logger.error("Ошибка обновления списка запрета оплаты: %s", e)
+            await asyncio.sleep(self.refresh_seconds)
+
+# Список запрета оплаты процесса
+denylist = Denylist()
+
+class PreCheckoutValidator:
+    """Проверка pre_checkout_query без обращения к базе.
+
+    На ответ Telegram дает несколько секунд, поэтому проверяется только
+    то, что есть в памяти: подписка из снимка каталога, валюта и сумма
+    по ее цене, отсутствие пользователя в списке запрета. Время проверки
+    и ответа публикуется в метриках checkout.validate_seconds и
+    checkout.answer_seconds, отказы - в checkout.rejected.<причина>.
+    """
+
+    def __init__(self, catalog: Callable[[], CatalogSnapshot] = get_catalog,
+                 denylist: Denylist = denylist):
+        self.catalog = catalog
+        self.denylist = denylist
+
+    def validate(self, query: PreCheckoutQuery) -> Optional[str]:
+        """Причина отказа или None, если платеж можно принять"""
+        product = self.catalog().by_payload(query.invoice_payload)
+        if product is None:
+            return "unknown_product"
+        if query.currency != "XTR":
+            return "currency"
+        if query.total_amount != product.price:
+            return "amount_mismatch"
+        if query.from_user.id in self.denylist:
+            return "denied"
+        return None
+
+    async def answer(self, query: PreCheckoutQuery) -> bool:
+        started = time.perf_counter()
+        reason = self.validate(query)
+        metrics.observe("checkout.validate_seconds", time.perf_counter() - started)
+        if reason is None:
+            await query.answer(ok=True)
+            metrics.inc("checkout.approved")
+        else:
+            await query.answer(ok=False, error_message=REJECT_MESSAGES[reason])
+            metrics.inc(f"checkout.rejected.{reason}")
+            logger.warning(
+                "Платеж пользователя %s отклонен: %s (payload %s, сумма %s %s)",
+                query.from_user.id, reason, query.invoice_payload, query.total_amount, query.currency
+            )
+        metrics.observe("checkout.answer_seconds", time.perf_counter() - started)
+        return reason is None
@@ -13,8 +13,71 @@ PROVIDER_TOKEN = os.getenv("PROVIDER_TOKEN", "")
 # Настройки базы данных (опционально)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///bot.db")
 
+# Реплика только для чтения: админские экраны и аналитика (опционально)
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL", "")
+REPLICA_RETRY_SECONDS = int(os.getenv("REPLICA_RETRY_SECONDS", "30"))  # Пауза после ошибки реплики
+
+# Писатель SQLite: все записи процесса идут через очередь на одном соединении.
+# Писатель свой в каждом процессе: при WORKER_PROCESSES > 1 процессы
+# по-прежнему конкурируют за блокировку файла базы
+SQLITE_WRITER = os.getenv("SQLITE_WRITER", "False").lower() == "true"  # Только для файловой SQLite
+SQLITE_WRITER_WINDOW_MS = float(os.getenv("SQLITE_WRITER_WINDOW_MS", "5"))  # Сбор задач в одну транзакцию
+SQLITE_WRITER_MAX_BATCH = int(os.getenv("SQLITE_WRITER_MAX_BATCH", "200"))  # Задач в одной транзакции
+SQLITE_WRITER_QUEUE_SIZE = int(os.getenv("SQLITE_WRITER_QUEUE_SIZE", "10000"))  # Дальше вызывающие ждут
+
+# Отложенная запись статуса в канале: изменения пишутся одним запросом
+CHANNEL_STATUS_FLUSH_SECONDS = float(os.getenv("CHANNEL_STATUS_FLUSH_SECONDS", "1"))
+CHANNEL_STATUS_BATCH_SIZE = int(os.getenv("CHANNEL_STATUS_BATCH_SIZE", "500"))  # Запись раньше интервала
+
+# Outbox: гарантированное выполнение действий после оплаты
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "8"))  # Задач одновременно на реплике
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "1"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "5"))  # Первая пауза, далее x2
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "600"))
+OUTBOX_LOCK_SECONDS = int(os.getenv("OUTBOX_LOCK_SECONDS", "60"))  # Не меньше времени выполнения задачи
+
+# Шина событий: очередь каждого подписчика и ожидание места в ней при публикации
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "1000"))
+EVENT_PUBLISH_TIMEOUT_SECONDS = float(os.getenv("EVENT_PUBLISH_TIMEOUT_SECONDS", "5"))  # Затем событие отбрасывается
+
+# Снимок статистики админ-панели пересчитывается по базе с этим интервалом
+STATS_RECONCILE_SECONDS = int(os.getenv("STATS_RECONCILE_SECONDS", "300"))
+
+# Отпечатки последних отправленных сообщений для пропуска одинаковых edit_text
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "10000"))
+
+# Автоматический ответ на callback-запросы, если обработчик не ответил сам
+CALLBACK_ACK_ENABLED = os.getenv("CALLBACK_ACK_ENABLED", "True").lower() == "true"
+CALLBACK_ACK_GRACE_SECONDS = float(os.getenv("CALLBACK_ACK_GRACE_SECONDS", "0.05"))  # 0 - отвечать сразу
+
+# Проверка состояния для оркестратора: /healthz, /readyz, /tasks, /metrics
+HEALTH_HOST = os.getenv("HEALTH_HOST", "127.0.0.1")
+HEALTH_PORT = int(os.getenv("HEALTH_PORT", "8080"))  # 0 - HTTP-сервер отключен
+HEALTH_MAX_LOOP_LAG_SECONDS = float(os.getenv("HEALTH_MAX_LOOP_LAG_SECONDS", "5"))  # Порог живости
+HEALTH_UPDATES_STALE_SECONDS = float(os.getenv("HEALTH_UPDATES_STALE_SECONDS", "60"))  # Без getUpdates - не готов
+HEALTH_DB_TIMEOUT_SECONDS = float(os.getenv("HEALTH_DB_TIMEOUT_SECONDS", "2"))
+LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", "0.5"))  # Период измерения задержки цикла
+
+# Профилирование по команде /profile (только для администраторов)
+PROFILE_DEFAULT_SECONDS = int(os.getenv("PROFILE_DEFAULT_SECONDS", "30"))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_TOP_ENTRIES = int(os.getenv("PROFILE_TOP_ENTRIES", "40"))  # Строк в каждом разделе отчета
+
+# Учет запросов к базе на обновление: off, metrics или debug (с текстами запросов в логе)
+QUERY_ACCOUNTING = os.getenv("QUERY_ACCOUNTING", "metrics")
+QUERY_BUDGET_COUNT = int(os.getenv("QUERY_BUDGET_COUNT", "5"))  # Больше запросов - предупреждение в лог
+QUERY_BUDGET_SECONDS = float(os.getenv("QUERY_BUDGET_SECONDS", "0.2"))  # Суммарное время запросов
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "3"))  # Повторы одного запроса (N+1)
+
+# Размер кэша скомпилированных SQL-запросов SQLAlchemy (query_cache_size)
+SQL_COMPILED_CACHE_SIZE = int(os.getenv("SQL_COMPILED_CACHE_SIZE", "500"))
+
 # Настройки логирования
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json или text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # При переполнении записи отбрасываются
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")  # Например: database=0.1,admin=0.5 (только ниже WARNING)
 
 # Список администраторов бота
 ADMIN_IDS_STR = os.getenv("ADMIN_IDS", "")
@@ -24,7 +87,8 @@ ADMIN_IDS = [int(id.strip()) for id in ADMIN_IDS_STR.split(",") if id.strip().is
 CHANNEL_ID = os.getenv("CHANNEL_ID", "")  # ID приватного канала (например: -1001234567890)
 CHANNEL_INVITE_LINK = os.getenv("CHANNEL_INVITE_LINK", "")  # Пригласительная ссылка на канал
 
-# Цены подписок (в звездах Telegram)
+# Цены подписок по умолчанию (в звездах Telegram): заполняют пустую таблицу products,
+# дальше цены меняются в базе (/set_price) без перезапуска
 SUBSCRIPTION_PRICES = {
     "1_month": 100,   # 1 месяц - 100 звезд
     "3_months": 250,  # 3 месяца - 250 звезд
@@ -32,8 +96,64 @@ SUBSCRIPTION_PRICES = {
     "12_months": 800  # 12 месяцев - 800 звезд
 }
 
-# Проверка обязательных настроек
-if BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
-    raise ValueError(
-        "Необходимо установить BOT_TOKEN в файле .env или переменных окружения"
-    )
\ No newline at end of file
+# Выбор лидера для фоновых задач при запуске нескольких реплик
+INSTANCE_ID = os.getenv("INSTANCE_ID", "")  # Идентификатор реплики (по умолчанию hostname:pid)
+LEADER_LEASE_TTL_SECONDS = int(os.getenv("LEADER_LEASE_TTL_SECONDS", "30"))  # Срок аренды лидера
+LEADER_HEARTBEAT_SECONDS = int(os.getenv("LEADER_HEARTBEAT_SECONDS", "10"))  # Интервал продления аренды
+
+# Многопроцессный режим: обновления шардируются по ID пользователя между воркерами
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))  # 0 или 1 - обычный однопроцессный режим
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))  # Размер очереди каждого воркера
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "64"))  # Одновременных обработок в воркере
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "10"))  # Таймаут long polling в секундах
+
+# Ограничение частоты запросов (антифлуд): класс=токенов_в_секунду/емкость
+THROTTLE_ENABLED = os.getenv("THROTTLE_ENABLED", "True").lower() == "true"
+THROTTLE_RULES = os.getenv("THROTTLE_RULES", "default=1/5,navigation=2/6,purchase=0.2/3,admin=5/20")
+THROTTLE_IDLE_TTL_SECONDS = int(os.getenv("THROTTLE_IDLE_TTL_SECONDS", "600"))  # Удаление неактивных корзин
+THROTTLE_MAX_TRACKED = int(os.getenv("THROTTLE_MAX_TRACKED", "100000"))  # Максимум отслеживаемых корзин
+
+# Инкрементальная выгрузка покупок для бухгалтерии
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+EXPORT_FORMAT = os.getenv("EXPORT_FORMAT", "csv")  # csv или jsonl, файлы сжимаются gzip
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))  # Строк на один запрос к базе
+EXPORT_MAX_FILE_ROWS = int(os.getenv("EXPORT_MAX_FILE_ROWS", "100000"))  # Ротация файлов
+EXPORT_REPLAY_WINDOW = int(os.getenv("EXPORT_REPLAY_WINDOW", "10000"))  # Максимум строк для повторной выгрузки
+EXPORT_SETTLE_SECONDS = int(os.getenv("EXPORT_SETTLE_SECONDS", "60"))  # Выгружаются покупки старше этого
+EXPORT_INTERVAL_MINUTES = int(os.getenv("EXPORT_INTERVAL_MINUTES", "0"))  # 0 - фоновая выгрузка отключена
+
+# Архивация покупок: старше этого срока переносятся в purchases_archive (итоги сохраняются)
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "0"))  # 0 - фоновая архивация отключена, минимум 30
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))  # Строк на одну транзакцию
+ARCHIVE_INTERVAL_HOURS = int(os.getenv("ARCHIVE_INTERVAL_HOURS", "24"))
+
+# Каталог подписок: снимок в памяти перечитывается из таблицы products
+CATALOG_REFRESH_SECONDS = int(os.getenv("CATALOG_REFRESH_SECONDS", "60"))
+
+# Список запрета оплаты: кэш в памяти для проверки pre_checkout_query без запросов к базе
+DENYLIST_REFRESH_SECONDS = int(os.getenv("DENYLIST_REFRESH_SECONDS", "60"))
+
+# Напоминания о продлении подписки: за сколько дней до окончания (по одному на окно)
+REMINDER_WINDOWS_DAYS = sorted(
+    {int(days.strip()) for days in os.getenv("REMINDER_WINDOWS_DAYS", "3,1").split(",") if days.strip().isdigit()},
+    reverse=True
+)
+REMINDER_INTERVAL_MINUTES = int(os.getenv("REMINDER_INTERVAL_MINUTES", "30"))  # 0 - напоминания отключены
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "200"))  # Пользователей на один запрос к базе
+REMINDER_RATE_PER_SECOND = float(os.getenv("REMINDER_RATE_PER_SECOND", "20"))  # Лимит Bot API - около 30 в секунду
+REMINDER_RENEW_PRODUCT = os.getenv("REMINDER_RENEW_PRODUCT", "1_month")  # Подписка для кнопки продления
+
+# Плавная остановка и быстрый перезапуск
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "20"))  # Ожидание начатых обработчиков
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "False").lower() == "true"  # Обновления, пришедшие во время перезапуска
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "100"))  # Получателей между контрольными точками
+BROADCAST_RATE_PER_SECOND = float(os.getenv("BROADCAST_RATE_PER_SECOND", "20"))
+JOB_CHECKPOINT_STALE_SECONDS = int(os.getenv("JOB_CHECKPOINT_STALE_SECONDS", "300"))  # Задача упавшей реплики продолжается после этого
+
+# Проверка обязательных настроек (вызывается при создании приложения, а не при импорте)
+def validate_config():
+    """Проверка обязательных настроек перед запуском бота"""
+    if BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
+        raise ValueError(
+            "Необходимо установить BOT_TOKEN в файле .env или переменных окружения"
+        )
\ No newline at end of file
@@ -1,17 +1,43 @@
 import asyncio
+import functools
+import json
 import logging
+import time
+from contextvars import ContextVar
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text, select
+from sqlalchemy import (
+    create_engine, Column, Integer, String, Date, DateTime, Boolean, Text, Index,
+    select, update, delete, insert, func, event, or_, and_, not_, exists, inspect, text, bindparam
+)
+from sqlalchemy.engine.default import CacheStats
+from sqlalchemy.exc import DBAPIError, IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
-from config import DATABASE_URL
+from sqlalchemy.orm import sessionmaker, validates
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from config import (
+    DATABASE_URL, DATABASE_REPLICA_URL, REPLICA_RETRY_SECONDS, SQL_COMPILED_CACHE_SIZE, SQLITE_WRITER,
+    CHANNEL_STATUS_FLUSH_SECONDS, CHANNEL_STATUS_BATCH_SIZE
+)
+from events import bus, UserRegistered, PaymentCommitted, SubscriptionExtended
+from query_accounting import detach_query_stats, instrument_engine
+from sqlite_writer import SQLiteWriter
 
 logger = logging.getLogger(__name__)
 
 # Базовый класс для моделей
 Base = declarative_base()
 
+# Нормализованные колонки для поиска пользователей (в порядке приоритета)
+USER_SEARCH_FIELDS = ('username_lower', 'first_name_lower', 'last_name_lower')
+
+def normalize_search_text(value: str):
+    """Нормализация строки для регистронезависимого поиска"""
+    if value is None:
+        return None
+    return value.strip().lower() or None
+
 # Модель пользователя
 class User(Base):
     __tablename__ = 'users'
@@ -22,12 +48,33 @@ class User(Base):
     first_name = Column(String(255))
     last_name = Column(String(255))
     is_premium = Column(Boolean, default=False)
-    premium_until = Column(DateTime)
-    subscription_until = Column(DateTime)  # Дата окончания подписки на канал
+    premium_until = Column(DateTime, index=True)
+    subscription_until = Column(DateTime, index=True)  # Дата окончания подписки на канал
     is_in_channel = Column(Boolean, default=False)  # Находится ли пользователь в канале
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Копии username и имени в нижнем регистре для префиксного поиска по индексу.
+    # SQLite lower() не понимает кириллицу, поэтому значения нормализуются в Python
+    username_lower = Column(String(255), index=True)
+    first_name_lower = Column(String(255), index=True)
+    last_name_lower = Column(String(255), index=True)
+    
+    # На PostgreSQL префиксный LIKE обслуживают триграммные индексы (pg_trgm)
+    __table_args__ = tuple(
+        Index(
+            f'ix_users_{field}_trgm', field,
+            postgresql_using='gin',
+            postgresql_ops={field: 'gin_trgm_ops'}
+        ).ddl_if(dialect='postgresql')
+        for field in USER_SEARCH_FIELDS
+    )
+    
+    @validates('username', 'first_name', 'last_name')
+    def _sync_search_fields(self, key, value):
+        setattr(self, f'{key}_lower', normalize_search_text(value))
+        return value
+    
     def __repr__(self):
         return f"<User(telegram_id={self.telegram_id}, username={self.username})>"
     
@@ -57,37 +104,652 @@ class Purchase(Base):
     telegram_payment_charge_id = Column(String(255), unique=True)
     provider_payment_charge_id = Column(String(255))
     status = Column(String(50), default='completed')
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    # Покрывающий индекс для группировки по товарам в статистике
+    __table_args__ = (
+        Index('ix_purchases_product_amount', 'product_id', 'amount'),
+    )
     
     def __repr__(self):
         return f"<Purchase(user_id={self.user_id}, product_id={self.product_id}, amount={self.amount})>"
 
+# Архив покупок старше ARCHIVE_AFTER_DAYS: строки переносятся из purchases с теми же id
+class ArchivedPurchase(Base):
+    __tablename__ = 'purchases_archive'
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=False, index=True)
+    product_id = Column(String(100), nullable=False)
+    product_title = Column(String(255), nullable=False)
+    amount = Column(Integer, nullable=False)
+    telegram_payment_charge_id = Column(String(255))
+    provider_payment_charge_id = Column(String(255))
+    status = Column(String(50))
+    created_at = Column(DateTime, index=True)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<ArchivedPurchase(id={self.id}, user_id={self.user_id}, amount={self.amount})>"
+
+# Итоги архивных покупок по дням и товарам: суммы за все время без чтения архива
+class PurchaseRollup(Base):
+    __tablename__ = 'purchase_rollups'
+    
+    day = Column(Date, primary_key=True)
+    product_id = Column(String(100), primary_key=True)
+    product_title = Column(String(255), nullable=False)  # название из последней покупки дня
+    count = Column(Integer, nullable=False, default=0)
+    revenue = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<PurchaseRollup(day={self.day}, product_id={self.product_id}, count={self.count})>"
+
+# Колонки, переносимые в архив
+ARCHIVED_PURCHASE_COLUMNS = (
+    'id', 'user_id', 'product_id', 'product_title', 'amount',
+    'telegram_payment_charge_id', 'provider_payment_charge_id', 'status', 'created_at'
+)
+
+# Отправленные напоминания о продлении: одно на окно и срок подписки.
+# После продления срок другой, поэтому напоминания придут снова
+class ReminderSent(Base):
+    __tablename__ = 'reminders_sent'
+    
+    user_id = Column(Integer, primary_key=True)  # telegram_id пользователя
+    days = Column(Integer, primary_key=True)  # окно напоминания: за сколько дней до окончания
+    subscription_until = Column(DateTime, primary_key=True)
+    sent_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    # Удаление записей по истекшим подпискам
+    __table_args__ = (
+        Index('ix_reminders_sent_subscription_until', 'subscription_until'),
+    )
+    
+    def __repr__(self):
+        return f"<ReminderSent(user_id={self.user_id}, days={self.days}, subscription_until={self.subscription_until})>"
+
+# Каталог подписок (читается в неизменяемый снимок catalog.CatalogSnapshot)
+class CatalogProduct(Base):
+    __tablename__ = 'products'
+    
+    id = Column(String(100), primary_key=True)  # ID подписки, например '1_month'
+    title = Column(String(255), nullable=False)
+    description = Column(Text, nullable=False, default='')
+    price = Column(Integer, nullable=False)  # в звездах Telegram
+    days = Column(Integer, nullable=False)  # срок подписки
+    sort_order = Column(Integer, nullable=False, default=0)  # порядок в каталоге
+    is_active = Column(Boolean, nullable=False, default=True)  # неактивные не продаются
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<CatalogProduct(id={self.id}, price={self.price}, days={self.days}, is_active={self.is_active})>"
+
+# Пользователи, которым запрещена оплата (читается в кэш checkout.Denylist)
+class DeniedUser(Base):
+    __tablename__ = 'denied_users'
+    
+    user_id = Column(Integer, primary_key=True)  # telegram_id пользователя
+    reason = Column(String(255))
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f"<DeniedUser(user_id={self.user_id}, reason={self.reason})>"
+
+# Модель аренды (lease) для выбора лидера среди реплик бота
+class Lease(Base):
+    __tablename__ = 'leases'
+    
+    name = Column(String(100), primary_key=True)  # имя аренды, например 'background'
+    holder = Column(String(255), nullable=False)  # идентификатор реплики-владельца
+    expires_at = Column(DateTime, nullable=False)  # момент, после которого аренду можно перехватить
+    heartbeat_at = Column(DateTime, nullable=False)  # время последнего продления
+    
+    def __repr__(self):
+        return f"<Lease(name={self.name}, holder={self.holder}, expires_at={self.expires_at})>"
+
+# Модель контрольной точки длительной задачи: прогресс для продолжения после перезапуска
+class JobCheckpoint(Base):
+    __tablename__ = 'job_checkpoints'
+
+    name = Column(String(255), primary_key=True)  # имя задачи, например 'broadcast:<id>'
+    holder = Column(String(255), nullable=False)  # реплика, выполняющая задачу
+    status = Column(String(20), nullable=False, default='running')  # running, interrupted
+    state = Column(Text, nullable=False)  # прогресс задачи в JSON
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    @property
+    def data(self) -> dict:
+        """Прогресс задачи"""
+        return json.loads(self.state)
+
+    def __repr__(self):
+        return f"<JobCheckpoint(name={self.name}, holder={self.holder}, status={self.status})>"
+
+# Модель исходящих задач (outbox): побочные эффекты после фиксации транзакции
+class OutboxMessage(Base):
+    __tablename__ = 'outbox'
+    
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(100), nullable=False)  # тип задачи, например 'grant_channel_access'
+    payload = Column(Text, nullable=False)  # параметры задачи в JSON
+    dedup_key = Column(String(255), unique=True, nullable=False)  # защита от повторной постановки
+    status = Column(String(20), nullable=False, default='pending')  # pending, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = Column(String(255))  # реплика, взявшая задачу в работу
+    locked_until = Column(DateTime)  # после этого момента задачу может взять другая реплика
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    processed_at = Column(DateTime)
+    
+    # Выборка готовых к выполнению задач читается из индекса
+    __table_args__ = (
+        Index('ix_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+    
+    @property
+    def data(self) -> dict:
+        """Параметры задачи"""
+        return json.loads(self.payload)
+    
+    def __repr__(self):
+        return f"<OutboxMessage(id={self.id}, kind={self.kind}, status={self.status}, attempts={self.attempts})>"
+
+# Горячие запросы строятся один раз при импорте модуля: значения передаются
+# через bindparam, а ключ кэша компиляции у готовой конструкции запоминается,
+# поэтому при вызове не тратится время на построение select и ключа.
+# Запросы администратора, фоновых задач раз в несколько секунд (аренда,
+# выборка outbox, контрольные точки), архивации и миграций строятся при
+# вызове: их мало, и они попадают в кэш компиляции движка по ключу.
+_USER_BY_TELEGRAM_ID = select(User).where(User.telegram_id == bindparam('telegram_id'))
+_USER_BY_USERNAME = select(User).where(User.username_lower == bindparam('username'))
+_EXPIRED_SUBSCRIPTIONS = select(User).where(
+    User.subscription_until < bindparam('now'),
+    User.is_in_channel == True
+)
+_ACTIVE_SUBSCRIBERS = select(User).where(User.subscription_until > bindparam('now'))
+# Окно напоминаний читается по индексу subscription_until страницами по
+# ключу (subscription_until, telegram_id); уже отправленные исключаются
+# поиском по первичному ключу reminders_sent
+_DUE_REMINDERS = select(User.telegram_id, User.subscription_until).where(
+    User.subscription_until > bindparam('start'),
+    User.subscription_until <= bindparam('end'),
+    or_(
+        User.subscription_until > bindparam('after_until'),
+        and_(
+            User.subscription_until == bindparam('after_until'),
+            User.telegram_id > bindparam('after_id')
+        )
+    ),
+    ~exists().where(
+        ReminderSent.user_id == User.telegram_id,
+        ReminderSent.days == bindparam('days'),
+        ReminderSent.subscription_until == User.subscription_until
+    )
+).order_by(User.subscription_until, User.telegram_id).limit(bindparam('limit'))
+_UPDATE_CHANNEL_STATUS = update(User.__table__).where(
+    User.__table__.c.telegram_id == bindparam('tid')
+).values(is_in_channel=bindparam('in_channel'), updated_at=bindparam('updated'))
+_USER_PURCHASES = select(Purchase).where(Purchase.user_id == bindparam('telegram_id'))
+_USER_ARCHIVED_PURCHASES = select(ArchivedPurchase).where(
+    ArchivedPurchase.user_id == bindparam('telegram_id')
+)
+_COUNT_USERS = select(func.count(User.telegram_id))
+_COUNT_PREMIUM_USERS = select(func.count(User.telegram_id)).where(
+    User.is_premium == True,
+    User.premium_until > bindparam('now')
+)
+# Итоги за все время и за дни: горячая таблица плюс итоги архива одним запросом
+_COUNT_PURCHASES = select(
+    select(func.count(Purchase.id)).scalar_subquery()
+    + select(func.coalesce(func.sum(PurchaseRollup.count), 0)).scalar_subquery()
+)
+_TOTAL_REVENUE = select(
+    select(func.coalesce(func.sum(Purchase.amount), 0)).scalar_subquery()
+    + select(func.coalesce(func.sum(PurchaseRollup.revenue), 0)).scalar_subquery()
+)
+_REVENUE_IN_RANGE = select(
+    select(func.coalesce(func.sum(Purchase.amount), 0)).where(
+        Purchase.created_at >= bindparam('start'),
+        Purchase.created_at < bindparam('end')
+    ).scalar_subquery()
+    + select(func.coalesce(func.sum(PurchaseRollup.revenue), 0)).where(
+        PurchaseRollup.day >= bindparam('start_day'),
+        PurchaseRollup.day < bindparam('end_day')
+    ).scalar_subquery()
+)
+_PURCHASES_COUNT_IN_RANGE = select(
+    select(func.count(Purchase.id)).where(
+        Purchase.created_at >= bindparam('start'),
+        Purchase.created_at < bindparam('end')
+    ).scalar_subquery()
+    + select(func.coalesce(func.sum(PurchaseRollup.count), 0)).where(
+        PurchaseRollup.day >= bindparam('start_day'),
+        PurchaseRollup.day < bindparam('end_day')
+    ).scalar_subquery()
+)
+_COMPLETE_OUTBOX = update(OutboxMessage.__table__).where(
+    OutboxMessage.__table__.c.id == bindparam('message_id')
+).values(status='done', processed_at=bindparam('processed_at'),
+         locked_by=None, locked_until=None, last_error=None)
+_USER_IDS_PAGE = select(User.telegram_id).where(
+    User.telegram_id > bindparam('after_id')
+).order_by(User.telegram_id).limit(bindparam('limit'))
+
+def _prefix_condition(column, dialect_name: str):
+    """Условие «колонка начинается с префикса», использующее индекс"""
+    if dialect_name == 'postgresql':
+        return column.like(bindparam('pattern'), escape='\\')
+    # Диапазон [prefix, upper) читается из B-tree индекса
+    return and_(column >= bindparam('prefix'), column < bindparam('upper'))
+
+def _prefix_params(prefix: str, dialect_name: str) -> dict:
+    if dialect_name == 'postgresql':
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return {'pattern': f'{escaped}%'}
+    # Следующая за всеми строками с этим префиксом строка
+    return {'prefix': prefix, 'upper': prefix[:-1] + chr(ord(prefix[-1]) + 1)}
+
+@functools.lru_cache(maxsize=None)
+def _search_statement(dialect_name: str, fields: tuple, index: int, after: bool):
+    """Запрос поиска по полю fields[index] (after - продолжение страницы внутри поля).
+
+    Сочетаний параметров немного, поэтому каждый запрос строится один раз.
+    """
+    column = getattr(User, fields[index])
+    stmt = select(User).where(_prefix_condition(column, dialect_name))
+    # Пользователи, найденные по предыдущим полям, уже были показаны
+    for previous in fields[:index]:
+        previous_column = getattr(User, previous)
+        stmt = stmt.where(or_(
+            previous_column.is_(None),
+            not_(_prefix_condition(previous_column, dialect_name))
+        ))
+    if after:
+        stmt = stmt.where(or_(
+            column > bindparam('after_value'),
+            and_(column == bindparam('after_value'), User.id > bindparam('after_id'))
+        ))
+    return stmt.order_by(column, User.id).limit(bindparam('limit'))
+
+# Куда направлять чтение в текущем вызове: 'primary' или 'replica'
+_read_target: ContextVar[str] = ContextVar('db_read_target', default='primary')
+
+def read_only(stale_ok: bool = True):
+    """Пометка метода, который только читает данные.
+    
+    Методы с stale_ok=True допускают небольшое отставание данных и читают
+    с реплики, если она настроена (через read_session). При ошибке реплики
+    запрос повторяется на основной базе, а реплика исключается на
+    REPLICA_RETRY_SECONDS. Методы с stale_ok=False всегда читают с основной
+    базы (например, проверки сразу после оплаты).
+    
+    Декоратор применим к методам Database и сервисов с атрибутом database.
+    """
+    def decorator(method):
+        async def call(self, target: str, args, kwargs):
+            # Цель задается явно: вложенный вызов не должен унаследовать
+            # 'replica' от внешнего метода, читающего с реплики
+            token = _read_target.set(target)
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                _read_target.reset(token)
+        
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            database = getattr(self, 'database', self)
+            if not stale_ok or not database.replica_available:
+                return await call(self, 'primary', args, kwargs)
+            try:
+                return await call(self, 'replica', args, kwargs)
+            except (DBAPIError, OSError) as e:
+                database._mark_replica_failed(e)
+            # Повтор на основной базе
+            return await call(self, 'primary', args, kwargs)
+        
+        wrapper.stale_ok = stale_ok
+        return wrapper
+    return decorator
+
+class ChannelStatusBuffer:
+    """Отложенная запись is_in_channel и updated_at пользователей.
+    
+    Изменения копятся в памяти (повторные для одного пользователя
+    сливаются, побеждает последнее) и записываются одним executemany
+    UPDATE раз в flush_seconds или при накоплении batch_size изменений.
+    Пользователи, загруженные из базы этим процессом, сразу видят
+    несохраненные значения (событие load модели User), а запросы с
+    фильтром по is_in_channel перед выполнением вызывают flush().
+    
+    Буфер свой у каждого процесса, и flush() записывает только его. В
+    многопроцессном режиме (WORKER_PROCESSES > 1) изменения, накопленные
+    воркерами, видны другим процессам (в том числе проверке подписок на
+    лидере) только после их записи - с задержкой до flush_seconds.
+    """
+    
+    def __init__(self, database, flush_seconds: float = CHANNEL_STATUS_FLUSH_SECONDS,
+                 batch_size: int = CHANNEL_STATUS_BATCH_SIZE):
+        self.database = database
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        # telegram_id -> (is_in_channel, updated_at)
+        self._pending: dict = {}
+        # Записываемые прямо сейчас: видны при чтении до фиксации транзакции
+        self._in_flight: dict = {}
+        self._lock = asyncio.Lock()
+        self._wakeup: asyncio.Event = None
+        self._task: asyncio.Task = None
+    
+    def set(self, telegram_id: int, is_in_channel: bool):
+        """Постановка изменения в очередь на запись"""
+        self._pending[telegram_id] = (is_in_channel, datetime.utcnow())
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="channel_status_flush")
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+    
+    def get(self, telegram_id: int):
+        """Несохраненное значение (is_in_channel, updated_at) или None"""
+        return self._pending.get(telegram_id) or self._in_flight.get(telegram_id)
+    
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending or self._in_flight)
+    
+    async def flush(self) -> int:
+        """Запись накопленных изменений; возвращает число записанных"""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            self._in_flight, self._pending = self._pending, {}
+            rows = [
+                {'tid': telegram_id, 'in_channel': is_in_channel, 'updated': updated_at}
+                for telegram_id, (is_in_channel, updated_at) in self._in_flight.items()
+            ]
+            try:
+                result = await self.database._write(
+                    lambda session: session.execute(_UPDATE_CHANNEL_STATUS, rows)
+                )
+            except Exception:
+                # Более новые изменения, поступившие во время записи, не затираются
+                self._pending = {**self._in_flight, **self._pending}
+                raise
+            finally:
+                self._in_flight = {}
+            if result.rowcount is not None and 0 <= result.rowcount < len(rows):
+                logger.warning("Статус канала: не найдено пользователей: %d", len(rows) - result.rowcount)
+            logger.debug("Записан статус канала для %d пользователей", len(rows))
+            return len(rows)
+    
+    async def _run(self):
+        detach_query_stats()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Ошибка записи статуса канала, повтор через %s с: %s", self.flush_seconds, e)
+            if not self._pending:
+                # Задача перезапускается при следующем изменении
+                return
+    
+    async def close(self):
+        """Остановка фоновой записи и запись оставшихся изменений"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+@event.listens_for(User, 'load')
+@event.listens_for(User, 'refresh')
+def _apply_pending_channel_status(user, context, *args):
+    # Чтение своих записей: несохраненный статус поверх значения из базы
+    buffer = context.session.info.get('channel_status')
+    if buffer is None or not buffer.has_pending:
+        return
+    pending = buffer.get(user.telegram_id)
+    if pending is not None:
+        set_committed_value(user, 'is_in_channel', pending[0])
+        set_committed_value(user, 'updated_at', pending[1])
+
+def _sqlite_writer_connect(dbapi_connection, connection_record):
+    # Драйвер sqlite3 сам открывает транзакции и ломает SAVEPOINT, поэтому
+    # BEGIN выдается явно (_sqlite_writer_begin). WAL: чтение не ждет записи
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+def _sqlite_writer_begin(conn):
+    # Блокировка записи берется сразу, а не при первом изменении
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+def _async_url(database_url: str) -> str:
+    """Преобразование URL для async SQLAlchemy"""
+    if database_url.startswith('sqlite:///'):
+        return database_url.replace('sqlite:///', 'sqlite+aiosqlite:///')
+    return database_url
+
 # Класс для работы с базой данных
 class Database:
-    def __init__(self, database_url: str):
-        # Преобразование URL для async SQLAlchemy
-        if database_url.startswith('sqlite:///'):
-            self.database_url = database_url.replace('sqlite:///', 'sqlite+aiosqlite:///')
-        else:
-            self.database_url = database_url
+    def __init__(self, database_url: str, replica_url: str = None, events=None,
+                 single_writer: bool = SQLITE_WRITER):
+        self.database_url = _async_url(database_url)
+        # Шина событий: публикуются после фиксации транзакций
+        self.events = events or bus
+        # Реплика только для чтения (опционально)
+        self.replica_url = _async_url(replica_url) if replica_url else None
+        
+        # Движки и фабрики сессий создаются при первом обращении,
+        # поэтому импорт модуля не открывает соединений
+        self._engine = None
+        self._async_session = None
+        self._replica_engine = None
+        self._replica_session = None
+        self._replica_down_until = 0.0
+        self._cache_stats = {outcome: 0 for outcome in CacheStats}
+        # Отложенная запись статуса в канале (update_channel_status)
+        self.channel_status = ChannelStatusBuffer(self)
+        # Записи в файловую SQLite через единственного писателя (_write)
+        self._writer_engine = None
+        self._writer_session = None
+        self.writer = None
+        if single_writer and self.database_url.startswith('sqlite') and ':memory:' not in self.database_url:
+            self.writer = SQLiteWriter(self._new_writer_session)
+    
+    def _create_engine(self, url: str):
+        engine = create_async_engine(
+            url,
+            echo=False,
+            query_cache_size=SQL_COMPILED_CACHE_SIZE
+        )
+        event.listen(engine.sync_engine, "before_cursor_execute", self._count_cache_outcome)
+        instrument_engine(engine.sync_engine)
+        return engine
+    
+    def _new_writer_session(self):
+        """Сессия на выделенном соединении писателя SQLite"""
+        if self._writer_session is None:
+            self._writer_engine = create_async_engine(
+                self.database_url,
+                echo=False,
+                query_cache_size=SQL_COMPILED_CACHE_SIZE,
+                # Одно постоянное соединение (по умолчанию для файловой SQLite - NullPool)
+                poolclass=AsyncAdaptedQueuePool,
+                pool_size=1,
+                max_overflow=0
+            )
+            sync_engine = self._writer_engine.sync_engine
+            event.listen(sync_engine, "connect", _sqlite_writer_connect)
+            event.listen(sync_engine, "begin", _sqlite_writer_begin)
+            event.listen(sync_engine, "before_cursor_execute", self._count_cache_outcome)
+            instrument_engine(sync_engine)
+            self._writer_session = sessionmaker(
+                self._writer_engine, class_=AsyncSession, expire_on_commit=False,
+                info={'channel_status': self.channel_status}
+            )
+        return self._writer_session()
+    
+    async def _write(self, job):
+        """Выполнение задачи записи job(session) с фиксацией транзакции.
         
-        self.engine = create_async_engine(self.database_url, echo=False)
-        self.async_session = sessionmaker(
-            self.engine, class_=AsyncSession, expire_on_commit=False
+        С писателем SQLite задача попадает в общую транзакцию пачки (в своей
+        точке сохранения), иначе выполняется в отдельной сессии. Ошибки
+        задачи, в том числе IntegrityError, передаются вызывающему.
+        """
+        if self.writer is not None:
+            return await self.writer.submit(job)
+        async with self.async_session() as session:
+            result = await job(session)
+            await session.commit()
+            return result
+    
+    @property
+    def engine(self):
+        """Движок SQLAlchemy (создается лениво)"""
+        if self._engine is None:
+            self._engine = self._create_engine(self.database_url)
+        return self._engine
+    
+    @property
+    def replica_engine(self):
+        """Движок реплики для чтения (создается лениво)"""
+        if self._replica_engine is None and self.replica_url:
+            self._replica_engine = self._create_engine(self.replica_url)
+        return self._replica_engine
+    
+    @property
+    def replica_available(self) -> bool:
+        """Настроена ли реплика и не исключена ли она после ошибки"""
+        return bool(self.replica_url) and time.monotonic() >= self._replica_down_until
+    
+    def _mark_replica_failed(self, error: Exception):
+        self._replica_down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+        logger.warning(
+            f"Реплика недоступна, чтение переключено на основную базу "
+            f"на {REPLICA_RETRY_SECONDS} с: {error}"
         )
     
+    def read_session(self):
+        """Сессия для чтения: реплика внутри методов с @read_only(stale_ok=True)"""
+        if _read_target.get() == 'replica' and self.replica_url:
+            if self._replica_session is None:
+                self._replica_session = sessionmaker(
+                    self.replica_engine, class_=AsyncSession, expire_on_commit=False,
+                    info={'channel_status': self.channel_status}
+                )
+            return self._replica_session()
+        return self.async_session()
+    
+    def _count_cache_outcome(self, conn, cursor, statement, parameters, context, executemany):
+        outcome = getattr(context, 'cache_hit', None)
+        if outcome in self._cache_stats:
+            self._cache_stats[outcome] += 1
+    
+    def compiled_cache_stats(self) -> dict:
+        """Статистика кэша скомпилированных запросов SQLAlchemy"""
+        hits = self._cache_stats[CacheStats.CACHE_HIT]
+        misses = self._cache_stats[CacheStats.CACHE_MISS]
+        stats = {outcome.name.lower(): count for outcome, count in self._cache_stats.items()}
+        # no_cache_key - DDL и PRAGMA создания таблиц при запуске: в долю
+        # попаданий не входят, иначе она занижена независимо от нагрузки
+        stats['hit_rate'] = hits / (hits + misses) if hits + misses else 0.0
+        stats['capacity'] = SQL_COMPILED_CACHE_SIZE
+        return stats
+    
+    @property
+    def async_session(self):
+        """Фабрика сессий (создается лениво)"""
+        if self._async_session is None:
+            self._async_session = sessionmaker(
+                self.engine, class_=AsyncSession, expire_on_commit=False,
+                info={'channel_status': self.channel_status}
+            )
+        return self._async_session
+    
     async def create_tables(self):
         """Создание таблиц в базе данных"""
         async with self.engine.begin() as conn:
+            if conn.dialect.name == 'postgresql':
+                await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
             await conn.run_sync(Base.metadata.create_all)
+            # create_all не добавляет новые колонки и индексы в уже существующие таблицы
+            added = await conn.run_sync(self._add_missing_columns)
+            if any(column in added for column in USER_SEARCH_FIELDS):
+                await self._backfill_search_fields(conn)
+            await conn.run_sync(self._create_missing_indexes)
         logger.info("Таблицы базы данных созданы")
     
+    @staticmethod
+    def _add_missing_columns(connection) -> set:
+        """Добавление колонок, объявленных в моделях после создания таблиц"""
+        inspector = inspect(connection)
+        added = set()
+        for table in Base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                added.add(column.name)
+                logger.info(f"Добавлена колонка {table.name}.{column.name}")
+        return added
+    
+    @staticmethod
+    async def _backfill_search_fields(conn, batch_size: int = 5000):
+        """Заполнение нормализованных колонок поиска для существующих пользователей"""
+        last_id = 0
+        while True:
+            rows = (await conn.execute(
+                select(User.id, User.username, User.first_name, User.last_name)
+                .where(User.id > last_id)
+                .order_by(User.id)
+                .limit(batch_size)
+            )).all()
+            if not rows:
+                break
+            await conn.execute(
+                update(User.__table__)
+                .where(User.__table__.c.id == bindparam('row_id'))
+                .values(
+                    username_lower=bindparam('username_lower'),
+                    first_name_lower=bindparam('first_name_lower'),
+                    last_name_lower=bindparam('last_name_lower')
+                ),
+                [
+                    {
+                        'row_id': row.id,
+                        'username_lower': normalize_search_text(row.username),
+                        'first_name_lower': normalize_search_text(row.first_name),
+                        'last_name_lower': normalize_search_text(row.last_name),
+                    }
+                    for row in rows
+                ]
+            )
+            last_id = rows[-1].id
+        logger.info("Колонки поиска пользователей заполнены")
+    
+    @staticmethod
+    def _create_missing_indexes(connection):
+        """Создание индексов, объявленных в моделях после создания таблиц"""
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+    
+    @read_only(stale_ok=False)
     async def get_user(self, telegram_id: int) -> User:
         """Получение пользователя по telegram_id"""
-        async with self.async_session() as session:
-            result = await session.execute(
-                select(User).where(User.telegram_id == telegram_id)
-            )
+        async with self.read_session() as session:
+            result = await session.execute(_USER_BY_TELEGRAM_ID, {'telegram_id': telegram_id})
             return result.scalar_one_or_none()
     
     async def get_user_by_id(self, telegram_id: int) -> User:
@@ -95,23 +757,65 @@ class Database:
         return await self.get_user(telegram_id)
     
     async def get_user_by_username(self, username: str) -> User:
-        """Получение пользователя по username"""
+        """Получение пользователя по username (без учета регистра)"""
         async with self.async_session() as session:
             result = await session.execute(
-                select(User).where(User.username == username)
+                _USER_BY_USERNAME, {'username': normalize_search_text(username.lstrip('@'))}
             )
-            return result.scalar_one_or_none()
+            return result.scalars().first()
     
+    @read_only(stale_ok=True)
     async def get_all_users(self) -> list[User]:
         """Получение всех пользователей"""
-        async with self.async_session() as session:
+        async with self.read_session() as session:
             result = await session.execute(select(User))
             return result.scalars().all()
     
-    async def get_user_subscriptions(self, telegram_id: int) -> list:
-        """Получение подписок пользователя"""
+    @read_only(stale_ok=True)
+    async def search_users(self, query: str, limit: int = 10, cursor: tuple = None) -> tuple:
+        """Регистронезависимый префиксный поиск по username, имени и фамилии.
+        
+        Запрос вида '@prefix' ищет только по username. Результаты идут
+        сначала по username, затем по имени и фамилии, внутри поля - по
+        значению и id; каждое поле читается диапазоном индекса с LIMIT,
+        поэтому стоимость страницы не зависит от размера таблицы.
+        
+        Возвращает (пользователи, курсор следующей страницы или None).
+        """
+        fields = USER_SEARCH_FIELDS[:1] if query.strip().startswith('@') else USER_SEARCH_FIELDS
+        prefix = normalize_search_text(query.strip().lstrip('@'))
+        if not prefix:
+            return [], None
+        
+        field_index, after_value, after_id = cursor or (0, None, None)
+        dialect_name = self.engine.dialect.name
+        params = _prefix_params(prefix, dialect_name)
+        found = []  # (номер поля, пользователь)
+        async with self.read_session() as session:
+            for index in range(field_index, len(fields)):
+                after = index == field_index and after_value is not None
+                stmt = _search_statement(dialect_name, fields, index, after)
+                # На одну строку больше страницы: по ней видно, есть ли
+                # следующая страница (в этом поле или в следующих)
+                result = await session.execute(stmt, {
+                    **params, 'after_value': after_value, 'after_id': after_id,
+                    'limit': limit + 1 - len(found)
+                })
+                found.extend((index, user) for user in result.scalars().all())
+                if len(found) > limit:
+                    break
+        
+        page = [user for _, user in found[:limit]]
+        if len(found) <= limit:
+            return page, None
+        index, last = found[limit - 1]
+        return page, (index, getattr(last, fields[index]), last.id)
+    
+    async def get_user_subscriptions(self, telegram_id: int, user: User = None) -> list:
+        """Получение подписок пользователя (user - уже загруженный пользователь)"""
         # Возвращаем информацию о подписке на основе данных пользователя
-        user = await self.get_user(telegram_id)
+        if user is None:
+            user = await self.get_user(telegram_id)
         if not user:
             return []
         
@@ -129,12 +833,10 @@ class Database:
     
     async def create_or_update_user(self, telegram_id: int, username: str = None, 
                                   first_name: str = None, last_name: str = None) -> User:
-        """Создание или обновление пользователя"""
-        async with self.async_session() as session:
+        """Создание или обновление пользователя (у нового user.is_new == True)"""
+        async def job(session):
             # Попытка найти существующего пользователя по telegram_id
-            result = await session.execute(
-                select(User).where(User.telegram_id == telegram_id)
-            )
+            result = await session.execute(_USER_BY_TELEGRAM_ID, {'telegram_id': telegram_id})
             user = result.scalar_one_or_none()
             
             if user:
@@ -153,25 +855,36 @@ class Database:
                 )
                 session.add(user)
             
-            await session.commit()
-            await session.refresh(user)
+            user.is_new = user.id is None
+            # Значения по умолчанию и id заполняются при flush
+            await session.flush()
             return user
+        
+        user = await self._write(job)
+        is_new = user.is_new
+        if is_new:
+            await self.events.publish(UserRegistered(telegram_id))
+        return user
     
     async def activate_premium(self, telegram_id: int, days: int = 30):
         """Активация премиум статуса для пользователя"""
-        async with self.async_session() as session:
-            user = await session.get(User, telegram_id)
+        async def job(session):
+            result = await session.execute(_USER_BY_TELEGRAM_ID, {'telegram_id': telegram_id})
+            user = result.scalar_one_or_none()
             if user:
                 user.is_premium = True
                 user.premium_until = datetime.utcnow() + timedelta(days=days)
                 user.updated_at = datetime.utcnow()
-                await session.commit()
-                logger.info(f"Премиум активирован для пользователя {telegram_id} на {days} дней")
+            return user is not None
+        
+        if await self._write(job):
+            logger.info("Премиум активирован для пользователя %s на %s дней", telegram_id, days)
     
     async def activate_subscription(self, telegram_id: int, days: int = 30):
         """Активация подписки на канал для пользователя"""
-        async with self.async_session() as session:
-            user = await session.get(User, telegram_id)
+        async def job(session):
+            result = await session.execute(_USER_BY_TELEGRAM_ID, {'telegram_id': telegram_id})
+            user = result.scalar_one_or_none()
             if user:
                 # Если у пользователя уже есть активная подписка, продлеваем её
                 if user.is_subscription_active:
@@ -179,53 +892,151 @@ class Database:
                 else:
                     user.subscription_until = datetime.utcnow() + timedelta(days=days)
                 user.updated_at = datetime.utcnow()
-                await session.commit()
-                logger.info(f"Подписка активирована для пользователя {telegram_id} на {days} дней")
+            return user
+        
+        user = await self._write(job)
+        if user:
+            logger.info("Подписка активирована для пользователя %s на %s дней", telegram_id, days)
+            await self.events.publish(SubscriptionExtended(telegram_id, days, user.subscription_until))
     
     async def update_channel_status(self, telegram_id: int, is_in_channel: bool):
-        """Обновление статуса нахождения пользователя в канале"""
-        from sqlalchemy import select
-        async with self.async_session() as session:
-            result = await session.execute(
-                select(User).where(User.telegram_id == telegram_id)
-            )
-            user = result.scalar_one_or_none()
-            if user:
-                user.is_in_channel = is_in_channel
-                user.updated_at = datetime.utcnow()
-                await session.commit()
-                logger.info(f"Статус канала обновлен для пользователя {telegram_id}: {is_in_channel}")
-            else:
-                logger.warning(f"Пользователь с telegram_id {telegram_id} не найден")
+        """Обновление статуса нахождения пользователя в канале.
+        
+        Запись отложенная (ChannelStatusBuffer): изменения за интервал
+        записываются одним запросом, а этот процесс видит их сразу.
+        """
+        self.channel_status.set(telegram_id, is_in_channel)
+        logger.debug("Статус канала пользователя %s: %s", telegram_id, is_in_channel)
     
+    @read_only(stale_ok=False)
     async def get_expired_subscriptions(self) -> list[User]:
         """Получение пользователей с истекшей подпиской"""
-        from sqlalchemy import select
-        async with self.async_session() as session:
-            result = await session.execute(
-                select(User).where(
-                    User.subscription_until < datetime.utcnow(),
-                    User.is_in_channel == True
-                )
-            )
+        # Фильтр по is_in_channel должен учитывать отложенные изменения; буферы
+        # других процессов записываются сами не позже чем через flush_seconds
+        await self.channel_status.flush()
+        async with self.read_session() as session:
+            result = await session.execute(_EXPIRED_SUBSCRIPTIONS, {'now': datetime.utcnow()})
             return result.scalars().all()
     
+    @read_only(stale_ok=True)
     async def get_active_subscribers(self) -> list[User]:
         """Получение пользователей с активной подпиской"""
-        from sqlalchemy import select
-        async with self.async_session() as session:
+        async with self.read_session() as session:
+            result = await session.execute(_ACTIVE_SUBSCRIBERS, {'now': datetime.utcnow()})
+            return result.scalars().all()
+    
+    @read_only(stale_ok=False)
+    async def get_due_reminders(self, days: int, start: datetime, end: datetime,
+                                after: tuple = None, limit: int = 500) -> list[tuple]:
+        """Подписки, заканчивающиеся в (start, end], без напоминания за days дней.
+        
+        Возвращает пары (telegram_id, subscription_until) по возрастанию срока;
+        последнюю пару передают в after для следующей страницы.
+        """
+        after_id, after_until = after or (0, start)
+        async with self.read_session() as session:
+            result = await session.execute(_DUE_REMINDERS, {
+                'start': start, 'end': end, 'after_until': after_until,
+                'after_id': after_id, 'days': days, 'limit': limit
+            })
+            return [tuple(row) for row in result.all()]
+    
+    async def mark_reminders_sent(self, days: int, rows: list[tuple]):
+        """Запись отправленных напоминаний (пары telegram_id, subscription_until)"""
+        if not rows:
+            return
+        now = datetime.utcnow()
+        await self._write(lambda session: session.execute(insert(ReminderSent), [
+            {'user_id': user_id, 'days': days, 'subscription_until': until, 'sent_at': now}
+            for user_id, until in rows
+        ]))
+    
+    async def purge_reminders(self, before: datetime) -> int:
+        """Удаление записей о напоминаниях по подпискам, закончившимся до before"""
+        result = await self._write(lambda session: session.execute(
+            delete(ReminderSent).where(ReminderSent.subscription_until < before)
+        ))
+        return result.rowcount
+    
+    @read_only(stale_ok=False)
+    async def get_products(self) -> list[CatalogProduct]:
+        """Активные подписки каталога в порядке показа"""
+        async with self.read_session() as session:
             result = await session.execute(
-                select(User).where(
-                    User.subscription_until > datetime.utcnow()
-                )
+                select(CatalogProduct)
+                .where(CatalogProduct.is_active == True)
+                .order_by(CatalogProduct.sort_order, CatalogProduct.id)
             )
             return result.scalars().all()
     
+    @read_only(stale_ok=False)
+    async def get_product(self, product_id: str) -> CatalogProduct:
+        """Подписка каталога по ID, в том числе снятая с продажи"""
+        async with self.read_session() as session:
+            result = await session.execute(select(CatalogProduct).where(CatalogProduct.id == product_id))
+            return result.scalar_one_or_none()
+    
+    async def seed_products(self, products: list[dict]) -> int:
+        """Заполнение пустого каталога; возвращает число добавленных подписок"""
+        async def job(session):
+            if (await session.execute(select(func.count(CatalogProduct.id)))).scalar():
+                return False
+            session.add_all(CatalogProduct(**product) for product in products)
+            return True
+        
+        try:
+            if not await self._write(job):
+                return 0
+        except IntegrityError:
+            # Каталог одновременно заполнила другая реплика
+            return 0
+        logger.info("Каталог заполнен подписками по умолчанию: %d", len(products))
+        return len(products)
+    
+    async def set_product_price(self, product_id: str, price: int) -> bool:
+        """Изменение цены подписки (False, если подписки нет)"""
+        result = await self._write(lambda session: session.execute(
+            update(CatalogProduct)
+            .where(CatalogProduct.id == product_id)
+            .values(price=price, updated_at=datetime.utcnow())
+        ))
+        if result.rowcount:
+            logger.info("Цена подписки %s изменена на %s", product_id, price)
+        return bool(result.rowcount)
+    
+    @read_only(stale_ok=True)
+    async def get_denied_user_ids(self) -> list[int]:
+        """ID пользователей, которым запрещена оплата"""
+        async with self.read_session() as session:
+            result = await session.execute(select(DeniedUser.user_id))
+            return result.scalars().all()
+    
+    async def deny_user(self, telegram_id: int, reason: str = None) -> bool:
+        """Запрет оплаты для пользователя (False, если запрет уже есть)"""
+        async def job(session):
+            session.add(DeniedUser(user_id=telegram_id, reason=reason))
+        
+        try:
+            await self._write(job)
+        except IntegrityError:
+            return False
+        logger.info("Оплата запрещена для пользователя %s: %s", telegram_id, reason)
+        return True
+    
+    async def allow_user(self, telegram_id: int) -> bool:
+        """Снятие запрета оплаты (False, если запрета не было)"""
+        result = await self._write(lambda session: session.execute(
+            delete(DeniedUser).where(DeniedUser.user_id == telegram_id)
+        ))
+        if result.rowcount:
+            logger.info("Запрет оплаты снят для пользователя %s", telegram_id)
+        return bool(result.rowcount)
+    
     async def create_purchase(self, user_id: int, product_id: str, product_title: str,
                             amount: int, telegram_payment_charge_id: str,
                             provider_payment_charge_id: str = None) -> Purchase:
         """Создание записи о покупке"""
-        async with self.async_session() as session:
+        async def job(session):
             purchase = Purchase(
                 user_id=user_id,
                 product_id=product_id,
@@ -235,141 +1046,503 @@ class Database:
                 provider_payment_charge_id=provider_payment_charge_id
             )
             session.add(purchase)
-            await session.commit()
-            await session.refresh(purchase)
-            logger.info(f"Создана запись о покупке: {purchase}")
+            # id и значения по умолчанию известны после flush
+            await session.flush()
             return purchase
+        
+        purchase = await self._write(job)
+        logger.info("Создана запись о покупке: %r", purchase)
+        await self.events.publish(PaymentCommitted(
+            user_id, purchase.id, product_id, product_title, amount, telegram_payment_charge_id
+        ))
+        return purchase
     
-    async def get_user_purchases(self, telegram_id: int) -> list[Purchase]:
-        """Получение всех покупок пользователя"""
-        from sqlalchemy import select
-        async with self.async_session() as session:
+    async def record_payment(self, user_id: int, product_id: str, product_title: str,
+                             amount: int, days: int, telegram_payment_charge_id: str,
+                             provider_payment_charge_id: str = None,
+                             effects: tuple = ()) -> Purchase:
+        """Фиксация оплаты одной транзакцией.
+        
+        Покупка, продление подписки и задачи outbox (кортежи
+        (kind, payload, dedup_key)) записываются вместе: либо все, либо
+        ничего. Повторная доставка того же платежа возвращает None.
+        """
+        async def job(session):
+            result = await session.execute(_USER_BY_TELEGRAM_ID, {'telegram_id': user_id})
+            user = result.scalar_one_or_none()
+            if user:
+                now = datetime.utcnow()
+                if user.is_subscription_active:
+                    user.subscription_until = user.subscription_until + timedelta(days=days)
+                else:
+                    user.subscription_until = now + timedelta(days=days)
+                user.updated_at = now
+            
+            purchase = Purchase(
+                user_id=user_id,
+                product_id=product_id,
+                product_title=product_title,
+                amount=amount,
+                telegram_payment_charge_id=telegram_payment_charge_id,
+                provider_payment_charge_id=provider_payment_charge_id
+            )
+            session.add(purchase)
+            for kind, payload, dedup_key in effects:
+                session.add(OutboxMessage(
+                    kind=kind,
+                    payload=json.dumps(payload, ensure_ascii=False),
+                    dedup_key=dedup_key
+                ))
+            return user, purchase
+        
+        try:
+            user, purchase = await self._write(job)
+        except IntegrityError:
+            logger.warning("Платеж %s уже обработан, повтор пропущен", telegram_payment_charge_id)
+            return None
+        
+        logger.info("Создана запись о покупке: %r, задач outbox: %s", purchase, len(effects))
+        await self.events.publish(PaymentCommitted(
+            user_id, purchase.id, product_id, product_title, amount, telegram_payment_charge_id
+        ))
+        if user:
+            await self.events.publish(SubscriptionExtended(user_id, days, user.subscription_until))
+        return purchase
+    
+    async def enqueue_outbox(self, kind: str, payload: dict, dedup_key: str) -> bool:
+        """Постановка задачи в outbox (False, если задача с таким ключом уже есть)"""
+        async def job(session):
+            session.add(OutboxMessage(
+                kind=kind,
+                payload=json.dumps(payload, ensure_ascii=False),
+                dedup_key=dedup_key
+            ))
+        
+        try:
+            await self._write(job)
+            return True
+        except IntegrityError:
+            return False
+    
+    async def claim_outbox(self, holder: str, limit: int, lock_seconds: int) -> list[OutboxMessage]:
+        """Захват готовых к выполнению задач outbox.
+        
+        Каждая задача захватывается условным UPDATE, поэтому несколько
+        реплик не возьмут одну задачу. Если реплика упадет, блокировка
+        истечет через lock_seconds и задачу подберет другая.
+        """
+        now = datetime.utcnow()
+        available = or_(OutboxMessage.locked_until.is_(None), OutboxMessage.locked_until < now)
+        
+        async def job(session):
             result = await session.execute(
-                select(Purchase).where(Purchase.user_id == telegram_id)
+                select(OutboxMessage.id)
+                .where(
+                    OutboxMessage.status == 'pending',
+                    OutboxMessage.next_attempt_at <= now,
+                    available
+                )
+                .order_by(OutboxMessage.next_attempt_at)
+                .limit(limit)
+            )
+            claimed = []
+            for message_id in result.scalars().all():
+                result = await session.execute(
+                    update(OutboxMessage)
+                    .where(
+                        OutboxMessage.id == message_id,
+                        OutboxMessage.status == 'pending',
+                        available
+                    )
+                    .values(
+                        locked_by=holder,
+                        locked_until=now + timedelta(seconds=lock_seconds),
+                        attempts=OutboxMessage.attempts + 1
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount:
+                    claimed.append(message_id)
+            
+            if not claimed:
+                return []
+            result = await session.execute(
+                select(OutboxMessage).where(OutboxMessage.id.in_(claimed))
             )
             return result.scalars().all()
+        
+        return await self._write(job)
     
-    async def get_total_users_count(self) -> int:
-        """Получение общего количества пользователей"""
-        from sqlalchemy import select, func
+    async def complete_outbox(self, message_id: int):
+        """Отметка задачи outbox как выполненной"""
+        await self._write(lambda session: session.execute(
+            _COMPLETE_OUTBOX, {'message_id': message_id, 'processed_at': datetime.utcnow()}
+        ))
+    
+    async def reschedule_outbox(self, message_id: int, error: str, next_attempt_at: datetime = None):
+        """Перенос задачи outbox на повтор (без next_attempt_at - окончательная ошибка)"""
+        values = {'locked_by': None, 'locked_until': None, 'last_error': error[:2000]}
+        if next_attempt_at is None:
+            values.update(status='failed', processed_at=datetime.utcnow())
+        else:
+            values['next_attempt_at'] = next_attempt_at
+        await self._write(lambda session: session.execute(
+            update(OutboxMessage).where(OutboxMessage.id == message_id).values(**values)
+        ))
+    
+    async def get_outbox_counts(self) -> dict:
+        """Количество задач outbox по статусам"""
         async with self.async_session() as session:
             result = await session.execute(
-                select(func.count(User.telegram_id))
+                select(OutboxMessage.status, func.count(OutboxMessage.id))
+                .group_by(OutboxMessage.status)
             )
+            return dict(result.all())
+    
+    @read_only(stale_ok=False)
+    async def get_user_purchases(self, telegram_id: int, include_archive: bool = False) -> list:
+        """Получение покупок пользователя в порядке id (с include_archive - и архивных)"""
+        async with self.read_session() as session:
+            result = await session.execute(_USER_PURCHASES, {'telegram_id': telegram_id})
+            purchases = result.scalars().all()
+            if not include_archive:
+                return purchases
+            result = await session.execute(_USER_ARCHIVED_PURCHASES, {'telegram_id': telegram_id})
+            return sorted([*result.scalars().all(), *purchases], key=lambda purchase: purchase.id)
+    
+    @read_only(stale_ok=True)
+    async def get_total_users_count(self) -> int:
+        """Получение общего количества пользователей"""
+        async with self.read_session() as session:
+            result = await session.execute(_COUNT_USERS)
             return result.scalar() or 0
     
+    @read_only(stale_ok=True)
     async def get_premium_users_count(self) -> int:
         """Получение количества премиум пользователей"""
-        from sqlalchemy import select, func
-        async with self.async_session() as session:
-            result = await session.execute(
-                select(func.count(User.telegram_id)).where(
-                    User.is_premium == True,
-                    User.premium_until > datetime.utcnow()
-                )
-            )
+        async with self.read_session() as session:
+            result = await session.execute(_COUNT_PREMIUM_USERS, {'now': datetime.utcnow()})
             return result.scalar() or 0
     
+    @read_only(stale_ok=True)
     async def get_total_purchases_count(self) -> int:
         """Получение общего количества покупок"""
-        from sqlalchemy import select, func
-        async with self.async_session() as session:
-            result = await session.execute(
-                select(func.count(Purchase.id))
-            )
+        async with self.read_session() as session:
+            result = await session.execute(_COUNT_PURCHASES)
             return result.scalar() or 0
     
+    @read_only(stale_ok=True)
     async def get_total_revenue(self) -> int:
         """Получение общего дохода в звездах"""
-        from sqlalchemy import select, func
-        async with self.async_session() as session:
-            result = await session.execute(
-                select(func.sum(Purchase.amount))
-            )
+        async with self.read_session() as session:
+            result = await session.execute(_TOTAL_REVENUE)
             return result.scalar() or 0
     
+    @read_only(stale_ok=True)
     async def get_recent_users(self, limit: int = 10) -> list[User]:
         """Получение последних зарегистрированных пользователей"""
-        from sqlalchemy import select
-        async with self.async_session() as session:
+        async with self.read_session() as session:
             result = await session.execute(
                 select(User).order_by(User.created_at.desc()).limit(limit)
             )
             return result.scalars().all()
     
+    @read_only(stale_ok=True)
     async def get_recent_purchases(self, limit: int = 10) -> list[Purchase]:
         """Получение последних покупок"""
-        from sqlalchemy import select
-        async with self.async_session() as session:
+        async with self.read_session() as session:
             result = await session.execute(
                 select(Purchase).order_by(Purchase.created_at.desc()).limit(limit)
             )
             return result.scalars().all()
     
+    async def iter_purchases(self, after_id: int = 0, created_before: datetime = None,
+                             batch_size: int = 1000):
+        """Покупки с id > after_id пачками по batch_size в порядке id.
+        
+        Каждая пачка читается отдельным запросом по первичному ключу
+        (keyset), поэтому память не зависит от размера таблицы. Архив
+        читается, только если after_id меньше последнего архивного id.
+        """
+        while True:
+            async with self.async_session() as session:
+                # Проверяется на каждой пачке: архивация может идти параллельно
+                archive_max_id = (await session.execute(select(func.max(ArchivedPurchase.id)))).scalar() or 0
+                batch = []
+                for model in ((ArchivedPurchase, Purchase) if after_id < archive_max_id else (Purchase,)):
+                    stmt = select(model).where(model.id > after_id)
+                    if created_before is not None:
+                        stmt = stmt.where(model.created_at < created_before)
+                    result = await session.execute(stmt.order_by(model.id).limit(batch_size))
+                    batch.extend(result.scalars().all())
+            if not batch:
+                return
+            batch = sorted(batch, key=lambda purchase: purchase.id)[:batch_size]
+            yield batch
+            after_id = batch[-1].id
+    
+    async def archive_purchases(self, before: datetime, batch_size: int = 5000) -> int:
+        """Перенос покупок старше before в архив; возвращает число перенесенных.
+        
+        Каждая пачка переносится одной транзакцией: строки копируются в
+        purchases_archive, их количество и сумма добавляются в итоги
+        purchase_rollups по дням и товарам, затем строки удаляются из
+        purchases. Пачки берутся по возрастанию id, поэтому повторный
+        запуск после сбоя продолжает с места остановки.
+        """
+        async def job(session):
+            result = await session.execute(
+                select(Purchase)
+                .where(Purchase.created_at < before)
+                .order_by(Purchase.id)
+                .limit(batch_size)
+            )
+            purchases = result.scalars().all()
+            if not purchases:
+                return 0, None
+            
+            now = datetime.utcnow()
+            await session.execute(insert(ArchivedPurchase), [
+                {**{column: getattr(purchase, column) for column in ARCHIVED_PURCHASE_COLUMNS},
+                 'archived_at': now}
+                for purchase in purchases
+            ])
+            
+            totals = {}
+            for purchase in purchases:
+                key = (purchase.created_at.date(), purchase.product_id)
+                count, revenue, _ = totals.get(key, (0, 0, None))
+                totals[key] = (count + 1, revenue + purchase.amount, purchase.product_title)
+            result = await session.execute(
+                select(PurchaseRollup).where(PurchaseRollup.day.in_({day for day, _ in totals}))
+            )
+            rollups = {(rollup.day, rollup.product_id): rollup for rollup in result.scalars().all()}
+            for (day, product_id), (count, revenue, title) in totals.items():
+                rollup = rollups.get((day, product_id))
+                if rollup is None:
+                    session.add(PurchaseRollup(
+                        day=day, product_id=product_id, product_title=title,
+                        count=count, revenue=revenue
+                    ))
+                else:
+                    rollup.count += count
+                    rollup.revenue += revenue
+                    rollup.product_title = title
+            
+            # Все строки старше before с id до последнего выбранного попали в пачку
+            await session.execute(
+                delete(Purchase).where(
+                    Purchase.id <= purchases[-1].id,
+                    Purchase.created_at < before
+                )
+            )
+            return len(purchases), purchases[-1].id
+        
+        moved = 0
+        while True:
+            count, last_id = await self._write(job)
+            if not count:
+                return moved
+            moved += count
+            logger.info("Перенесено в архив покупок: %d (до id %d)", moved, last_id)
+    
+    @read_only(stale_ok=True)
     async def get_all_user_ids(self) -> list[int]:
         """Получение всех ID пользователей для рассылки"""
-        from sqlalchemy import select
-        async with self.async_session() as session:
+        async with self.read_session() as session:
             result = await session.execute(
                 select(User.telegram_id)
             )
             return [row[0] for row in result.fetchall()]
-    
+
+    @read_only(stale_ok=True)
+    async def get_user_ids_page(self, after_id: int = 0, limit: int = 100) -> list[int]:
+        """ID пользователей больше after_id по возрастанию (страница рассылки)"""
+        async with self.read_session() as session:
+            result = await session.execute(_USER_IDS_PAGE, {'after_id': after_id, 'limit': limit})
+            return result.scalars().all()
+
+    @read_only(stale_ok=True)
     async def get_all_users(self) -> list[User]:
         """Получение всех пользователей"""
-        from sqlalchemy import select
-        async with self.async_session() as session:
+        async with self.read_session() as session:
             result = await session.execute(
                 select(User).order_by(User.created_at.desc())
             )
             return result.scalars().all()
     
+    @read_only(stale_ok=True)
     async def get_revenue_by_date(self, date) -> int:
         """Получение дохода за определенную дату"""
-        from sqlalchemy import select, func, and_
-        from datetime import datetime, timedelta
         
         # Преобразуем дату в datetime для начала и конца дня
         start_of_day = datetime.combine(date, datetime.min.time())
         end_of_day = start_of_day + timedelta(days=1)
         
-        async with self.async_session() as session:
-            result = await session.execute(
-                select(func.sum(Purchase.amount)).where(
-                    and_(
-                        Purchase.created_at >= start_of_day,
-                        Purchase.created_at < end_of_day
-                    )
-                )
-            )
+        async with self.read_session() as session:
+            result = await session.execute(_REVENUE_IN_RANGE, {
+                'start': start_of_day, 'end': end_of_day,
+                'start_day': start_of_day.date(), 'end_day': end_of_day.date()
+            })
             return result.scalar() or 0
     
+    @read_only(stale_ok=True)
     async def get_purchases_count_by_date(self, date) -> int:
         """Получение количества покупок за определенную дату"""
-        from sqlalchemy import select, func, and_
-        from datetime import datetime, timedelta
         
         # Преобразуем дату в datetime для начала и конца дня
         start_of_day = datetime.combine(date, datetime.min.time())
         end_of_day = start_of_day + timedelta(days=1)
         
-        async with self.async_session() as session:
+        async with self.read_session() as session:
+            result = await session.execute(_PURCHASES_COUNT_IN_RANGE, {
+                'start': start_of_day, 'end': end_of_day,
+                'start_day': start_of_day.date(), 'end_day': end_of_day.date()
+            })
+            return result.scalar() or 0
+    
+    @staticmethod
+    async def _db_utcnow(session) -> datetime:
+        """Текущее время UTC по часам сервера базы данных"""
+        if session.bind.dialect.name == 'sqlite':
+            value = (await session.execute(text("SELECT strftime('%Y-%m-%d %H:%M:%f', 'now')"))).scalar()
+            return datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
+        # PostgreSQL: now() с часовым поясом приводится к UTC без пояса, как в колонках DateTime
+        return (await session.execute(select(func.timezone('UTC', func.now())))).scalar()
+    
+    async def acquire_lease(self, name: str, holder: str, ttl_seconds: int) -> bool:
+        """Захват или продление аренды.
+        
+        Аренда достается реплике, если она уже ею владеет или срок
+        предыдущего владельца истек. Условный UPDATE атомарен и на SQLite,
+        и на PostgreSQL; первая запись создается через INSERT, гонку за
+        которую разрешает первичный ключ.
+        """
+        async def job(session):
+            # Срок считается по часам сервера базы, общим для всех реплик:
+            # расхождение часов реплик не продлевает и не сокращает аренду
+            now = await self._db_utcnow(session)
+            expires_at = now + timedelta(seconds=ttl_seconds)
             result = await session.execute(
-                select(func.count(Purchase.id)).where(
-                    and_(
-                        Purchase.created_at >= start_of_day,
-                        Purchase.created_at < end_of_day
-                    )
+                update(Lease)
+                .where(
+                    Lease.name == name,
+                    or_(Lease.holder == holder, Lease.expires_at < now)
                 )
+                .values(holder=holder, expires_at=expires_at, heartbeat_at=now)
+                .execution_options(synchronize_session=False)
             )
-            return result.scalar() or 0
+            if result.rowcount:
+                return True
+            
+            existing = await session.execute(select(Lease.name).where(Lease.name == name))
+            if existing.scalar_one_or_none() is not None:
+                # Аренда занята другой живой репликой
+                return False
+            
+            session.add(Lease(name=name, holder=holder, expires_at=expires_at, heartbeat_at=now))
+            return True
+        
+        try:
+            return await self._write(job)
+        except IntegrityError:
+            # Другая реплика успела создать запись раньше
+            return False
+    
+    async def release_lease(self, name: str, holder: str):
+        """Освобождение аренды, чтобы другая реплика могла сразу ее захватить"""
+        async def job(session):
+            now = await self._db_utcnow(session)
+            await session.execute(
+                update(Lease)
+                .where(Lease.name == name, Lease.holder == holder)
+                .values(expires_at=now - timedelta(seconds=1))
+                .execution_options(synchronize_session=False)
+            )
+        
+        await self._write(job)
+    
+    async def get_lease(self, name: str) -> Lease:
+        """Получение текущего состояния аренды"""
+        async with self.async_session() as session:
+            return await session.get(Lease, name)
+
+    async def save_checkpoint(self, name: str, holder: str, state: dict, status: str = 'running'):
+        """Запись прогресса задачи (контрольная точка создается при первой записи)"""
+        async def job(session):
+            await session.merge(JobCheckpoint(
+                name=name,
+                holder=holder,
+                status=status,
+                state=json.dumps(state, ensure_ascii=False),
+                updated_at=datetime.utcnow()
+            ))
+
+        await self._write(job)
+
+    async def delete_checkpoint(self, name: str):
+        """Удаление контрольной точки завершенной задачи"""
+        await self._write(lambda session: session.execute(
+            delete(JobCheckpoint).where(JobCheckpoint.name == name)
+        ))
+
+    async def claim_checkpoints(self, prefix: str, holder: str, stale_seconds: int) -> list[JobCheckpoint]:
+        """Захват прерванных задач с именем, начинающимся с prefix.
+
+        Прерванной считается задача, остановленная при завершении реплики
+        (status='interrupted'), или задача, прогресс которой не обновлялся
+        stale_seconds секунд (реплика упала). Условный UPDATE атомарен,
+        поэтому каждую задачу забирает одна реплика.
+        """
+        now = datetime.utcnow()
+        resumable = and_(
+            JobCheckpoint.name.startswith(prefix),
+            or_(
+                JobCheckpoint.status == 'interrupted',
+                JobCheckpoint.updated_at < now - timedelta(seconds=stale_seconds)
+            )
+        )
+        async def job(session):
+            result = await session.execute(select(JobCheckpoint.name).where(resumable))
+            claimed = []
+            for name in result.scalars().all():
+                result = await session.execute(
+                    update(JobCheckpoint)
+                    .where(JobCheckpoint.name == name, resumable)
+                    .values(holder=holder, status='running', updated_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount:
+                    claimed.append(name)
+            if not claimed:
+                return []
+            result = await session.execute(select(JobCheckpoint).where(JobCheckpoint.name.in_(claimed)))
+            return result.scalars().all()
+        
+        return await self._write(job)
+
+    async def ping(self):
+        """Проверка соединения с базой данных (открывает пул)"""
+        async with self.engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
     
     async def close(self):
         """Закрытие соединения с базой данных"""
-        await self.engine.dispose()
+        try:
+            await self.channel_status.close()
+        except Exception as e:
+            logger.error("Не удалось записать статус канала при остановке: %s", e)
+        if self.writer is not None:
+            await self.writer.close()
+        if self._writer_engine is not None:
+            await self._writer_engine.dispose()
+        if self._engine is not None:
+            await self._engine.dispose()
+        if self._replica_engine is not None:
+            await self._replica_engine.dispose()
 
 # Глобальный экземпляр базы данных
-db = Database(DATABASE_URL)
+db = Database(DATABASE_URL, DATABASE_REPLICA_URL or None)
 
 async def init_database():
     """Инициализация базы данных"""
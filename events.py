@@ -0,0 +1,155 @@
+import asyncio
+import inspect
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Type, Union
+from config import EVENT_QUEUE_SIZE, EVENT_PUBLISH_TIMEOUT_SECONDS
+from metrics import metrics
+from query_accounting import detach_query_stats
+
+logger = logging.getLogger(__name__)
+
+# События публикуются после фиксации транзакции, поэтому подписчик не
+# увидит событие по изменению, которое затем откатилось
+
+@dataclass(frozen=True)
+class UserRegistered:
+    """Новый пользователь"""
+    user_id: int
+
+@dataclass(frozen=True)
+class PaymentCommitted:
+    """Покупка записана в базу"""
+    user_id: int
+    purchase_id: int
+    product_id: str
+    product_title: str
+    amount: int
+    telegram_payment_charge_id: str
+
+@dataclass(frozen=True)
+class SubscriptionExtended:
+    """Подписка продлена (или активирована) до subscription_until"""
+    user_id: int
+    days: int
+    subscription_until: datetime
+
+@dataclass(frozen=True)
+class SubscriptionExpired:
+    """Подписка истекла, пользователь будет удален из канала"""
+    user_id: int
+
+@dataclass(frozen=True)
+class MemberJoined:
+    """Пользователю выдан доступ к каналу"""
+    user_id: int
+
+@dataclass(frozen=True)
+class MemberLeft:
+    """Пользователь удален из канала"""
+    user_id: int
+
+EventHandler = Callable[[Any], Union[None, Awaitable[None]]]
+
+class _Subscriber:
+    __slots__ = ("name", "handler", "is_async", "queue", "task")
+
+    def __init__(self, name: str, handler: EventHandler, queue_size: int):
+        self.name = name
+        self.handler = handler
+        self.is_async = inspect.iscoroutinefunction(handler)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.task: Optional[asyncio.Task] = None
+
+class EventBus:
+    """Шина событий внутри процесса.
+
+    У каждого подписчика своя ограниченная очередь и своя задача-обработчик,
+    поэтому медленный подписчик не задерживает остальных. Если очередь
+    подписчика заполнена, publish ждет освобождения места (обратное
+    давление на источник событий); если место не освободилось за
+    publish_timeout секунд, событие для этого подписчика отбрасывается
+    и учитывается в метрике events.dropped.<подписчик>.
+    """
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE,
+                 publish_timeout: float = EVENT_PUBLISH_TIMEOUT_SECONDS):
+        self.queue_size = queue_size
+        self.publish_timeout = publish_timeout
+        self._subscribers: Dict[type, List[_Subscriber]] = {}
+        self._closed = False
+
+    def subscribe(self, event_type: Type, handler: EventHandler,
+                  name: Optional[str] = None, queue_size: Optional[int] = None):
+        """Подписка handler (функция или корутина) на события типа event_type"""
+        name = name or getattr(handler, "__qualname__", repr(handler))
+        subscriber = _Subscriber(name, handler, queue_size or self.queue_size)
+        self._subscribers.setdefault(event_type, []).append(subscriber)
+
+    async def publish(self, event: Any):
+        """Передача события подписчикам его типа"""
+        subscribers = self._subscribers.get(type(event))
+        metrics.inc(f"events.published.{type(event).__name__}")
+        if not subscribers or self._closed:
+            return
+        for subscriber in subscribers:
+            if subscriber.task is None:
+                subscriber.task = asyncio.create_task(self._consume(subscriber), name=f"events:{subscriber.name}")
+            try:
+                subscriber.queue.put_nowait(event)
+                continue
+            except asyncio.QueueFull:
+                metrics.inc(f"events.backpressure.{subscriber.name}")
+            try:
+                await asyncio.wait_for(subscriber.queue.put(event), timeout=self.publish_timeout)
+            except asyncio.TimeoutError:
+                metrics.inc(f"events.dropped.{subscriber.name}")
+                logger.error("Подписчик %s не успевает, событие %r отброшено", subscriber.name, event)
+
+    async def _consume(self, subscriber: _Subscriber):
+        detach_query_stats()
+        while True:
+            event = await subscriber.queue.get()
+            try:
+                if subscriber.is_async:
+                    await subscriber.handler(event)
+                else:
+                    subscriber.handler(event)
+            except Exception as e:
+                metrics.inc(f"events.failed.{subscriber.name}")
+                logger.error("Ошибка подписчика %s на событие %r: %s", subscriber.name, event, e)
+            finally:
+                subscriber.queue.task_done()
+
+    async def drain(self, timeout: Optional[float] = None):
+        """Ожидание обработки уже опубликованных событий"""
+        queues = [
+            subscriber.queue.join()
+            for subscribers in self._subscribers.values() for subscriber in subscribers
+            if subscriber.task is not None
+        ]
+        if queues:
+            await asyncio.wait_for(asyncio.gather(*queues), timeout=timeout)
+
+    async def close(self, timeout: float = 5.0):
+        """Обработка оставшихся событий и остановка подписчиков"""
+        self._closed = True
+        try:
+            await self.drain(timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Не все события обработаны за %s с до остановки", timeout)
+        tasks = [
+            subscriber.task
+            for subscribers in self._subscribers.values() for subscriber in subscribers
+            if subscriber.task is not None
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for subscribers in self._subscribers.values():
+            for subscriber in subscribers:
+                subscriber.task = None
+
+# Глобальная шина событий процесса
+bus = EventBus()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Инкрементальная выгрузка покупок для бухгалтерии
+
+Выгружаются только покупки, появившиеся после прошлого запуска: номер
+последней выгруженной покупки (watermark) хранится в файле состояния
+рядом с выгрузками. Файлы сжимаются gzip и ротируются по числу строк.
+
+Запуск:
+    python exporter.py
+    python exporter.py --format jsonl
+    python exporter.py --replay 500
+"""
+
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+from config import (
+    EXPORT_DIR, EXPORT_FORMAT, EXPORT_BATCH_SIZE, EXPORT_MAX_FILE_ROWS,
+    EXPORT_REPLAY_WINDOW, EXPORT_SETTLE_SECONDS, EXPORT_INTERVAL_MINUTES
+)
+from metrics import metrics
+from utils import PURCHASE_CSV_HEADER, purchase_csv_row
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("csv", "jsonl")
+
+def purchase_json_row(purchase) -> dict:
+    """Запись JSON-lines для одной покупки"""
+    return {
+        "id": purchase.id,
+        "user_id": purchase.user_id,
+        "product_id": purchase.product_id,
+        "product_title": purchase.product_title,
+        "amount": purchase.amount,
+        "created_at": purchase.created_at.isoformat() if purchase.created_at else None,
+        "telegram_payment_charge_id": purchase.telegram_payment_charge_id,
+        "provider_payment_charge_id": purchase.provider_payment_charge_id,
+    }
+
+class _ExportFile:
+    """Сжатый файл выгрузки: пишется во временный файл и переименовывается при закрытии"""
+
+    def __init__(self, directory: str, fmt: str, first_id: int):
+        self.directory = directory
+        self.fmt = fmt
+        self.first_id = first_id
+        self.last_id = first_id
+        self.rows = 0
+        self.temp_path = os.path.join(directory, f".purchases-{first_id}.{fmt}.gz.part")
+        self._gzip = gzip.open(self.temp_path, "wt", encoding="utf-8", newline="")
+        if fmt == "csv":
+            self._writer = csv.writer(self._gzip)
+            self._writer.writerow(PURCHASE_CSV_HEADER)
+
+    def write(self, purchase):
+        if self.fmt == "csv":
+            self._writer.writerow(purchase_csv_row(purchase))
+        else:
+            self._gzip.write(json.dumps(purchase_json_row(purchase), ensure_ascii=False))
+            self._gzip.write("\n")
+        self.last_id = purchase.id
+        self.rows += 1
+
+    def close(self) -> str:
+        self._gzip.close()
+        path = os.path.join(self.directory, f"purchases-{self.first_id:010d}-{self.last_id:010d}.{self.fmt}.gz")
+        os.replace(self.temp_path, path)
+        return path
+
+    def discard(self):
+        self._gzip.close()
+        os.unlink(self.temp_path)
+
+class PurchaseExporter:
+    """Выгрузка новых покупок в ротируемые файлы с сохранением watermark.
+
+    Watermark сдвигается только после того, как файл полностью записан и
+    переименован, поэтому при падении посреди выгрузки следующий запуск
+    повторит незавершенный файл, а не потеряет строки. Покупки моложе
+    settle_seconds откладываются до следующего запуска, чтобы не пропустить
+    транзакции, зафиксированные не в порядке id.
+    """
+
+    def __init__(self, database, directory: str = EXPORT_DIR, fmt: str = EXPORT_FORMAT,
+                 batch_size: int = EXPORT_BATCH_SIZE, max_file_rows: int = EXPORT_MAX_FILE_ROWS,
+                 replay_window: int = EXPORT_REPLAY_WINDOW, settle_seconds: int = EXPORT_SETTLE_SECONDS):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+        self.database = database
+        self.directory = directory
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.max_file_rows = max_file_rows
+        self.replay_window = replay_window
+        self.settle_seconds = settle_seconds
+        self.state_path = os.path.join(directory, "purchases.watermark.json")
+
+    def load_watermark(self) -> int:
+        """ID последней выгруженной покупки (0, если выгрузок еще не было)"""
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return int(json.load(f)["last_id"])
+        except FileNotFoundError:
+            return 0
+
+    def save_watermark(self, last_id: int):
+        """Атомарная запись watermark"""
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"last_id": last_id, "updated_at": datetime.utcnow().isoformat()}, f)
+        os.replace(temp_path, self.state_path)
+
+    async def export(self, replay: int = 0) -> List[str]:
+        """Выгрузка покупок после watermark; возвращает пути созданных файлов.
+
+        replay сдвигает начало выгрузки на replay номеров покупок назад
+        (не больше replay_window), например если бухгалтерия потеряла файл.
+        """
+        if replay < 0 or replay > self.replay_window:
+            raise ValueError(f"Повторная выгрузка ограничена {self.replay_window} покупками")
+        os.makedirs(self.directory, exist_ok=True)
+
+        watermark = self.load_watermark()
+        after_id = max(0, watermark - replay)
+        created_before = datetime.utcnow() - timedelta(seconds=self.settle_seconds)
+
+        paths = []
+        current: Optional[_ExportFile] = None
+        exported = 0
+        try:
+            async for batch in self.database.iter_purchases(after_id, created_before, self.batch_size):
+                for purchase in batch:
+                    if current is None:
+                        current = _ExportFile(self.directory, self.fmt, purchase.id)
+                    current.write(purchase)
+                    if current.rows >= self.max_file_rows:
+                        paths.append(current.close())
+                        exported += current.rows
+                        watermark = max(watermark, current.last_id)
+                        self.save_watermark(watermark)
+                        current = None
+            if current is not None:
+                paths.append(current.close())
+                exported += current.rows
+                watermark = max(watermark, current.last_id)
+                self.save_watermark(watermark)
+                current = None
+        finally:
+            if current is not None:
+                current.discard()
+
+        metrics.inc("export.purchases.rows", exported)
+        metrics.set_gauge("export.purchases.watermark", watermark)
+        logger.info(f"Выгружено покупок: {exported}, файлов: {len(paths)}, watermark: {watermark}")
+        return paths
+
+async def export_purchases_task(exporter: PurchaseExporter, interval_minutes: int = EXPORT_INTERVAL_MINUTES):
+    """Периодическая выгрузка покупок (фоновая задача лидера)"""
+    while True:
+        try:
+            await exporter.export()
+        except Exception as e:
+            logger.error(f"Ошибка при выгрузке покупок: {e}")
+        await asyncio.sleep(interval_minutes * 60)
+
+async def _run(args):
+    from database import db
+
+    exporter = PurchaseExporter(db, directory=args.directory, fmt=args.format)
+    try:
+        for path in await exporter.export(replay=args.replay):
+            print(path)
+    finally:
+        await db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Инкрементальная выгрузка покупок")
+    parser.add_argument("--directory", default=EXPORT_DIR)
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default=EXPORT_FORMAT)
+    parser.add_argument("--replay", type=int, default=0, help="повторно выгрузить последние N покупок")
+    args = parser.parse_args()
+
+    from logging_setup import setup_logging
+
+    setup_logging()
+    asyncio.run(_run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.methods.base import TelegramType
+from config import (
+    HEALTH_HOST, HEALTH_PORT, HEALTH_MAX_LOOP_LAG_SECONDS,
+    HEALTH_UPDATES_STALE_SECONDS, HEALTH_DB_TIMEOUT_SECONDS, LOOP_LAG_INTERVAL_SECONDS
+)
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class LoopLagMonitor:
+    """Измерение задержки цикла событий.
+
+    Каждые interval секунд задача засыпает и сравнивает фактическое время
+    пробуждения с ожидаемым: разница - время, на которое цикл был занят
+    блокирующим кодом или длинной очередью готовых задач.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL_SECONDS):
+        self.interval = interval
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.last_tick: Optional[float] = None
+
+    async def run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.last_tick = time.monotonic()
+            metrics.observe("event_loop.lag_seconds", lag)
+            metrics.set_gauge("event_loop.lag_seconds", lag)
+
+    def current_lag(self) -> float:
+        """Текущая задержка с учетом того, что монитор сам может не просыпаться"""
+        if self.last_tick is None:
+            return 0.0
+        overdue = time.monotonic() - self.last_tick - self.interval
+        return max(self.last_lag, overdue)
+
+class UpdatesTracker(BaseRequestMiddleware):
+    """Время последнего успешного getUpdates (поллинг жив и Bot API доступен)"""
+
+    def __init__(self):
+        self.last_success: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Any:
+        if not isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+        try:
+            result = await make_request(bot, method)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            raise
+        self.last_success = time.monotonic()
+        self.last_error = None
+        return result
+
+    def seconds_since_success(self) -> Optional[float]:
+        if self.last_success is None:
+            return None
+        return time.monotonic() - self.last_success
+
+class HealthService:
+    """Состояние процесса для оркестратора.
+
+    /healthz - живость (цикл событий отвечает без большой задержки),
+    /readyz - готовность (база отвечает, getUpdates недавно проходил,
+    фоновые задачи не упали, реплика не останавливается), /tasks - состояние фоновых задач,
+    /metrics - снимок реестра метрик (с долей попаданий в кэш
+    скомпилированных запросов SQL).
+    """
+
+    def __init__(self, database, max_loop_lag: float = HEALTH_MAX_LOOP_LAG_SECONDS,
+                 updates_stale_seconds: float = HEALTH_UPDATES_STALE_SECONDS,
+                 db_timeout: float = HEALTH_DB_TIMEOUT_SECONDS):
+        self.database = database
+        self.max_loop_lag = max_loop_lag
+        self.updates_stale_seconds = updates_stale_seconds
+        self.db_timeout = db_timeout
+        self.loop_lag = LoopLagMonitor()
+        self.updates = UpdatesTracker()
+        self.leader = None
+        # Реплика останавливается и больше не принимает обновления
+        self.draining = False
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self._lag_task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def watch(self, name: str, task: asyncio.Task) -> asyncio.Task:
+        """Наблюдение за фоновой задачей: падение пишется в лог и снимает готовность"""
+        self._tasks[name] = task
+        task.add_done_callback(lambda done: self._on_task_done(name, done))
+        return task
+
+    def _on_task_done(self, name: str, task: asyncio.Task):
+        if self._stopping or self.draining or task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            metrics.inc(f"health.task_failed.{name}")
+            logger.error("Фоновая задача %s завершилась с ошибкой: %r", name, error)
+        else:
+            logger.warning("Фоновая задача %s завершилась", name)
+
+    @staticmethod
+    def _task_state(task: asyncio.Task) -> Dict[str, Any]:
+        if not task.done():
+            return {"state": "running"}
+        if task.cancelled():
+            return {"state": "cancelled"}
+        error = task.exception()
+        if error is not None:
+            return {"state": "failed", "error": f"{type(error).__name__}: {error}"}
+        return {"state": "finished"}
+
+    def tasks_status(self) -> Dict[str, Any]:
+        """Состояние наблюдаемых задач и задач лидера"""
+        status = {name: self._task_state(task) for name, task in self._tasks.items()}
+        if self.leader is not None:
+            status["leader"] = {
+                "is_leader": self.leader.is_leader,
+                "jobs": {name: self._task_state(task) for name, task in self.leader.jobs.items()},
+            }
+        return status
+
+    def liveness(self) -> Dict[str, Any]:
+        lag = self.loop_lag.current_lag()
+        return {
+            "ok": lag <= self.max_loop_lag,
+            "loop_lag_seconds": round(lag, 4),
+            "loop_lag_max_seconds": round(self.loop_lag.max_lag, 4),
+        }
+
+    async def readiness(self) -> Dict[str, Any]:
+        checks: Dict[str, Any] = {}
+
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.database.ping(), timeout=self.db_timeout)
+            checks["database"] = {"ok": True, "seconds": round(time.perf_counter() - started, 4)}
+        except Exception as e:
+            checks["database"] = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+        since = self.updates.seconds_since_success()
+        checks["updates"] = {
+            "ok": since is not None and since <= self.updates_stale_seconds,
+            "seconds_since_success": None if since is None else round(since, 1),
+            "last_error": self.updates.last_error,
+        }
+
+        failed = [name for name, task in self._tasks.items()
+                  if task.done() and not task.cancelled()]
+        checks["tasks"] = {"ok": not failed, "stopped": failed}
+
+        checks["loop"] = self.liveness()
+        checks["accepting"] = {"ok": not self.draining}
+        return {"ok": all(check["ok"] for check in checks.values()), "checks": checks}
+
+    async def _healthz(self, request: web.Request) -> web.Response:
+        body = self.liveness()
+        return web.json_response(body, status=200 if body["ok"] else 503)
+
+    async def _readyz(self, request: web.Request) -> web.Response:
+        body = await self.readiness()
+        return web.json_response(body, status=200 if body["ok"] else 503)
+
+    async def _tasks_handler(self, request: web.Request) -> web.Response:
+        return web.json_response(self.tasks_status())
+
+    def publish_database_gauges(self):
+        """Статистика кэша скомпилированных запросов в виде gauge db.compiled_cache.*"""
+        for name, value in self.database.compiled_cache_stats().items():
+            metrics.set_gauge(f"db.compiled_cache.{name}", value)
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        self.publish_database_gauges()
+        return web.json_response(metrics.snapshot())
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/healthz", self._healthz)
+        app.router.add_get("/readyz", self._readyz)
+        app.router.add_get("/tasks", self._tasks_handler)
+        app.router.add_get("/metrics", self._metrics)
+        return app
+
+    async def start(self, host: str = HEALTH_HOST, port: int = HEALTH_PORT):
+        """Запуск монитора задержки и HTTP-сервера (port=0 - только монитор)"""
+        self._lag_task = asyncio.create_task(self.loop_lag.run(), name="loop_lag")
+        if port <= 0:
+            return
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info("Проверка состояния доступна на http://%s:%s", host, port)
+
+    async def stop(self):
+        self._stopping = True
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+def setup_health(bot: Bot, database) -> HealthService:
+    """Подключение учета getUpdates к сессии бота"""
+    health = HealthService(database)
+    bot.session.middleware(health.updates)
+    return health
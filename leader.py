@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+from config import INSTANCE_ID, LEADER_LEASE_TTL_SECONDS, LEADER_HEARTBEAT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+JobFactory = Callable[[], Awaitable[None]]
+
+def default_instance_id() -> str:
+    """Идентификатор текущей реплики бота"""
+    if INSTANCE_ID:
+        return INSTANCE_ID
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+class LeaderElector:
+    """Выбор лидера среди реплик бота на основе аренды в базе данных.
+
+    Одиночные фоновые задачи (очистка подписок, агрегаты, напоминания)
+    регистрируются через register_job и запускаются только на реплике,
+    которая держит аренду. Остальные реплики простаивают и перехватывают
+    аренду не позже чем через ttl + heartbeat секунд после падения лидера.
+    """
+
+    def __init__(self, database, lease_name: str = "background",
+                 holder_id: Optional[str] = None,
+                 ttl_seconds: int = LEADER_LEASE_TTL_SECONDS,
+                 heartbeat_seconds: int = LEADER_HEARTBEAT_SECONDS):
+        if heartbeat_seconds * 2 > ttl_seconds:
+            raise ValueError("Интервал продления аренды должен быть не больше половины ее срока")
+
+        self.database = database
+        self.lease_name = lease_name
+        self.holder_id = holder_id or default_instance_id()
+        self.ttl_seconds = ttl_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+
+        self._job_factories: Dict[str, JobFactory] = {}
+        self._job_tasks: Dict[str, asyncio.Task] = {}
+        self._is_leader = False
+        self._last_renewal: Optional[float] = None
+        self._stopped = asyncio.Event()
+
+    @property
+    def is_leader(self) -> bool:
+        """Является ли текущая реплика лидером"""
+        return self._is_leader
+
+    @property
+    def jobs(self) -> Dict[str, asyncio.Task]:
+        """Запущенные на этой реплике фоновые задачи"""
+        return dict(self._job_tasks)
+
+    def register_job(self, name: str, factory: JobFactory):
+        """Регистрация одиночной фоновой задачи.
+
+        factory должна возвращать новую корутину при каждом вызове:
+        задача перезапускается при повторном получении лидерства.
+        """
+        self._job_factories[name] = factory
+        if self._is_leader:
+            self._start_job(name)
+
+    def _start_job(self, name: str):
+        task = self._job_tasks.get(name)
+        if task and not task.done():
+            return
+        if task and task.done() and not task.cancelled() and task.exception():
+            logger.error(f"Фоновая задача {name} завершилась с ошибкой: {task.exception()}")
+        self._job_tasks[name] = asyncio.create_task(self._job_factories[name](), name=name)
+        logger.info(f"Запущена фоновая задача {name} на реплике {self.holder_id}")
+
+    async def _stop_jobs(self):
+        tasks = [task for task in self._job_tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._job_tasks.clear()
+
+    async def _become_leader(self):
+        self._is_leader = True
+        logger.info(f"Реплика {self.holder_id} стала лидером ({self.lease_name})")
+        for name in self._job_factories:
+            self._start_job(name)
+
+    async def _step_down(self, reason: str):
+        self._is_leader = False
+        logger.warning(f"Реплика {self.holder_id} потеряла лидерство: {reason}")
+        await self._stop_jobs()
+
+    async def _tick(self):
+        loop = asyncio.get_running_loop()
+        # Аренда отсчитывается от начала запроса: позже ее срок не наступит
+        started = loop.time()
+        try:
+            # Зависший запрос не должен отложить проверку срока аренды
+            acquired = await asyncio.wait_for(
+                self.database.acquire_lease(self.lease_name, self.holder_id, self.ttl_seconds),
+                timeout=self.heartbeat_seconds
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при продлении аренды {self.lease_name}: {e!r}")
+            # Без связи с БД аренда может быть перехвачена другой репликой.
+            # Следующее решение будет не позже чем через heartbeat секунд паузы
+            # и heartbeat секунд ожидания запроса, поэтому задачи
+            # останавливаются, если к нему аренда уже может истечь
+            elapsed = loop.time() - self._last_renewal if self._last_renewal is not None else None
+            if self._is_leader and (elapsed is None or elapsed + 2 * self.heartbeat_seconds >= self.ttl_seconds):
+                await self._step_down("аренда не продлена вовремя")
+            return
+
+        if acquired:
+            self._last_renewal = started
+            if not self._is_leader:
+                await self._become_leader()
+            else:
+                # Перезапускаем упавшие задачи
+                for name in self._job_factories:
+                    self._start_job(name)
+        elif self._is_leader:
+            await self._step_down("аренда перехвачена другой репликой")
+
+    async def run(self):
+        """Цикл выбора лидера и продления аренды"""
+        logger.info(f"Запуск выбора лидера: реплика {self.holder_id}, аренда {self.lease_name}")
+        while not self._stopped.is_set():
+            await self._tick()
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=self.heartbeat_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        """Остановка задач и освобождение аренды"""
+        self._stopped.set()
+        was_leader = self._is_leader
+        self._is_leader = False
+        await self._stop_jobs()
+        if was_leader:
+            try:
+                await self.database.release_lease(self.lease_name, self.holder_id)
+                logger.info(f"Аренда {self.lease_name} освобождена репликой {self.holder_id}")
+            except Exception as e:
+                logger.error(f"Не удалось освободить аренду {self.lease_name}: {e}")
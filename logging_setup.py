@@ -0,0 +1,176 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiogram import BaseMiddleware, Dispatcher, types
+from config import LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES
+from metrics import metrics
+
+# Контекст текущего обновления: попадает в каждую запись лога
+update_id_var: ContextVar[Optional[int]] = ContextVar("log_update_id", default=None)
+user_id_var: ContextVar[Optional[int]] = ContextVar("log_user_id", default=None)
+
+# Типы аргументов, которые безопасно форматировать позже в потоке записи
+_LAZY_ARG_TYPES = (str, int, float, bool, type(None))
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def parse_sample_rates(rates: str) -> Dict[str, float]:
+    """Разбор правил вида 'database=0.1,admin=0.5' (имя логгера = доля записей)"""
+    parsed = {}
+    for item in rates.split(","):
+        if not item.strip():
+            continue
+        name, _, rate = item.partition("=")
+        parsed[name.strip()] = float(rate)
+    return parsed
+
+class ContextFilter(logging.Filter):
+    """Добавление update_id и user_id текущего обновления в запись"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id = update_id_var.get()
+        record.user_id = getattr(record, "user_id", None) or user_id_var.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Выборочная запись массовых событий уровня ниже WARNING.
+
+    Доля задается по имени логгера (с учетом родителей) или для отдельной
+    записи через extra={"sample_rate": 0.01}. Предупреждения и ошибки
+    пишутся всегда.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def _rate(self, name: str) -> float:
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = getattr(record, "sample_rate", None)
+        if rate is None:
+            rate = self._rate(record.name)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        metrics.inc("logging.sampled_out")
+        return False
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        update_id = getattr(record, "update_id", None)
+        if update_id is not None:
+            entry["update_id"] = update_id
+        user_id = getattr(record, "user_id", None)
+        if user_id is not None:
+            entry["user_id"] = user_id
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который не блокирует цикл событий.
+
+    Сообщение форматируется в фоновом потоке, если аргументы - простые
+    значения; объекты (модели, исключения) форматируются сразу, пока их
+    состояние не изменилось. При переполнении очереди запись отбрасывается
+    и учитывается в метрике logging.dropped.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args and not all(isinstance(arg, _LAZY_ARG_TYPES) for arg in
+                                   (record.args if isinstance(record.args, tuple) else (record.args,))):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("logging.dropped")
+
+class LogContextMiddleware(BaseMiddleware):
+    """Установка update_id и user_id для логов на время обработки обновления"""
+
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: types.Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        update_token = update_id_var.set(event.update_id)
+        user_token = user_id_var.set(user.id if user else None)
+        try:
+            return await handler(event, data)
+        finally:
+            update_id_var.reset(update_token)
+            user_id_var.reset(user_token)
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT,
+                  stream=None) -> logging.handlers.QueueListener:
+    """Настройка логирования через очередь и фоновый поток записи.
+
+    Обработчики корня заменяются на NonBlockingQueueHandler; запись в
+    stream (по умолчанию stderr) выполняет QueueListener. fmt - "json"
+    или "text". Повторный вызов перенастраивает логирование.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    sink = logging.StreamHandler(stream or sys.stderr)
+    if fmt == "json":
+        sink.setFormatter(JsonFormatter())
+    else:
+        sink.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    if _listener is None:
+        atexit.register(stop_logging)
+    _listener = logging.handlers.QueueListener(log_queue, sink, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def stop_logging():
+    """Запись оставшихся в очереди сообщений и остановка фонового потока"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def setup_log_context(dp: Dispatcher):
+    """Подключение контекста обновления к логам"""
+    dp.update.outer_middleware(LogContextMiddleware())
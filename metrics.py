@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Dict
+
+class Timing:
+    """Статистика длительностей: количество, сумма, максимум и окно последних значений"""
+
+    __slots__ = ("count", "total", "max", "recent")
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        self.recent.append(value)
+
+    def percentile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+class Metrics:
+    """Реестр метрик процесса: счетчики, текущие значения и длительности"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._gauges: Dict[str, float] = {}
+        self._timings: Dict[str, Timing] = {}
+        self.started_at = time.time()
+
+    def inc(self, name: str, value: int = 1):
+        """Увеличение счетчика"""
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float):
+        """Установка текущего значения"""
+        self._gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        """Регистрация длительности или размера"""
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = Timing()
+            timing.observe(value)
+
+    def counter(self, name: str) -> int:
+        return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Снимок всех метрик"""
+        with self._lock:
+            return {
+                "uptime_seconds": time.time() - self.started_at,
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timings": {name: timing.as_dict() for name, timing in self._timings.items()},
+            }
+
+# Глобальный реестр метрик
+metrics = Metrics()
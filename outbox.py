@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+from config import (
+    OUTBOX_CONCURRENCY, OUTBOX_POLL_SECONDS, OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_BACKOFF_SECONDS, OUTBOX_MAX_BACKOFF_SECONDS, OUTBOX_LOCK_SECONDS
+)
+from leader import default_instance_id
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Типы задач outbox
+GRANT_CHANNEL_ACCESS = "grant_channel_access"
+
+OutboxHandler = Callable[[dict], Awaitable[None]]
+
+class PermanentOutboxError(Exception):
+    """Ошибка, при которой повтор задачи бессмыслен (например, пользователь заблокировал бота)"""
+
+class OutboxWorker:
+    """Выполнение задач outbox с повторами и экспоненциальной паузой.
+
+    Задачи записываются в одной транзакции с покупкой (Database.record_payment),
+    поэтому после оплаты они не теряются даже при падении процесса. Воркер
+    может работать на каждой реплике: задачи захватываются условным UPDATE
+    с блокировкой на OUTBOX_LOCK_SECONDS, а обработчик прерывается через
+    80% этого срока.
+    """
+
+    def __init__(self, database, holder_id: Optional[str] = None,
+                 concurrency: int = OUTBOX_CONCURRENCY,
+                 poll_seconds: float = OUTBOX_POLL_SECONDS,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 backoff_seconds: float = OUTBOX_BACKOFF_SECONDS,
+                 max_backoff_seconds: float = OUTBOX_MAX_BACKOFF_SECONDS,
+                 lock_seconds: int = OUTBOX_LOCK_SECONDS):
+        self.database = database
+        self.holder_id = holder_id or default_instance_id()
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.lock_seconds = lock_seconds
+        # Обработчик прерывается раньше, чем истечет блокировка задачи: иначе
+        # ее захватит другая реплика и действие (например, ссылка-приглашение)
+        # выполнится дважды. Остаток срока - на запись результата
+        self.handler_timeout = lock_seconds * 0.8
+
+        self._handlers: Dict[str, OutboxHandler] = {}
+        self._failure_handlers: Dict[str, OutboxHandler] = {}
+        self._counts_updated_at = 0.0
+        self._wakeup = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, kind: str, handler: OutboxHandler,
+                 on_failure: Optional[OutboxHandler] = None):
+        """Регистрация обработчика задач типа kind (получает payload задачи).
+
+        on_failure вызывается один раз, когда задача окончательно не выполнена.
+        """
+        self._handlers[kind] = handler
+        if on_failure is not None:
+            self._failure_handlers[kind] = on_failure
+
+    def wake(self):
+        """Немедленный опрос outbox (после записи новой задачи)"""
+        self._wakeup.set()
+
+    def backoff(self, attempts: int) -> float:
+        """Пауза перед следующей попыткой: экспонента с небольшим случайным разбросом"""
+        delay = min(self.backoff_seconds * 2 ** (attempts - 1), self.max_backoff_seconds)
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _process(self, message):
+        handler = self._handlers.get(message.kind)
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise PermanentOutboxError(f"нет обработчика для задачи {message.kind}")
+            await asyncio.wait_for(handler(message.data), timeout=self.handler_timeout)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if isinstance(e, PermanentOutboxError) or message.attempts >= self.max_attempts:
+                await self.database.reschedule_outbox(message.id, error)
+                metrics.inc(f"outbox.failed.{message.kind}")
+                logger.error(
+                    f"Задача outbox {message.id} ({message.kind}) не выполнена "
+                    f"после {message.attempts} попыток: {error}"
+                )
+                on_failure = self._failure_handlers.get(message.kind)
+                if on_failure is not None:
+                    try:
+                        await on_failure(message.data)
+                    except Exception as failure_error:
+                        logger.error(f"Ошибка обработки отказа задачи outbox {message.id}: {failure_error}")
+            else:
+                delay = self.backoff(message.attempts)
+                await self.database.reschedule_outbox(
+                    message.id, error, datetime.utcnow() + timedelta(seconds=delay)
+                )
+                metrics.inc(f"outbox.retried.{message.kind}")
+                logger.warning(
+                    f"Задача outbox {message.id} ({message.kind}), попытка {message.attempts}: "
+                    f"{error}; повтор через {delay:.0f} с"
+                )
+            return
+
+        await self.database.complete_outbox(message.id)
+        metrics.inc(f"outbox.done.{message.kind}")
+        metrics.observe(f"outbox.handler_seconds.{message.kind}", time.perf_counter() - started)
+        metrics.observe("outbox.delivery_seconds", (datetime.utcnow() - message.created_at).total_seconds())
+
+    async def run_once(self) -> int:
+        """Один проход: захват и выполнение готовых задач; возвращает их количество"""
+        messages = await self.database.claim_outbox(self.holder_id, self.concurrency, self.lock_seconds)
+        if messages:
+            await asyncio.gather(*(self._process(message) for message in messages))
+        return len(messages)
+
+    async def _publish_counts(self):
+        # Размер очереди для метрик, не чаще раза в 30 секунд
+        if time.monotonic() - self._counts_updated_at < 30:
+            return
+        self._counts_updated_at = time.monotonic()
+        for status, count in (await self.database.get_outbox_counts()).items():
+            if status != "done":
+                metrics.set_gauge(f"outbox.{status}", count)
+
+    async def run(self):
+        """Цикл опроса outbox до вызова stop()"""
+        logger.info(f"Outbox запущен на реплике {self.holder_id}")
+        self._task = asyncio.current_task()
+        while not self._stopped.is_set():
+            # Сигнал, пришедший во время прохода, не теряется
+            self._wakeup.clear()
+            try:
+                processed = await self.run_once()
+                await self._publish_counts()
+            except Exception as e:
+                logger.error(f"Ошибка при обработке outbox: {e}")
+                processed = 0
+            if processed == self.concurrency:
+                # Задач больше, чем помещается в один проход
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self, timeout: Optional[float] = None):
+        """Остановка после завершения текущего прохода.
+
+        С timeout ожидает окончания прохода не дольше timeout секунд;
+        незавершенные задачи после истечения блокировки возьмет другая реплика.
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        if timeout and self._task is not None and not self._task.done():
+            await asyncio.wait({self._task}, timeout=timeout)
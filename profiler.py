@@ -0,0 +1,99 @@
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Optional
+from config import PROFILE_MAX_SECONDS, PROFILE_TOP_ENTRIES
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Одновременно выполняется только одно профилирование
+_lock = asyncio.Lock()
+
+class ProfilerBusyError(Exception):
+    """Профилирование уже запущено"""
+
+def is_running() -> bool:
+    return _lock.locked()
+
+def _cpu_report(profile: cProfile.Profile, top: int) -> str:
+    stream = io.StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+    stats.strip_dirs()
+    stream.write("=== По суммарному времени (cumulative) ===\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    stream.write("\n=== По собственному времени (tottime) ===\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(top)
+    return stream.getvalue()
+
+def _memory_report(snapshot: tracemalloc.Snapshot, top: int) -> str:
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    lines = ["=== Места выделения памяти (живые объекты) ==="]
+    stats = snapshot.statistics("lineno")
+    for stat in stats[:top]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:10.1f} KiB {stat.count:8d} объектов  {frame.filename}:{frame.lineno}")
+    total = sum(stat.size for stat in stats)
+    lines.append(f"Всего: {total / 1024 / 1024:.1f} MiB")
+    return "\n".join(lines) + "\n"
+
+async def profile(seconds: float, memory: bool = False, top: int = PROFILE_TOP_ENTRIES) -> str:
+    """Профилирование процесса на живом трафике в течение seconds секунд.
+
+    cProfile включается только на время замера в потоке цикла событий, где
+    выполняются все обработчики; вне замера профилировщик не установлен и
+    накладных расходов нет. memory=True дополнительно включает tracemalloc.
+    Возвращает текстовый отчет.
+    """
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise ValueError(f"Длительность профилирования - от 1 до {PROFILE_MAX_SECONDS} секунд")
+    if _lock.locked():
+        raise ProfilerBusyError("Профилирование уже выполняется")
+
+    async with _lock:
+        started_at = datetime.utcnow()
+        tracing = memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start(1)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot() if memory and tracemalloc.is_tracing() else None
+            if tracing:
+                tracemalloc.stop()
+
+    metrics.inc("profiler.runs")
+    logger.info("Профилирование завершено: %.1f с, память: %s", elapsed, memory)
+
+    header = (
+        f"Профиль процесса: {started_at.strftime('%Y-%m-%d %H:%M:%S')} UTC, "
+        f"{elapsed:.1f} с, tracemalloc: {'да' if snapshot is not None else 'нет'}\n\n"
+    )
+    report = header + _cpu_report(profiler, top)
+    if snapshot is not None:
+        report += "\n" + _memory_report(snapshot, top)
+    return report
+
+def parse_profile_args(text: Optional[str], default_seconds: float) -> tuple:
+    """Разбор аргументов команды: '/profile 30 mem' -> (30.0, True)"""
+    seconds = default_seconds
+    memory = False
+    for arg in (text or "").split()[1:]:
+        if arg.lower() in ("mem", "memory", "память"):
+            memory = True
+        else:
+            seconds = float(arg)
+    return seconds, memory
@@ -0,0 +1,189 @@
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+from aiogram import BaseMiddleware, Dispatcher, types
+from sqlalchemy import event
+from sqlalchemy.orm import ORMExecuteState, Session
+from config import (
+    QUERY_ACCOUNTING, QUERY_BUDGET_COUNT, QUERY_BUDGET_SECONDS, QUERY_REPEAT_THRESHOLD
+)
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+QUERY_ACCOUNTING_MODES = ("off", "metrics", "debug")
+
+class QueryStats:
+    """Запросы к базе, выполненные в рамках одного обновления (или блока count_queries)"""
+
+    __slots__ = ("queries", "rows", "seconds", "handler", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        # Измененные (rowcount) и выбранные строки
+        self.rows = 0
+        self.seconds = 0.0
+        self.handler: Optional[str] = None
+        # Текст запроса -> число выполнений
+        self.statements: Counter = Counter()
+
+    @property
+    def repeated(self) -> Dict[str, int]:
+        """Запросы, выполненные не меньше QUERY_REPEAT_THRESHOLD раз (признак N+1)"""
+        return {
+            statement: count for statement, count in self.statements.items()
+            if count >= QUERY_REPEAT_THRESHOLD
+        }
+
+    def __repr__(self) -> str:
+        return f"<QueryStats queries={self.queries} rows={self.rows} seconds={self.seconds:.4f}>"
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        context._query_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None:
+        return
+    stats.seconds += time.perf_counter() - getattr(context, "_query_started", time.perf_counter())
+    stats.queries += 1
+    stats.statements[statement] += 1
+    # Для SELECT rowcount не определен: выбранные строки считает _count_selected_rows
+    if (context.isinsert or context.isupdate or context.isdelete) and cursor.rowcount > 0:
+        stats.rows += cursor.rowcount
+
+def _count_selected_rows(orm_execute_state: ORMExecuteState):
+    stats = _current.get()
+    if stats is None or not orm_execute_state.is_select:
+        return None
+    options = orm_execute_state.execution_options
+    if options.get("stream_results") or options.get("yield_per"):
+        # Потоковое чтение не буферизуется ради подсчета
+        return None
+    # Результат читается целиком (асинхронная сессия и так буферизует
+    # строки) и возвращается вызывающему из памяти
+    frozen = orm_execute_state.invoke_statement().freeze()
+    stats.rows += len(frozen.rewrite_rows())
+    return frozen()
+
+def instrument_engine(sync_engine):
+    """Подключение учета запросов к движку (без активного учета - одна проверка contextvar)"""
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    # Выбранные строки считаются на уровне сессий ORM (общий обработчик для всех)
+    if not event.contains(Session, "do_orm_execute", _count_selected_rows):
+        event.listen(Session, "do_orm_execute", _count_selected_rows)
+
+def detach_query_stats():
+    """Отключение учета запросов в текущей задаче.
+
+    Задача, созданная во время обработки обновления, наследует его
+    счетчик и добавляла бы запросы к уже завершенному обновлению. Фоновые
+    задачи (рассылка, запись буфера, подписчики шины событий, писатель
+    SQLite) вызывают эту функцию первой: у задачи своя копия контекста,
+    поэтому обработчик продолжает считать свои запросы.
+    """
+    _current.set(None)
+
+@contextmanager
+def count_queries() -> Iterator[QueryStats]:
+    """Подсчет запросов внутри блока, например в бенчмарках и проверках:
+
+        with count_queries() as stats:
+            await db.get_user(user_id)
+        assert stats.queries == 1
+    """
+    stats = QueryStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Запоминание имени обработчика, которому достались запросы обновления"""
+
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: types.TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        stats = _current.get()
+        if stats is not None:
+            callback = getattr(data.get("handler"), "callback", None)
+            stats.handler = getattr(callback, "__name__", None)
+        return await handler(event, data)
+
+class QueryAccountingMiddleware(BaseMiddleware):
+    """Учет запросов к базе на каждое обновление.
+
+    Внешний middleware на dp.update открывает счетчик, HandlerNameMiddleware
+    на наблюдателях событий запоминает имя сработавшего обработчика. По
+    окончании обработки публикуются метрики db.queries.<обработчик>,
+    db.rows.<обработчик> и db.seconds.<обработчик>; обновления сверх бюджета (число запросов или
+    суммарное время) и повторяющиеся запросы (N+1) пишутся в лог, в режиме
+    debug - вместе с текстами запросов.
+    """
+
+    def __init__(self, debug: bool = False, budget_count: int = QUERY_BUDGET_COUNT,
+                 budget_seconds: float = QUERY_BUDGET_SECONDS):
+        self.debug = debug
+        self.budget_count = budget_count
+        self.budget_seconds = budget_seconds
+
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: types.Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        with count_queries() as stats:
+            try:
+                return await handler(event, data)
+            finally:
+                self._publish(event, stats)
+
+    def _publish(self, update: types.Update, stats: QueryStats):
+        name = stats.handler or "unhandled"
+        metrics.observe(f"db.queries.{name}", stats.queries)
+        if stats.queries:
+            metrics.observe(f"db.seconds.{name}", stats.seconds)
+            metrics.observe(f"db.rows.{name}", stats.rows)
+
+        repeated = stats.repeated
+        if repeated:
+            metrics.inc(f"db.repeated_queries.{name}")
+        over_budget = stats.queries > self.budget_count or stats.seconds > self.budget_seconds
+        if over_budget:
+            metrics.inc(f"db.over_budget.{name}")
+        if not over_budget and not repeated:
+            return
+
+        logger.warning(
+            "Обновление %s (%s): %d запросов к базе, %d строк, %.1f мс%s",
+            update.update_id, name, stats.queries, stats.rows, stats.seconds * 1000, ", есть повторяющиеся запросы (N+1)" if repeated else ""
+        )
+        if self.debug:
+            for statement, count in stats.statements.most_common():
+                logger.warning("  %dx %s", count, " ".join(statement.split()))
+
+def setup_query_accounting(dp: Dispatcher, mode: str = QUERY_ACCOUNTING) -> Optional[QueryAccountingMiddleware]:
+    """Подключение учета запросов к диспетчеру (mode: off, metrics или debug)"""
+    if mode not in QUERY_ACCOUNTING_MODES:
+        raise ValueError(f"Неизвестный режим учета запросов: {mode}")
+    if mode == "off":
+        return None
+    middleware = QueryAccountingMiddleware(debug=mode == "debug")
+    dp.update.outer_middleware(middleware)
+    handler_name = HandlerNameMiddleware()
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(handler_name)
+    return middleware
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from catalog import Product, get_catalog
+from config import (
+    REMINDER_WINDOWS_DAYS, REMINDER_INTERVAL_MINUTES,
+    REMINDER_BATCH_SIZE, REMINDER_RATE_PER_SECOND, REMINDER_RENEW_PRODUCT
+)
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=16)
+def get_renew_keyboard(product: Optional[Product]) -> InlineKeyboardMarkup:
+    """Кнопка продления сразу выставляет счет (обработчик buy_ в bot.py).
+
+    Ключ кэша - подписка целиком, поэтому после смены цены строится новая клавиатура.
+    """
+    keyboard = InlineKeyboardBuilder()
+    if product is not None:
+        keyboard.button(text=f"🔄 Продлить за {product.price} ⭐", callback_data=f"buy_{product.id}")
+    keyboard.button(text="💎 Все подписки", callback_data="subscriptions")
+    keyboard.adjust(1)
+    return keyboard.as_markup()
+
+def reminder_text(subscription_until: datetime, now: datetime) -> str:
+    days_left = max(1, math.ceil((subscription_until - now).total_seconds() / 86400))
+    return (
+        f"⏳ Ваша подписка на канал заканчивается "
+        f"{subscription_until.strftime('%d.%m.%Y %H:%M')} UTC (осталось дней: {days_left}).\n\n"
+        "После окончания подписки доступ к каналу будет закрыт. "
+        "Продлите ее заранее - новый срок добавится к текущему."
+    )
+
+class RenewalReminders:
+    """Напоминания о скором окончании подписки.
+
+    Для каждого окна (например, за 3 дня и за 1 день) выбираются подписки,
+    заканчивающиеся между текущим и следующим окном: пользователь с
+    подпиской на 2 дня получит только напоминание за 1 день, когда до него
+    дойдет. Окно читается по индексу subscription_until страницами по
+    batch_size, поэтому проход стоит пропорционально числу пользователей,
+    которым пора напомнить, а не размеру таблицы. Страница записывается в
+    reminders_sent до отправки: при сбое напоминание может не дойти, но
+    дважды не придет. Сообщения отправляются не чаще rate в секунду.
+    """
+
+    def __init__(self, bot: Bot, database, windows: List[int] = REMINDER_WINDOWS_DAYS,
+                 batch_size: int = REMINDER_BATCH_SIZE, rate: float = REMINDER_RATE_PER_SECOND,
+                 renew_product: str = REMINDER_RENEW_PRODUCT):
+        self.bot = bot
+        self.database = database
+        self.windows = sorted(windows, reverse=True)
+        self.batch_size = batch_size
+        self.interval = 1 / rate
+        self.renew_product = renew_product
+        self._next_send = 0.0
+
+    async def _pace(self):
+        # Равномерная отправка: не чаще одного сообщения за interval
+        delay = self._next_send - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._next_send = max(self._next_send, time.monotonic()) + self.interval
+
+    async def send(self, user_id: int, subscription_until: datetime, now: datetime) -> bool:
+        """Отправка одного напоминания; False, если пользователь недоступен"""
+        for attempt in range(2):
+            await self._pace()
+            try:
+                await self.bot.send_message(
+                    chat_id=user_id,
+                    text=reminder_text(subscription_until, now),
+                    reply_markup=get_renew_keyboard(get_catalog().get(self.renew_product))
+                )
+                return True
+            except TelegramRetryAfter as e:
+                metrics.inc("reminders.retry_after")
+                logger.warning("Bot API просит подождать %s с перед напоминаниями", e.retry_after)
+                self._next_send = time.monotonic() + e.retry_after
+            except (TelegramBadRequest, TelegramForbiddenError) as e:
+                # Пользователь заблокировал бота или удалил аккаунт
+                metrics.inc("reminders.undeliverable")
+                logger.debug("Напоминание пользователю %s не доставлено: %s", user_id, e)
+                return False
+        metrics.inc("reminders.failed")
+        return False
+
+    async def run_window(self, days: int, start: datetime, end: datetime, now: datetime) -> int:
+        """Напоминания за days дней подпискам, заканчивающимся в (start, end]"""
+        sent = 0
+        after: Optional[tuple] = None
+        while True:
+            rows = await self.database.get_due_reminders(days, start, end, after, self.batch_size)
+            if not rows:
+                return sent
+            await self.database.mark_reminders_sent(days, rows)
+            delivered = 0
+            for user_id, subscription_until in rows:
+                if await self.send(user_id, subscription_until, now):
+                    delivered += 1
+            metrics.inc(f"reminders.sent.{days}d", delivered)
+            sent += delivered
+            if len(rows) < self.batch_size:
+                return sent
+            after = rows[-1]
+
+    async def run_once(self) -> Dict[int, int]:
+        """Один проход по всем окнам; возвращает число доставленных по окнам"""
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        results = {}
+        for index, days in enumerate(self.windows):
+            lower = self.windows[index + 1] if index + 1 < len(self.windows) else 0
+            results[days] = await self.run_window(
+                days, now + timedelta(days=lower), now + timedelta(days=days), now
+            )
+        # Записи по закончившимся подпискам больше не нужны
+        await self.database.purge_reminders(now - timedelta(days=1))
+        metrics.observe("reminders.run_seconds", time.perf_counter() - started)
+        if any(results.values()):
+            logger.info("Отправлены напоминания о продлении: %s", results)
+        return results
+
+async def renewal_reminders_task(bot: Bot, database, interval_minutes: int = REMINDER_INTERVAL_MINUTES):
+    """Периодическая отправка напоминаний о продлении (фоновая задача лидера)"""
+    reminders = RenewalReminders(bot, database)
+    while True:
+        try:
+            await reminders.run_once()
+        except Exception as e:
+            logger.error("Ошибка при отправке напоминаний о продлении: %s", e)
+        await asyncio.sleep(interval_minutes * 60)
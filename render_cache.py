@@ -0,0 +1,113 @@
+import logging
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+from aiogram import Bot
+from aiogram.client.default import Default
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import (
+    DeleteMessage, EditMessageReplyMarkup, EditMessageText, Response, SendMessage, TelegramMethod
+)
+from aiogram.methods.base import TelegramType
+from aiogram.types import Message
+from config import RENDER_CACHE_SIZE
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MessageKey = Tuple[Any, int]
+
+def _resolve(bot: Bot, value: Any) -> Any:
+    # Значения по умолчанию (Default) берутся из настроек бота
+    if isinstance(value, Default):
+        return getattr(bot.default, value.name, None)
+    return value
+
+def _dump(value: Any) -> Any:
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return tuple(_dump(item) for item in value)
+    if hasattr(value, "model_dump_json"):
+        return value.model_dump_json(exclude_none=True)
+    return value
+
+def render_fingerprint(bot: Bot, method: Any) -> int:
+    """Отпечаток отображаемого содержимого сообщения: текст, разметка и клавиатура"""
+    return hash((
+        method.text,
+        _resolve(bot, method.parse_mode),
+        _dump(method.entities),
+        _dump(_resolve(bot, method.link_preview_options)),
+        _resolve(bot, method.disable_web_page_preview),
+        _dump(method.reply_markup),
+    ))
+
+class RenderCacheMiddleware(BaseRequestMiddleware):
+    """Пропуск EditMessageText, если сообщение уже выглядит так же.
+
+    Для последних max_size сообщений хранится отпечаток текста и клавиатуры,
+    с которыми они были отправлены или отредактированы. Повторное
+    редактирование тем же содержимым не отправляется в Bot API (которое
+    ответило бы ошибкой "message is not modified"), а сразу возвращает True.
+    """
+
+    def __init__(self, max_size: int = RENDER_CACHE_SIZE):
+        self.max_size = max_size
+        self.skipped = 0
+        self.sent = 0
+        self._fingerprints: "OrderedDict[MessageKey, int]" = OrderedDict()
+
+    def _remember(self, key: MessageKey, fingerprint: int):
+        self._fingerprints[key] = fingerprint
+        self._fingerprints.move_to_end(key)
+        while len(self._fingerprints) > self.max_size:
+            self._fingerprints.popitem(last=False)
+
+    def forget(self, chat_id: Any, message_id: int):
+        """Удаление отпечатка (сообщение изменено в обход кэша)"""
+        self._fingerprints.pop((chat_id, message_id), None)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if isinstance(method, EditMessageText) and method.message_id is not None:
+            key = (method.chat_id, method.message_id)
+            fingerprint = render_fingerprint(bot, method)
+            if self._fingerprints.get(key) == fingerprint:
+                self._fingerprints.move_to_end(key)
+                self.skipped += 1
+                metrics.inc("render_cache.skipped")
+                return True
+
+            self.forget(*key)
+            self.sent += 1
+            metrics.inc("render_cache.sent")
+            try:
+                result = await make_request(bot, method)
+            except TelegramBadRequest as e:
+                # Сообщение уже имеет это содержимое (например, после перезапуска)
+                if "message is not modified" in str(e):
+                    self._remember(key, fingerprint)
+                raise
+            self._remember(key, fingerprint)
+            return result
+
+        if isinstance(method, SendMessage):
+            result = await make_request(bot, method)
+            if isinstance(result, Message):
+                self._remember((method.chat_id, result.message_id), render_fingerprint(bot, method))
+            return result
+
+        if isinstance(method, (EditMessageReplyMarkup, DeleteMessage)) and method.message_id is not None:
+            self.forget(method.chat_id, method.message_id)
+        return await make_request(bot, method)
+
+def setup_render_cache(bot: Bot, middleware: Optional[RenderCacheMiddleware] = None) -> RenderCacheMiddleware:
+    """Подключение кэша отпечатков к сессии бота"""
+    middleware = middleware or RenderCacheMiddleware()
+    bot.session.middleware(middleware)
+    return middleware
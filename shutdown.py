@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Tuple
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Шаг остановки: имя (для метрик и лога) и функция, возвращающая корутину
+ShutdownStep = Tuple[str, Callable[[], Awaitable[Any]]]
+
+class InFlightTracker(BaseMiddleware):
+    """Учет обновлений, обработка которых еще идет.
+
+    aiogram выполняет каждое обновление в отдельной задаче и после
+    остановки поллинга их не ждет. Трекер запоминает эти задачи, чтобы
+    при остановке дождаться начатых обработчиков (drain) до закрытия
+    сессии бота и базы.
+    """
+
+    def __init__(self):
+        self._tasks: set = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self._tasks.discard(task)
+            if not self._tasks:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> int:
+        """Ожидание начатых обработчиков не дольше timeout секунд.
+
+        Не успевшие завершиться обработчики отменяются; возвращает их число.
+        """
+        if self._tasks:
+            logger.info("Ожидание обработчиков: %d", len(self._tasks))
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        pending = list(self._tasks)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            metrics.inc("shutdown.cancelled_handlers", len(pending))
+            logger.warning("Обработчики не завершились за %s с и отменены: %d", timeout, len(pending))
+        return len(pending)
+
+def setup_drain(dp: Dispatcher) -> InFlightTracker:
+    """Подключение учета обрабатываемых обновлений"""
+    tracker = InFlightTracker()
+    dp.update.outer_middleware(tracker)
+    return tracker
+
+async def shut_down(steps: Iterable[ShutdownStep]) -> dict:
+    """Последовательное выполнение шагов остановки с замером времени.
+
+    Ошибка шага пишется в лог и не мешает следующим: база и сессия бота
+    закрываются, даже если не удалось, например, освободить аренду.
+    Возвращает длительность каждого шага в секундах.
+    """
+    started = time.perf_counter()
+    phases = {}
+    for name, step in steps:
+        step_started = time.perf_counter()
+        try:
+            await step()
+        except Exception as e:
+            metrics.inc(f"shutdown.failed.{name}")
+            logger.error("Ошибка на шаге остановки %s: %s", name, e)
+        phases[name] = time.perf_counter() - step_started
+        metrics.set_gauge(f"shutdown.{name}_seconds", phases[name])
+
+    total = time.perf_counter() - started
+    metrics.set_gauge("shutdown.seconds", total)
+    logger.info(
+        "Остановка завершена за %.2f с: %s",
+        total, ", ".join(f"{name} {seconds * 1000:.0f} мс" for name, seconds in phases.items())
+    )
+    return phases
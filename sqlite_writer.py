@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+from config import SQLITE_WRITER_WINDOW_MS, SQLITE_WRITER_MAX_BATCH, SQLITE_WRITER_QUEUE_SIZE
+from metrics import metrics
+from query_accounting import detach_query_stats
+
+logger = logging.getLogger(__name__)
+
+# Задача записи: получает сессию, изменяет данные и не фиксирует транзакцию
+WriteJob = Callable[[Any], Awaitable[Any]]
+
+class SQLiteWriter:
+    """Единственный писатель SQLite.
+
+    SQLite допускает одну пишущую транзакцию на всю базу: одновременные
+    записи из пула соединений ждут блокировку и под нагрузкой получают
+    "database is locked". Писатель выполняет задачи записи из очереди на
+    одном выделенном соединении: задачи, пришедшие в течение window
+    секунд (не больше max_batch), выполняются одной транзакцией, каждая
+    в своей точке сохранения (SAVEPOINT). Ошибка задачи (например,
+    IntegrityError повторного платежа) откатывает только ее и передается
+    вызвавшему, остальные задачи пачки фиксируются. Чтение идет через
+    обычный пул соединений и писателя не ждет (WAL).
+
+    Писатель сериализует записи одного процесса. В многопроцессном режиме
+    (WORKER_PROCESSES > 1) у каждого процесса свой писатель, и между
+    процессами запись по-прежнему ждет блокировку файла базы.
+    """
+
+    def __init__(self, session_factory: Callable[[], Any],
+                 window: float = SQLITE_WRITER_WINDOW_MS / 1000,
+                 max_batch: int = SQLITE_WRITER_MAX_BATCH,
+                 queue_size: int = SQLITE_WRITER_QUEUE_SIZE):
+        self.session_factory = session_factory
+        self.window = window
+        self.max_batch = max_batch
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def submit(self, job: WriteJob) -> Any:
+        """Выполнение задачи записи; возвращает ее результат после фиксации транзакции"""
+        if self._closed:
+            raise RuntimeError("Писатель SQLite остановлен")
+        if self._task is None or self._task.done():
+            # Очередь создается в цикле событий, в котором работает писатель
+            if self._queue is None:
+                self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.create_task(self._run(), name="sqlite_writer")
+        future = asyncio.get_running_loop().create_future()
+        # При переполненной очереди вызывающий ждет (обратное давление)
+        await self._queue.put((job, future, time.perf_counter()))
+        return await future
+
+    async def _next_batch(self) -> List[Tuple[WriteJob, asyncio.Future, float]]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        detach_query_stats()
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._execute(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _execute(self, batch: List[Tuple[WriteJob, asyncio.Future, float]]):
+        started = time.perf_counter()
+        outcomes = []
+        try:
+            async with self.session_factory() as session:
+                async with session.begin():
+                    for job, future, _ in batch:
+                        if future.done():
+                            # Вызывающий перестал ждать (отмена) - задача не выполняется
+                            outcomes.append(None)
+                            continue
+                        try:
+                            # Изменения задачи сбрасываются при выходе из точки
+                            # сохранения: ошибка ограничения возникает там же
+                            async with session.begin_nested():
+                                value = await job(session)
+                            outcomes.append((True, value))
+                        except Exception as e:
+                            outcomes.append((False, e))
+                        finally:
+                            # Объекты задачи отвязываются от сессии: откат точки
+                            # сохранения следующей задачи их не сбросит
+                            session.expunge_all()
+        except Exception as e:
+            # Транзакция пачки не зафиксирована: ошибку получают все задачи
+            metrics.inc("sqlite_writer.failed_batches")
+            logger.error("Ошибка транзакции писателя SQLite (%d задач): %s", len(batch), e)
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        finished = time.perf_counter()
+        metrics.observe("sqlite_writer.batch_size", len(batch))
+        metrics.observe("sqlite_writer.transaction_seconds", finished - started)
+        for (_, future, queued_at), outcome in zip(batch, outcomes):
+            if outcome is None or future.done():
+                continue
+            metrics.observe("sqlite_writer.wait_seconds", finished - queued_at)
+            ok, value = outcome
+            if ok:
+                future.set_result(value)
+            else:
+                metrics.inc("sqlite_writer.failed_jobs")
+                future.set_exception(value)
+
+    async def close(self):
+        """Выполнение поставленных задач и остановка писателя"""
+        self._closed = True
+        if self._task is None:
+            return
+        if not self._task.done():
+            await self._queue.join()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
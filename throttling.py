@@ -0,0 +1,147 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from aiogram import BaseMiddleware, Dispatcher, types
+from config import THROTTLE_RULES, THROTTLE_IDLE_TTL_SECONDS, THROTTLE_MAX_TRACKED
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Классы обработчиков по префиксу callback_data (проверяются по порядку)
+DEFAULT_CALLBACK_CLASSES: Tuple[Tuple[str, str], ...] = (
+    ("buy_", "purchase"),
+    ("admin_", "admin"),
+    ("", "navigation"),
+)
+
+def parse_rules(rules: str) -> Dict[str, Tuple[float, float]]:
+    """Разбор правил вида 'navigation=2/6,purchase=0.2/3' (токенов в секунду / емкость)"""
+    parsed = {}
+    for item in rules.split(","):
+        if not item.strip():
+            continue
+        name, _, limits = item.partition("=")
+        rate, _, burst = limits.partition("/")
+        parsed[name.strip()] = (float(rate), float(burst or rate))
+    return parsed
+
+class TokenBucket:
+    """Корзина токенов одного пользователя для одного класса обработчиков"""
+
+    __slots__ = ("tokens", "updated_at", "notified")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated_at = now
+        self.notified = False
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Ограничение частоты запросов пользователя до вызова обработчиков.
+
+    Корзины хранятся в OrderedDict в порядке последнего обращения: на
+    каждом вызове из начала удаляются корзины, простаивающие дольше
+    idle_ttl, поэтому память пропорциональна числу активных пользователей.
+    """
+
+    def __init__(self, rules: Optional[Dict[str, Tuple[float, float]]] = None,
+                 callback_classes: Tuple[Tuple[str, str], ...] = DEFAULT_CALLBACK_CLASSES,
+                 idle_ttl: float = THROTTLE_IDLE_TTL_SECONDS,
+                 max_tracked: int = THROTTLE_MAX_TRACKED,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rules = rules if rules is not None else parse_rules(THROTTLE_RULES)
+        self.callback_classes = callback_classes
+        self.idle_ttl = idle_ttl
+        self.max_tracked = max_tracked
+        self.clock = clock
+        self.dropped: Dict[str, int] = {}
+        self._buckets: "OrderedDict[Tuple[int, str], TokenBucket]" = OrderedDict()
+
+    def classify(self, event: types.TelegramObject) -> Optional[str]:
+        """Класс обработчика для события (None - без ограничений)"""
+        if isinstance(event, types.CallbackQuery):
+            data = event.data or ""
+            for prefix, name in self.callback_classes:
+                if data.startswith(prefix):
+                    return name
+            return None
+        if isinstance(event, types.Message):
+            # Платежи никогда не отбрасываются
+            if event.successful_payment:
+                return None
+            return "command" if event.text and event.text.startswith("/") else "message"
+        return None
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        while buckets:
+            key, bucket = next(iter(buckets.items()))
+            if now - bucket.updated_at < self.idle_ttl and len(buckets) <= self.max_tracked:
+                break
+            del buckets[key]
+
+    def allow(self, user_id: int, name: str) -> Tuple[bool, Optional[TokenBucket]]:
+        """Списание токена; возвращает (разрешено, корзина)"""
+        rule = self.rules.get(name) or self.rules.get("default")
+        if rule is None:
+            return True, None
+        rate, burst = rule
+        now = self.clock()
+        key = (user_id, name)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(burst, now)
+        else:
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated_at) * rate)
+            bucket.updated_at = now
+            self._buckets.move_to_end(key)
+        self._evict(now)
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.notified = False
+            return True, bucket
+        return False, bucket
+
+    @property
+    def tracked(self) -> int:
+        """Количество отслеживаемых корзин"""
+        return len(self._buckets)
+
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: types.TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        name = self.classify(event)
+        if user is None or name is None:
+            return await handler(event, data)
+
+        allowed, bucket = self.allow(user.id, name)
+        if allowed:
+            return await handler(event, data)
+
+        self.dropped[name] = self.dropped.get(name, 0) + 1
+        metrics.inc(f"throttling.dropped.{name}")
+        metrics.set_gauge("throttling.tracked_buckets", len(self._buckets))
+
+        # Текст получает только первый отброшенный запрос, остальные схлопываются;
+        # на каждый отброшенный callback нужен ответ, иначе у кнопки крутится индикатор
+        notify = not bucket.notified
+        bucket.notified = True
+        if isinstance(event, types.CallbackQuery):
+            try:
+                await event.answer("⏳ Слишком много запросов, подождите немного" if notify else None)
+            except Exception as e:
+                logger.debug(f"Не удалось ответить на отброшенный callback: {e}")
+        return None
+
+def setup_throttling(dp: Dispatcher, middleware: Optional[ThrottlingMiddleware] = None) -> ThrottlingMiddleware:
+    """Подключение ограничения частоты к сообщениям и callback-запросам"""
+    middleware = middleware or ThrottlingMiddleware()
+    dp.message.outer_middleware(middleware)
+    dp.callback_query.outer_middleware(middleware)
+    return middleware
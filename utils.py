@@ -270,13 +270,36 @@ def export_users_to_csv(users: List[Any]) -> str:
             user.username or '',
             user.first_name or '',
             user.last_name or '',
-            format_datetime(user.registration_date, 'full'),
+            format_datetime(user.created_at, 'full'),
             'Да' if user.is_premium_active else 'Нет',
             format_datetime(user.premium_until, 'full') if user.premium_until else ''
         ])
     
     return output.getvalue()
 
+# Колонки выгрузки покупок (общие для export_purchases_to_csv и exporter.py)
+PURCHASE_CSV_HEADER = [
+    'ID покупки',
+    'Telegram ID пользователя',
+    'ID товара',
+    'Название товара',
+    'Сумма (звезды)',
+    'Дата покупки',
+    'ID платежа Telegram'
+]
+
+def purchase_csv_row(purchase: Any) -> list:
+    """Строка CSV для одной покупки"""
+    return [
+        purchase.id,
+        purchase.user_id,
+        purchase.product_id,
+        purchase.product_title,
+        purchase.amount,
+        format_datetime(purchase.created_at, 'full'),
+        purchase.telegram_payment_charge_id
+    ]
+
 def export_purchases_to_csv(purchases: List[Any]) -> str:
     """
     Экспортирует покупки в CSV формат
@@ -290,34 +313,19 @@ def export_purchases_to_csv(purchases: List[Any]) -> str:
     output = StringIO()
     writer = csv.writer(output)
     
-    # Заголовки
-    writer.writerow([
-        'ID покупки',
-        'Telegram ID пользователя',
-        'ID товара',
-        'Название товара',
-        'Сумма (звезды)',
-        'Дата покупки',
-        'ID платежа Telegram'
-    ])
-    
-    # Данные покупок
+    writer.writerow(PURCHASE_CSV_HEADER)
     for purchase in purchases:
-        writer.writerow([
-            purchase.id,
-            purchase.user_id,
-            purchase.product_id,
-            purchase.product_title,
-            purchase.amount,
-            format_datetime(purchase.purchase_date, 'full'),
-            purchase.telegram_payment_charge_id
-        ])
+        writer.writerow(purchase_csv_row(purchase))
     
     return output.getvalue()
 
 def calculate_statistics(users: List[Any], purchases: List[Any]) -> Dict[str, Any]:
     """
-    Вычисляет статистику по пользователям и покупкам
+    Вычисляет статистику по пользователям и покупкам в памяти
+    
+    Подходит только для небольших списков: для статистики по всей базе
+    используйте analytics.StatisticsService, который считает тот же отчет
+    агрегатными запросами.
     
     Args:
         users: Список пользователей
@@ -326,7 +334,7 @@ def calculate_statistics(users: List[Any], purchases: List[Any]) -> Dict[str, An
     Returns:
         Словарь со статистикой
     """
-    now = datetime.now()
+    now = datetime.utcnow()
     
     # Статистика пользователей
     total_users = len(users)
@@ -336,7 +344,7 @@ def calculate_statistics(users: List[Any], purchases: List[Any]) -> Dict[str, An
     week_ago = now - timedelta(days=7)
     new_users_week = sum(
         1 for user in users 
-        if user.registration_date and user.registration_date >= week_ago
+        if user.created_at and user.created_at >= week_ago
     )
     
     # Статистика покупок
@@ -346,7 +354,7 @@ def calculate_statistics(users: List[Any], purchases: List[Any]) -> Dict[str, An
     # Покупки за последние 7 дней
     purchases_week = [
         purchase for purchase in purchases
-        if purchase.purchase_date and purchase.purchase_date >= week_ago
+        if purchase.created_at and purchase.created_at >= week_ago
     ]
     revenue_week = sum(purchase.amount for purchase in purchases_week)
     
@@ -434,7 +442,8 @@ def log_user_action(user_id: int, action: str, details: str = ""):
         action: Тип действия
         details: Дополнительные детали
     """
-    logger.info(f"User {user_id} performed action: {action}. Details: {details}")
+    logger.info("User %s performed action: %s. Details: %s", user_id, action, details,
+                extra={"user_id": user_id})
 
 def log_payment(user_id: int, product_id: str, amount: int, charge_id: str):
     """
@@ -447,8 +456,9 @@ def log_payment(user_id: int, product_id: str, amount: int, charge_id: str):
         charge_id: ID платежа
     """
     logger.info(
-        f"Payment processed: User {user_id}, Product {product_id}, "
-        f"Amount {amount} stars, Charge ID {charge_id}"
+        "Payment processed: User %s, Product %s, Amount %s stars, Charge ID %s",
+        user_id, product_id, amount, charge_id,
+        extra={"user_id": user_id}
     )
 
 def log_error(error: Exception, context: str = ""):
@@ -459,7 +469,7 @@ def log_error(error: Exception, context: str = ""):
         error: Объект исключения
         context: Контекст ошибки
     """
-    logger.error(f"Error in {context}: {str(error)}", exc_info=True)
+    logger.error("Error in %s: %s", context, error, exc_info=True)
 
 def create_backup_filename() -> str:
     """
@@ -529,6 +539,27 @@ def escape_markdown(text: str) -> str:
     
     return text
 
+def escape_legacy_markdown(text: str) -> str:
+    """
+    Экранирует пользовательский текст для parse_mode="Markdown"
+    
+    В устаревшем Markdown экранируются только _, *, ` и [, остальные
+    символы с обратной косой чертой выводятся как есть.
+    
+    Args:
+        text: Исходный текст
+    
+    Returns:
+        Экранированный текст
+    """
+    if not text:
+        return ""
+    
+    for char in ['_', '*', '`', '[']:
+        text = text.replace(char, f'\\{char}')
+    
+    return text
+
 # Константы для форматирования
 EMOJI_SUCCESS = "✅"
 EMOJI_ERROR = "❌"
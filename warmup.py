@@ -0,0 +1,60 @@
+import logging
+import time
+from typing import Callable, Iterable
+from metrics import metrics
+from query_accounting import count_queries
+
+logger = logging.getLogger(__name__)
+
+async def _timed(name: str, phases: dict, coro):
+    started = time.perf_counter()
+    result = await coro
+    elapsed = time.perf_counter() - started
+    phases[name] = elapsed
+    metrics.set_gauge(f"startup.warmup.{name}_seconds", elapsed)
+    return result
+
+# Непустой префикс поиска, который не совпадет с реальными пользователями:
+# пустой search_users отсекает до запроса к базе
+WARMUP_SEARCH_PREFIX = "zzzz_warmup"
+
+async def _compile_hot_statements(database) -> int:
+    """Выполнение горячих запросов с заведомо пустым результатом.
+
+    Первое выполнение каждого запроса компилирует SQL и кладет его
+    в кэш движка, поэтому первые пользователи не платят за компиляцию.
+    Возвращает число выполненных запросов.
+    """
+    with count_queries() as stats:
+        await database.get_user(0)
+        await database.get_user_by_username("@")
+        await database.get_user_purchases(0)
+        # Поиск по username ('@...') и по всем полям - разные запросы
+        await database.search_users(f"@{WARMUP_SEARCH_PREFIX}", limit=1)
+        await database.search_users(WARMUP_SEARCH_PREFIX, limit=1)
+    metrics.set_gauge("startup.warmup.statements", stats.queries)
+    return stats.queries
+
+async def _preload(preload: Iterable[Callable]):
+    for loader in preload:
+        loader()
+
+async def warm_up(bot, database, preload: Iterable[Callable] = ()) -> dict:
+    """Прогрев перед началом приема обновлений.
+
+    Открывает пул соединений с базой, компилирует горячие запросы,
+    строит кэшируемые клавиатуры и проверяет доступность Bot API.
+    Возвращает длительность каждой фазы в секундах.
+    """
+    phases = {}
+    await _timed("database_pool", phases, database.ping())
+    await _timed("statements", phases, _compile_hot_statements(database))
+    await _timed("caches", phases, _preload(preload))
+    # Ошибка сети или неверный токен прерывают запуск до начала поллинга
+    me = await _timed("bot_api", phases, bot.me())
+
+    logger.info(
+        f"Прогрев завершен для @{me.username}: "
+        + ", ".join(f"{name} {seconds * 1000:.0f} мс" for name, seconds in phases.items())
+    )
+    return phases
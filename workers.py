@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import multiprocessing
+import queue as queue_module
+import signal
+import threading
+from contextlib import suppress
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from aiogram import Bot, Dispatcher
+from aiogram.methods import GetUpdates
+from aiogram.types import Update
+from config import WORKER_QUEUE_SIZE, WORKER_CONCURRENCY, POLLING_TIMEOUT, SHUTDOWN_DRAIN_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Порядок подключения обработчиков в процессе-воркере: возвращает (bot, dp)
+WorkerSetup = Callable[[], Tuple[Bot, Dispatcher]]
+
+# Наибольшая пачка обновлений, передаваемая из потока чтения в цикл событий
+READ_BATCH_SIZE = 100
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """Получение ID пользователя-инициатора из сырого обновления"""
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        sender = value.get("from") or value.get("user")
+        if sender:
+            return sender.get("id")
+        chat = value.get("chat")
+        if chat:
+            return chat.get("id")
+    return None
+
+def shard_for(update: Dict[str, Any], workers: int) -> int:
+    """Номер воркера для обновления.
+
+    Все обновления одного пользователя попадают в один воркер, поэтому
+    их порядок сохраняется. Обновления без пользователя распределяются
+    по update_id.
+    """
+    user_id = update_user_id(update)
+    key = user_id if user_id is not None else update.get("update_id", 0)
+    return key % workers
+
+def _default_setup() -> Tuple[Bot, Dispatcher]:
+    """Подключение обработчиков бота в процессе-воркере"""
+    from bot import create_app
+
+    return create_app()
+
+class OrderedUpdateRunner:
+    """Конкурентная обработка обновлений с сохранением порядка для каждого пользователя"""
+
+    def __init__(self, concurrency: int = WORKER_CONCURRENCY, max_pending: int = WORKER_QUEUE_SIZE):
+        # Одновременно выполняющиеся обработки
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # Принятые обработки, включая ждущие предыдущего обновления пользователя
+        self._pending = asyncio.Semaphore(max_pending)
+        self._tails: Dict[int, asyncio.Task] = {}
+        self._tasks: set = set()
+
+    async def submit(self, key: int, handler: Callable[[], Any]):
+        """Постановка обработки в очередь пользователя key"""
+        await self._pending.acquire()
+        previous = self._tails.get(key)
+
+        async def run():
+            try:
+                if previous is not None:
+                    await asyncio.wait([previous])
+                # Слот берется после предыдущего обновления пользователя: ждущие
+                # своей очереди обновления одного пользователя не занимают
+                # слоты остальных
+                async with self._semaphore:
+                    await handler()
+            except Exception as e:
+                logger.error(f"Ошибка обработки обновления в воркере: {e}")
+            finally:
+                self._pending.release()
+
+        task = asyncio.create_task(run())
+        self._tails[key] = task
+        self._tasks.add(task)
+
+        def cleanup(finished: asyncio.Task):
+            self._tasks.discard(finished)
+            if self._tails.get(key) is finished:
+                del self._tails[key]
+
+        task.add_done_callback(cleanup)
+
+    async def drain(self, timeout: Optional[float] = None) -> int:
+        """Ожидание завершения начатых обработок.
+
+        С timeout не успевшие за это время обработки отменяются; возвращает их число.
+        """
+        if not self._tasks:
+            return 0
+        _, pending = await asyncio.wait(list(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning("Обработки не завершились за %s с и отменены: %d", timeout, len(pending))
+        return len(pending)
+
+def _read_updates(updates: multiprocessing.Queue, loop: asyncio.AbstractEventLoop,
+                  inbox: asyncio.Queue, batch_size: int = READ_BATCH_SIZE):
+    """Поток чтения очереди воркера.
+
+    Блокирующий get выполняется в собственном потоке, а не в общем пуле
+    run_in_executor, которым пользуются база и экспорт. Все, что уже
+    лежит в очереди, забирается без ожидания, и пачка передается в цикл
+    событий за один переход между потоками. Поток ждет, пока цикл примет
+    пачку, поэтому заполненная очередь процесса по-прежнему
+    притормаживает прием обновлений.
+    """
+    while True:
+        batch = [updates.get()]
+        while batch[-1] is not None and len(batch) < batch_size:
+            try:
+                batch.append(updates.get_nowait())
+            except queue_module.Empty:
+                break
+        asyncio.run_coroutine_threadsafe(inbox.put(batch), loop).result()
+        if batch[-1] is None:
+            return
+
+async def _worker_loop(index: int, updates: multiprocessing.Queue, setup: WorkerSetup) -> int:
+    bot, dp = setup()
+    runner = OrderedUpdateRunner()
+    loop = asyncio.get_running_loop()
+    processed = 0
+    # Пачка в обработке и не больше одной следующей
+    inbox: asyncio.Queue = asyncio.Queue(maxsize=1)
+    # Поток-демон не мешает выходу процесса, если цикл завершился с ошибкой
+    threading.Thread(
+        target=_read_updates, args=(updates, loop, inbox),
+        name=f"starsbot-worker-{index}-reader", daemon=True
+    ).start()
+
+    # У воркера свои снимок каталога и кэш списка запрета оплаты
+    from catalog import reload_catalog, catalog_refresh_task
+    from checkout import denylist
+    from database import db
+    try:
+        await reload_catalog(db)
+    except Exception as e:
+        logger.error("Воркер %s: каталог не загружен, используются подписки по умолчанию: %s", index, e)
+    background = [
+        asyncio.create_task(catalog_refresh_task(db)),
+        asyncio.create_task(denylist.run(db)),
+    ]
+
+    logger.info(f"Воркер {index} запущен")
+    try:
+        stopping = False
+        while not stopping:
+            for raw in await inbox.get():
+                if raw is None:
+                    stopping = True
+                    break
+                key = update_user_id(raw) or raw.get("update_id", 0)
+                update = Update.model_validate(raw, context={"bot": bot})
+                await runner.submit(key, lambda update=update: dp.feed_update(bot, update))
+                processed += 1
+        await runner.drain(SHUTDOWN_DRAIN_SECONDS)
+    finally:
+        for task in background:
+            task.cancel()
+        # Рассылки, запущенные в воркере, сохраняют прогресс до закрытия базы
+        from broadcast import stop_broadcasts
+        await stop_broadcasts()
+        await bot.session.close()
+        with suppress(Exception):
+            from events import bus
+            await bus.close()
+            await db.close()
+        logger.info(f"Воркер {index} остановлен, обработано обновлений: {processed}")
+    return processed
+
+def worker_main(index: int, updates: multiprocessing.Queue,
+                results: Optional[multiprocessing.Queue] = None,
+                setup: WorkerSetup = _default_setup):
+    """Точка входа процесса-воркера.
+
+    Каждый воркер импортирует модули бота заново, поэтому у него свой
+    экземпляр Bot и свой пул соединений с базой данных.
+    """
+    from logging_setup import setup_logging, stop_logging
+
+    setup_logging()
+    # Остановкой управляет процесс приема обновлений
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    processed = asyncio.run(_worker_loop(index, updates, setup))
+    if results is not None:
+        results.put((index, processed))
+    stop_logging()
+
+class WorkerPool:
+    """Пул процессов-воркеров с шардированием обновлений по ID пользователя"""
+
+    def __init__(self, workers: int, setup: WorkerSetup = _default_setup,
+                 queue_size: int = WORKER_QUEUE_SIZE, collect_results: bool = False):
+        self.workers = workers
+        self._context = multiprocessing.get_context("spawn")
+        self._queues: List[multiprocessing.Queue] = [
+            self._context.Queue(maxsize=queue_size) for _ in range(workers)
+        ]
+        self.results = self._context.Queue() if collect_results else None
+        self._processes = [
+            self._context.Process(
+                target=worker_main,
+                args=(index, self._queues[index], self.results, setup),
+                name=f"starsbot-worker-{index}",
+                daemon=False
+            )
+            for index in range(workers)
+        ]
+
+    def start(self):
+        for process in self._processes:
+            process.start()
+        logger.info(f"Запущено процессов-воркеров: {self.workers}")
+
+    async def dispatch(self, update: Dict[str, Any]):
+        """Передача сырого обновления воркеру (с ожиданием при переполнении очереди)"""
+        target = self._queues[shard_for(update, self.workers)]
+        try:
+            target.put_nowait(update)
+        except queue_module.Full:
+            await asyncio.get_running_loop().run_in_executor(None, target.put, update)
+
+    async def stop(self, timeout: float = 30.0):
+        """Остановка воркеров после обработки уже принятых обновлений"""
+        loop = asyncio.get_running_loop()
+        for target in self._queues:
+            await loop.run_in_executor(None, target.put, None)
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.warning(f"Воркер {process.name} не завершился вовремя, принудительная остановка")
+                process.terminate()
+
+async def run_ingestion(bot: Bot, dp: Dispatcher, workers: int):
+    """Прием обновлений поллингом и распределение их по процессам-воркерам"""
+    pool = WorkerPool(workers)
+    pool.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    allowed_updates = dp.resolve_used_update_types()
+    offset = None
+    backoff = 1.0
+    logger.info(f"Прием обновлений для {workers} воркеров")
+    try:
+        while not stop.is_set():
+            get_updates = asyncio.create_task(bot(GetUpdates(
+                offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates
+            )))
+            stopping = asyncio.create_task(stop.wait())
+            done, _ = await asyncio.wait({get_updates, stopping}, return_when=asyncio.FIRST_COMPLETED)
+            if get_updates not in done:
+                get_updates.cancel()
+                break
+            stopping.cancel()
+
+            try:
+                updates = get_updates.result()
+            except Exception as e:
+                logger.error(f"Ошибка получения обновлений: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60.0)
+                continue
+            backoff = 1.0
+
+            for update in updates:
+                await pool.dispatch(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+                offset = update.update_id + 1
+    finally:
+        await pool.stop()